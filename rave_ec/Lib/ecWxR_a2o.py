@@ -28,6 +28,9 @@ along with RAVE.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys, os, glob, string, traceback, datetime, mimetypes
 import gzip
+import shutil
+import cStringIO
+import functools
 import _iris2odim
 import ec_nexrad
 import ec_mcgill
@@ -51,17 +54,45 @@ if not os.path.isdir(TMPPATH):
 rave_tempfile.tempfile.tempdir = TMPPATH
 rave_tempfile.RAVETEMP = TMPPATH
 
+# Decompressed files are written here, in RAM where available, for readers that need a path
+if os.path.isdir('/dev/shm'): SHMPATH = '/dev/shm'
+else: SHMPATH = TMPPATH
+
 IGNORE = []  # Already done
 
 
-def gunzip(fstr):
-    payload = gzip.open(fstr).read()
-    path, fstr = os.path.split(fstr)
-    fstr = os.path.join(TMPPATH, fstr[:-3])
-    fd = open(fstr, 'w')
-    fd.write(payload)
+## Decompresses a gzipped file into memory
+# @param string input file name
+# @returns file-like object containing the decompressed payload
+def gunzipBuffer(fstr):
+    fd = gzip.open(fstr)
+    payload = fd.read()
     fd.close()
-    return fstr
+    return cStringIO.StringIO(payload)
+
+
+## Decompresses a gzipped file to a file, for readers that need a path.
+#  Falls back to TMPPATH if it can't be written to the given directory, e.g. if RAM is full.
+# @param string input file name
+# @param string directory to write the decompressed file to
+# @returns string name of the decompressed file
+def gunzip(fstr, path=SHMPATH):
+    ifstr, fstr = fstr, os.path.split(fstr)[1][:-3]
+    for opath in (path, TMPPATH):
+        ofstr = os.path.join(opath, fstr)
+        ifd = gzip.open(ifstr)
+        try:
+            fd = open(ofstr, 'wb')
+            try:
+                shutil.copyfileobj(ifd, fd)
+            finally:
+                fd.close()
+            return ofstr
+        except IOError:
+            if os.path.isfile(ofstr): os.remove(ofstr)
+        finally:
+            ifd.close()
+    raise IOError, "Failed to write %s to %s or %s" % (fstr, path, TMPPATH)
 
 
 ## Use this only with Canadian CONVOL file strings to find matching DOPVOL file strings
@@ -125,31 +156,32 @@ def makeCanadianPETScan(flist):
     import ecWxR_precipet, ecWxR_meta
     from Proj import dr
 
-    # First run PRECIP-ET
-    meta_fstr = flist[0] + ".meta"  # Same file string with new extension
-    if not ecWxR_precipet.precipET(flist[0], flist[1], meta_fstr):
+    # First run PRECIP-ET, writing to RAM where available
+    meta_fstr = os.path.join(SHMPATH, os.path.split(flist[0])[1] + ".meta")  # Same file name with new extension
+    try:
+        if not ecWxR_precipet.precipET(flist[0], flist[1], meta_fstr):
+            raise IOError, "ecWxR_precipet.precipET failed on %s" % flist[0]
+
+        # Second, read the result and merge with lowest CONVOL sweep
+        pet_scan = ecWxR_meta.readMeta2Scan(meta_fstr)
+        rio = _iris2odim.readIRIS(flist[0])
+        convol = rio.object
+        beamw = convol.getAttribute('how/beamwH') * dr
+        checkDT(convol)  # Sanity check on date/time
+        convol.sortByElevations(1)
+        convol_scan = convol.getScan(0).clone()
+        ecWxR_precipet.mergePET(convol_scan, pet_scan)  # Will cast an IOError if it fails
+
+        convol_scan.beamwidth = beamw
+        convol.beamwidth = beamw
+
+        while convol.getNumberOfScans():
+            convol.removeScan(0)
+        convol.addScan(convol_scan)
+
+        rio.object = convol  # Now contains DBZH from PRECIP-ET
+    finally:
         if os.path.isfile(meta_fstr): os.remove(meta_fstr)
-        raise IOError, "ecWxR_precipet.precipET failed on %s" % flist[0]
-
-    # Second, read the result and merge with lowest CONVOL sweep
-    pet_scan = ecWxR_meta.readMeta2Scan(meta_fstr)
-    rio = _iris2odim.readIRIS(flist[0])
-    convol = rio.object
-    beamw = convol.getAttribute('how/beamwH') * dr
-    checkDT(convol)  # Sanity check on date/time
-    convol.sortByElevations(1)
-    convol_scan = convol.getScan(0).clone()
-    ecWxR_precipet.mergePET(convol_scan, pet_scan)  # Will cast an IOError if it fails
-
-    convol_scan.beamwidth = beamw
-    convol.beamwidth = beamw
-
-    while convol.getNumberOfScans():
-        convol.removeScan(0)
-    convol.addScan(convol_scan)
-
-    rio.object = convol  # Now contains DBZH from PRECIP-ET
-    if os.path.isfile(meta_fstr): os.remove(meta_fstr)
 
     return rio
 
@@ -157,25 +189,32 @@ def makeCanadianPETScan(flist):
 ## Converts to ODIM_H5. If Canadian IRIS files, perform dopvol-clutter filtering.
 # @param fstrs list containing one Level II or McGill file, or several IRIS files
 # @param trim boolean, whether to trim NEXRAD data (True) or not.
+# @param azimuth_reducer string, one of ec_nexrad.AZIMUTH_REDUCERS to aggregate NEXRAD
+# super-resolution sweeps to 1 degree, or None to keep them
+# @param merge_split_cuts boolean, whether to read the surveillance and Doppler cuts of
+# NEXRAD split cuts as one scan (True) or not.
 # @returns integer return code
-def generate(flist, trim=True):
+def generate(flist, trim=True, azimuth_reducer=None, merge_split_cuts=False):
+    tmpfiles = []  # Decompressed files to clean up
     try:
 
 #        # Skip NEXRAD, K for CONUS, P for Alaska
 #        if os.path.split(flist[0])[1][0] in ('K', 'P'):
 #            return flist[0], "Skipped"
 
-        files = []
-        for fstr in flist:
-            if mimetypes.guess_type(fstr)[1] == 'gzip':
-                files.append(gunzip(fstr))
-            else:
-                files.append(fstr)
-
-        path, fstr = os.path.split(files[0])
+        gzipped = [mimetypes.guess_type(fstr)[1] == 'gzip' for fstr in flist]
+        path, fstr = os.path.split(flist[0])
 
         # Is Canadian? Starts with digits, whereas NEXRAD LII files start with letters
         if fstr[0] in string.digits:
+            # IRIS and PRECIP-ET need paths, so gzipped files are decompressed to SHMPATH
+            files = []
+            for fstr, gz in zip(flist, gzipped):
+                if gz:
+                    fstr = gunzip(fstr)
+                    tmpfiles.append(fstr)
+                files.append(fstr)
+
             # Is IRIS?
             if _iris2odim.isIRIS(files[0]):
                 rio = makeCanadianPETScan(files)
@@ -186,9 +225,33 @@ def generate(flist, trim=True):
                 rio = _raveio.new()
                 rio.object = ec_mcgill.file2pvol(files[0])  # Should only be one file
 
-        # Else is Level II
+        # Else is Level II, which is read from memory
         else:
-            rio = ec_nexrad.readLevelII(files[0])
+            if gzipped[0]: l2file = gunzipBuffer(flist[0])
+            else: l2file = flist[0]
+
+            if trim:
+                # Only decode what the trimmer keeps
+                kwargs = {'quantities' : ecWxR_trimRange.PARAMS,
+                          'max_range_km' : ecWxR_trimRange.MAXR}
+            else:
+                kwargs = {}
+
+            # Written one scan at a time where h5py is available, under a temporary
+            # name until the quantities in the file, and so its name, are known
+            if ec_nexrad.h5py is not None:
+                tmpfstr = os.path.join(TMPPATH, "%s.h5" % fstr)
+                tmpfiles.append(tmpfstr)
+                rio, quants = ec_nexrad.writeLevelII(l2file, tmpfstr, azimuth_reducer=azimuth_reducer,
+                                                     merge_split_cuts=merge_split_cuts,
+                                                     unique_elangles=trim, **kwargs)
+                ofstr = ec_filesys.MakePolarFileName(rio, root=OUTPATH, makepath=True, Round=True,
+                                                     quants=quants)
+                shutil.move(tmpfstr, ofstr)
+                return ofstr, "OK"
+
+            rio = ec_nexrad.readLevelII(l2file, azimuth_reducer=azimuth_reducer,
+                                        merge_split_cuts=merge_split_cuts, **kwargs)
             if trim:
                 rio = ecWxR_trimRange.generate("bobbe", RIO=rio)  # dummy file string because it doesn't exist yet
 
@@ -197,31 +260,33 @@ def generate(flist, trim=True):
         ofstr = ec_filesys.MakePolarFileName(rio, root=OUTPATH, makepath=True, Round=True)
         rio.save(ofstr)
 
-        # Clean up tmp directory
-        for fstr in files:
-            if os.path.split(fstr)[0] == TMPPATH: os.remove(fstr)
-
     except Exception, e:
-        # Clean up tmp directory
-        for fstr in files:
-            if os.path.split(fstr)[0] == TMPPATH: os.remove(fstr)
         return flist, traceback.format_exc()
 
+    finally:
+        # Clean up decompressed files
+        for fstr in tmpfiles:
+            if os.path.isfile(fstr): os.remove(fstr)
+
     return ofstr, "OK"
 
 
 ## Multiprocesses the generate function
 # @param list of input file string lists, each list being one or more files
 # @param trim boolean, whether to trim NEXRAD data (True) or not.
+# @param azimuth_reducer string, passed to generate
+# @param merge_split_cuts boolean, passed to generate
 # @returns list of two-tuples containing output file names and return status
-def multi_generate(file_lists, trim=False):
+def multi_generate(file_lists, trim=True, azimuth_reducer=None, merge_split_cuts=False):
     if multiprocessing.cpu_count() == 16:
         pool = multiprocessing.Pool(16)  # Joule
     else:
         pool = multiprocessing.Pool(36)  # Everything else
 
     results = []
-    r = pool.map_async(generate, file_lists, chunksize=1, callback=results.append)
+    func = functools.partial(generate, trim=trim, azimuth_reducer=azimuth_reducer,
+                             merge_split_cuts=merge_split_cuts)
+    r = pool.map_async(func, file_lists, chunksize=1, callback=results.append)
     r.wait()
 
     pool.terminate()  # Being explicit
@@ -238,7 +303,10 @@ def multi_generate(file_lists, trim=False):
 # @param logging.logger object, optional
 # @param list or None containing any of 'C' (Canada), 'K' (conus), and 'P' (Alaska)
 # @param boolean, whether to trim NEXRAD data (True) or not.
-def main(datepath, multiprocess=True, logger=None, IGNORE=None, trim=False):
+# @param string, one of ec_nexrad.AZIMUTH_REDUCERS to aggregate NEXRAD super-resolution sweeps, or None
+# @param boolean, whether to merge the cuts of NEXRAD split cuts (True) or not.
+def main(datepath, multiprocess=True, logger=None, IGNORE=None, trim=True,
+         azimuth_reducer=None, merge_split_cuts=False):
         if os.path.isdir(datepath):
             FILE_LISTS = []
             #print datepath
@@ -284,7 +352,7 @@ def main(datepath, multiprocess=True, logger=None, IGNORE=None, trim=False):
             if multiprocess:
                 print "About to process %i files under %s" % (len(FILE_LISTS), datepath)
                 if len(FILE_LISTS) > 0:
-                    results = multi_generate(FILE_LISTS, trim)
+                    results = multi_generate(FILE_LISTS, trim, azimuth_reducer, merge_split_cuts)
                     if logger:
                         logger.log(ecWxR_log.LOGLEVEL, "%i files in %s. Exceptions follow:" % (len(FILE_LISTS), datepath))
                         for result in results:
@@ -293,7 +361,7 @@ def main(datepath, multiprocess=True, logger=None, IGNORE=None, trim=False):
             else:
                 # Sequential processing
                 for l in FILE_LISTS:
-                    ofstr, status = generate(l)
+                    ofstr, status = generate(l, trim, azimuth_reducer, merge_split_cuts)
                     print ofstr, status
         else:
             print "%s is not a directory, or just ignoring ..." % datepath
@@ -313,7 +381,7 @@ def getDirListing(fstr):
 if __name__ == "__main__":
     from optparse import OptionParser
 
-    usage = "usage: %prog [-i <input dir> -f [file name] -I [ignore] -t [trim] -L [log file] -s [sequential processing]] [h]"
+    usage = "usage: %prog [-i <input dir> -f [file name] -I [ignore] -t [trim] -a [azimuth reducer] -m [merge split cuts] -L [log file] -s [sequential processing]] [h]"
 
     parser = OptionParser(usage=usage)
 
@@ -327,7 +395,15 @@ if __name__ == "__main__":
                       help='List of radar types to ignore. Can be either of C (Canada), K (conus), and P (Alaska), e.g. "C,K"')
 
     parser.add_option("-t", "--trim", dest="trim", action="store_true",
-                      help='Trims the maximum range of NEXRAD data, according to presets in ecWxR_trimRange')
+                      default=True,
+                      help='Trims the maximum range of NEXRAD data, according to presets in ecWxR_trimRange. Defaults to True.')
+
+    parser.add_option("-a", "--azimuth_reducer", dest="azimuth_reducer",
+                      choices=ec_nexrad.AZIMUTH_REDUCERS,
+                      help='Aggregates NEXRAD super-resolution sweeps to 1 degree using one of: %s' % ", ".join(ec_nexrad.AZIMUTH_REDUCERS))
+
+    parser.add_option("-m", "--merge_split_cuts", dest="merge_split_cuts", action="store_true",
+                      help='Reads the surveillance and Doppler cuts of each NEXRAD split cut as one scan')
 
     parser.add_option("-L", "--logfile", dest="lfile",
                       default=LOGFILE,
@@ -348,15 +424,16 @@ if __name__ == "__main__":
         IGNORE = options.ignore.split(',')
         if len(IGNORE) == 0: IGNORE = None
 
-    if not options.trim:
-        options.trim = False
+    merge_split_cuts = bool(options.merge_split_cuts)
 
     if options.in_dir:
         if os.path.isdir(options.in_dir):
             if options.seq:
-                main(options.in_dir, False, logger, IGNORE, options.trim)
+                main(options.in_dir, False, logger, IGNORE, options.trim,
+                     options.azimuth_reducer, merge_split_cuts)
             else:
-                main(options.in_dir, True, logger, IGNORE, options.trim)
+                main(options.in_dir, True, logger, IGNORE, options.trim,
+                     options.azimuth_reducer, merge_split_cuts)
         else:
             print "Invalid input directory: %s" % options.in_dir
                 
@@ -367,9 +444,11 @@ if __name__ == "__main__":
 
             for path in paths:
                 if options.seq:
-                    main(path, False, logger, IGNORE, options.trim)
+                    main(path, False, logger, IGNORE, options.trim,
+                         options.azimuth_reducer, merge_split_cuts)
                 else:
-                    main(path, True, logger, IGNORE, options.trim)
+                    main(path, True, logger, IGNORE, options.trim,
+                         options.azimuth_reducer, merge_split_cuts)
         else:
             print "Invalid input file: %s" % options.dlf
 
@@ -26,7 +26,7 @@ along with RAVE.  If not, see <http://www.gnu.org/licenses/>.
 # @author Daniel Michelson, Environment and Climate Change Canada
 # @date 2017-04-25
 
-import sys, os
+import sys, os, mmap
 import _raveio, _polarscan, _polarscanparam
 import numpy as np
 from Proj import dr
@@ -34,6 +34,13 @@ from Proj import dr
 GAIN, OFFSET = 0.5, -32.0     # defaults from IRIS and URP
 UNDETECT, NODATA = 0.0, 255.0
 
+# Header keys of the bin length, in km, last on its line, and of the nominal date and
+# time, YYYYMMDD HHmm[SS]. These have not been confirmed against a real META header.
+# Without them, readMetaHeader returns rscale None, and the date and time from the
+# file name, see dateTimeFromName.
+RSCALE_KEY = "RangeResolution"
+DATETIME_KEY = "ValidityDate"
+
 
 def readHeader(ALL):
     header = {}
@@ -47,34 +54,99 @@ def readHeader(ALL):
     return header
 
 
+## Memory-maps a META file, read-only
+#  @param string input file name
+#  @returns mmap object, which the caller should close
+def mapMeta(filename):
+    fd = open(filename, 'rb')
+    try:
+        return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        fd.close()  # The map keeps its own file descriptor
+
+
+## Reads the date and time from the name of a URP file, which starts with YYYYMMDDHHmm
+#  @param string file name
+#  @returns tuple containing the date and time strings, YYYYMMDD and HHmmss, or Nones
+def dateTimeFromName(filename):
+    fstr = os.path.split(filename)[1]
+    if len(fstr) >= 12 and fstr[:12].isdigit():
+        return fstr[:8], fstr[8:12] + "00"
+    return None, None
+
+
+## Reads the scan geometry, date and time from the header of a META file
+#  @param mmap or string containing the META file
+#  @returns dictionary containing 'nrays', 'nbins', 'elangle', 'longitude' and 'latitude'
+#  in degrees, 'height' in m, 'rscale' in m, the 'date' and 'time' strings, YYYYMMDD and
+#  HHmmss, and the number of data 'bytes' at the end of the file. 'rscale', 'date' and 'time'
+#  are None when the header lacks them.
+def getMetaInfo(ALL):
+    end = ALL.find("\nTableLabels")
+    if end < 0: end = len(ALL)
+    header = readHeader(ALL[:end])
+
+    start = ALL.find("SizeInBytes")
+    if start < 0:
+        raise IOError, "No SizeInBytes in META header"
+    end = ALL.find("\n", start)
+    if end < 0: end = len(ALL)
+
+    rscale, date, time = None, None, None
+    if header.get(RSCALE_KEY):
+        rscale = float(header[RSCALE_KEY][-1]) * 1000.0
+    if header.get(DATETIME_KEY):
+        stamp = "".join(header[DATETIME_KEY]).strip()
+        if stamp.isdigit() and len(stamp) >= 12:
+            date, time = stamp[:8], stamp[8:14].ljust(6, "0")
+
+    return {"nrays" : int(header["Theta"][0]),
+            "nbins" : int(header["Range"][0]),
+            "elangle" : float(header["PPIAngle"][-1]),
+            "longitude" : float(header["LonCentre"][0]),
+            "latitude" : float(header["LatCentre"][0]),
+            "height" : float(header["GroundHeight"][0]) + float(header["HornHeight"][0]),
+            "rscale" : rscale,
+            "date" : date,
+            "time" : time,
+            "bytes" : int(ALL[start:end].split(" ")[1])}
+
+
+## Reads only the header of a META file, without touching its data. The date and time are
+#  taken from the file name when the header lacks them.
+#  @param string input file name
+#  @returns dictionary, see getMetaInfo
+def readMetaHeader(filename):
+    ALL = mapMeta(filename)
+    try:
+        info = getMetaInfo(ALL)
+    finally:
+        ALL.close()
+    if info["date"] is None:
+        info["date"], info["time"] = dateTimeFromName(filename)
+    return info
+
+
 def readMeta2Scan(filename):
-    fd = open(filename)
-    ALL = fd.read()
+    ALL = mapMeta(filename)
+    try:
+        info = getMetaInfo(ALL)
+        BYTES = info["bytes"]
+
+        # View of the data at the end of the map. It is copied once, by numpy.where
+        data = np.frombuffer(ALL, np.uint8, BYTES, len(ALL) - BYTES)
+        data = np.reshape(data, (info["nrays"], info["nbins"]))
+        data = np.where(np.equal(data, 1), 0, data)  # should be nodata but instead going with undetect
+    finally:
+        ALL.close()
 
     scan = _polarscan.new()
     param = _polarscanparam.new()
 
-    header = readHeader(ALL)
-    nrays = int(header["Theta"][0])
-    nbins = int(header["Range"][0])
-    elangle = float(header["PPIAngle"][-1])
-    longitude = float(header["LonCentre"][0])
-    latitude = float(header["LatCentre"][0])
-    height = float(header["GroundHeight"][0]) + float(header["HornHeight"][0])
-
-    fd.seek(ALL.index("SizeInBytes"))
-    line = fd.readline()
-    BYTES = int(line.split(" ")[1])
-
-    data = np.reshape(np.fromstring(ALL[-BYTES:], np.uint8), (nrays,nbins))
-    data = np.where(np.equal(data, 1), 0, data)  # should be nodata but instead going with undetect
-
-    fd.close()
-
-    scan.elangle = elangle * dr
-    scan.height = height
-    scan.longitude = longitude * dr
-    scan.latitude = latitude * dr
+    scan.elangle = info["elangle"] * dr
+    scan.height = info["height"]
+    scan.longitude = info["longitude"] * dr
+    scan.latitude = info["latitude"] * dr
 
     param.gain, param.offset = GAIN, OFFSET
     param.undetect, param.nodata = UNDETECT, NODATA
@@ -86,6 +158,5 @@ def readMeta2Scan(filename):
     return scan
 
 
-
 if __name__=="__main__":
     pass
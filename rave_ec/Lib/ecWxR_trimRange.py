@@ -34,6 +34,8 @@ import _polarscan, _polarscanparam
 import numpy as np
 from Proj import rd
 
+MAXR = 250  # km
+PARAMS = ['DBZH','TH','ZDR','RHOHV','VRADH']
 
 ## Convenience function for copying scan attributes
 # @param input PolarScan object
@@ -70,8 +72,8 @@ def copyScanAttrs(scan, newscan):
 # @param string format string for new output files
 # @param RaveIO object of the input PVOL
 # @returns string of the (new) output file, or output RaveIO object
-def generate(fstr, maxr=250, overwrite=False, write=True, 
-             PARAMS=['DBZH','TH','ZDR','RHOHV','VRADH'], 
+def generate(fstr, maxr=MAXR, overwrite=False, write=True, 
+             PARAMS=PARAMS, 
              iqual='_qc_', oqual='_qc%i_', RIO=None):
     if RIO: rio = RIO
     else: rio = _raveio.open(fstr)
@@ -79,11 +81,12 @@ def generate(fstr, maxr=250, overwrite=False, write=True,
 
     scanlist, elangles = [], []
 
-    # Save scans to list
+    # Save scans to list. They are removed from the volume below, so they can
+    # be modified without being cloned first.
     for i in range(pvol.getNumberOfScans()):
         scan = pvol.getScan(i)
         if scan.elangle not in elangles:
-            scanlist.append(scan.clone())
+            scanlist.append(scan)
             elangles.append(scan.elangle)
     # Remove all scans
     for i in range(pvol.getNumberOfScans()):
@@ -6,11 +6,16 @@
 import sys
 from collections import OrderedDict
 import os
+import re
 import warnings
 
 import numpy as np
 import ec_RB_util as util
 
+END_XML_MARKER = "<!-- END XML -->"
+BLOB_TAG = re.compile(r'<BLOB\s([^>]*)>')
+BLOB_ATTRIBUTE = re.compile(r'(\w+)="([^"]*)"')
+
 def find_key(key, dictionary):
     """Searches for given key in given (nested) dictionary.
 
@@ -145,7 +150,65 @@ def get_RB_blob_attribute(blobdict, attr):
     return value
 
 
-def get_RB_blob_data(datastring, blobid):
+def get_RB_blob_tag(match):
+    """Get the attributes of a BLOB tag found with BLOB_TAG
+
+    Parameters
+    ----------
+    match : re.MatchObject
+        Match of the BLOB tag
+
+    Returns
+    -------
+    blobid : int
+        Number of the blob
+
+    entry : tuple
+        (offset, size, compression) of the blob data
+
+    """
+    attrs = dict(BLOB_ATTRIBUTE.findall(match.group(1)))
+    try:
+        blobid, size = int(attrs['blobid']), int(attrs['size'])
+    except KeyError:
+        raise KeyError('Attribute @blobid or @size is missing from Blob at offset %d. '
+                       'There may be some problems with your file' % match.start())
+    offset = match.end() + 1  # data follow the newline after the tag
+
+    return blobid, (offset, size, attrs.get('compression'))
+
+
+def get_RB_blob_index(datastring, start=0):
+    """Index all BLOBs in datastring in one pass
+
+    The search for the next BLOB tag continues after the end of the data of the
+    previous one, so the data themselves are never searched.
+
+    Parameters
+    ----------
+    datastring : string
+        File contents
+
+    start : int
+        Offset to start searching from, e.g. the end of the XML header
+
+    Returns
+    -------
+    index : dict
+        (offset, size, compression) of the data of each blob, keyed by blob ID
+
+    """
+    index = {}
+    match = BLOB_TAG.search(datastring, start)
+    while match:
+        blobid, entry = get_RB_blob_tag(match)
+        index[blobid] = entry
+        match = BLOB_TAG.search(datastring, entry[0] + entry[1])
+
+    return index
+
+
+def get_RB_blob_data(datastring, blobid, index=None):
     """ Read BLOB data from datastring and return it
 
     Parameters
@@ -156,30 +219,25 @@ def get_RB_blob_data(datastring, blobid):
     blobid : int
         Number of requested blob
 
+    index : dict
+        Blob index from get_RB_blob_index. If None, the blob is searched for.
+
     Returns
     -------
     data : string
         Content of blob
 
     """
-    xmltodict = util.import_optional('xmltodict')
-
-    start = 0
-    if sys.version_info[1] == 6:
-        searchString = r'<BLOB blobid="{0}"'.format(blobid)
-    else:
-        searchString = r'<BLOB blobid="{}"'.format(blobid)
-    start = datastring.find(searchString, start)
-    if start == -1:
-        raise EOFError('Blob ID {} not found!'.format(blobid))
-    end = datastring.find('>', start)
-    xmlstring = datastring[start:end + 1]
-
-    # cheat the xml parser by making xml well-known
-    xmldict = xmltodict.parse(xmlstring + '</BLOB>')
-    cmpr = get_RB_blob_attribute(xmldict, 'compression')
-    size = int(get_RB_blob_attribute(xmldict, 'size'))
-    data = datastring[end + 2:end + 2 + size]  # read blob data to string
+    if index is None:
+        start = datastring.find(r'<BLOB blobid="{0}"'.format(blobid))
+        if start == -1:
+            raise EOFError('Blob ID {0} not found!'.format(blobid))
+        index = dict([get_RB_blob_tag(BLOB_TAG.match(datastring, start))])
+    try:
+        offset, size, cmpr = index[blobid]
+    except KeyError:
+        raise EOFError('Blob ID {0} not found!'.format(blobid))
+    data = datastring[offset:offset + size]  # read blob data to string
 
     # decompress if necessary
     # the first 4 bytes are neglected for an unknown reason
@@ -214,7 +272,7 @@ def map_RB_data(data, datadepth):
     return data
 
 
-def get_RB_blob_from_string(datastring, blobdict):
+def get_RB_blob_from_string(datastring, blobdict, index=None):
     """
     Read BLOB data from datastring and return it as numpy array with correct
     dataWidth and shape
@@ -227,6 +285,9 @@ def get_RB_blob_from_string(datastring, blobdict):
     blobdict : dict
         Blob Dict
 
+    index : dict
+        Blob index from get_RB_blob_index, or None
+
     Returns
     -------
     data : numpy array
@@ -235,7 +296,7 @@ def get_RB_blob_from_string(datastring, blobdict):
     """
 
     blobid = get_RB_data_attribute(blobdict, 'blobid')
-    data = get_RB_blob_data(datastring, blobid)
+    data = get_RB_blob_data(datastring, blobid, index)
 
     # map data to correct datatype and width
     datadepth = get_RB_data_attribute(blobdict, 'depth')
@@ -330,8 +391,9 @@ def get_RB_blobs_from_file(filename, rbdict):
     blobs = list(find_key('@blobid', rbdict))
 
     datastring = get_RB_file_as_string(filename)
+    index = get_RB_blob_index(datastring, max(datastring.find(END_XML_MARKER), 0))
     for blob in blobs:
-        data = get_RB_blob_from_string(datastring, blob)
+        data = get_RB_blob_from_string(datastring, blob, index)
         blob['data'] = data
 
     return rbdict
@@ -358,10 +420,9 @@ def get_RB_header(filename):
         raise IOError
 
     # load the header lines, i.e. the XML part
-    endXMLmarker = "<!-- END XML -->"
     header = ""
     line = ""
-    while not line.startswith(endXMLmarker):
+    while not line.startswith(END_XML_MARKER):
         header += line[:-1]
         line = fid.readline()
         if len(line) == 0:
@@ -373,6 +434,122 @@ def get_RB_header(filename):
     return xmltodict.parse(header)
 
 
+def split_RB_header(datastring):
+    """Split Rainbow file contents into the XML header and the BLOB part
+
+    Parameters
+    ----------
+    datastring : string
+        File contents
+
+    Returns
+    -------
+    header : string
+        XML header, with the newlines removed like get_RB_header does
+
+    start : int
+        Offset of the end of the header, where the BLOBs begin
+
+    """
+    if datastring.startswith(END_XML_MARKER):
+        start = 0
+    else:
+        start = datastring.find('\n' + END_XML_MARKER) + 1
+        if start == 0:
+            start = len(datastring)
+    lines = datastring[:start].split('\n')
+    header = ''.join(lines[:-1]) + lines[-1][:-1]
+
+    return header, start
+
+
+class RainbowFile(object):
+    """Rainbow file read once, with an index of its BLOBs
+
+    The file is read into memory once, its XML header is parsed and all BLOBs
+    are indexed in a single pass, see get_RB_blob_index. Blob data are then
+    decompressed by direct access at their offsets, on request only.
+
+    Parameters
+    ----------
+    filename : string
+        Filename of Data File
+
+    Attributes
+    ----------
+    filename : string
+        Filename of Data File
+
+    header : dict
+        Rainbow File Contents without the data, as returned by get_RB_header
+
+    blobs : dict
+        (offset, size, compression) of each blob, keyed by blob ID
+
+    slices : list
+        Dictionaries of the slices in the header, in order
+
+    rawdata : list
+        Dictionaries of the rawdata of each slice, with the 'slice' index, the
+        data 'type', the 'blobid' and the 'blobdict' describing the blob
+
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.datastring = get_RB_file_as_string(filename)
+        header, start = split_RB_header(self.datastring)
+        self.blobs = get_RB_blob_index(self.datastring, start)
+
+        xmltodict = util.import_optional('xmltodict')
+        self.header = xmltodict.parse(header)
+
+        self.slices = []
+        if 'volume' in self.header:
+            scan = self.header['volume'].get('scan') or {}
+            self.slices = scan.get('slice') or []
+            if isinstance(self.slices, dict):
+                self.slices = [self.slices]
+
+        self.rawdata = []
+        for i, sl in enumerate(self.slices):
+            rawdata = (sl.get('slicedata') or {}).get('rawdata') or []
+            if isinstance(rawdata, dict):
+                rawdata = [rawdata]
+            for blobdict in rawdata:
+                self.rawdata.append({'slice': i, 'type': blobdict.get('@type'),
+                                     'blobid': get_RB_data_attribute(blobdict, 'blobid'),
+                                     'blobdict': blobdict})
+
+    def get_blob_data(self, blobid):
+        """Decompressed content of blob `blobid`, see get_RB_blob_data"""
+        return get_RB_blob_data(self.datastring, blobid, self.blobs)
+
+    def get_blob(self, blobdict):
+        """Content of the blob described by `blobdict` as numpy array, see
+        get_RB_blob_from_string"""
+        return get_RB_blob_from_string(self.datastring, blobdict, self.blobs)
+
+    def load_blobs(self, blobs=None):
+        """Add the content of blobs to their dictionaries in the header
+
+        Parameters
+        ----------
+        blobs : list
+            Blob Dicts to load. If None, all blobs found in the header.
+
+        Returns
+        -------
+        header : dict
+            Rainbow File Contents
+        """
+        if blobs is None:
+            blobs = list(find_key('@blobid', self.header))
+        for blob in blobs:
+            blob['data'] = self.get_blob(blob)
+
+        return self.header
+
+
 def read_Rainbow(filename, loaddata=True):
     """"Reads Rainbow files files according to their structure
 
@@ -394,12 +571,10 @@ def read_Rainbow(filename, loaddata=True):
               original rainbow file structure
     """
 
-    rbdict = get_RB_header(filename)
+    if not loaddata:
+        return get_RB_header(filename)
 
-    if loaddata:
-        rbdict = get_RB_blobs_from_file(filename, rbdict)
-
-    return rbdict
+    return RainbowFile(filename).load_blobs()
 
 if __name__ == '__main__':
     print 'wradlib: Calling module <io> as main...'
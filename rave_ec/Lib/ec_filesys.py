@@ -202,12 +202,14 @@ def MakeProductFileName(s, prefix='dbzh'):
 
 ## Make a hex signature for the given polar payload, either a SCAN or a PVOL
 # @param RaveIOCore object
+# @param list of the quantities in the payload, or None to find them in it
 # @returns hex string representing the quantitities found in the payload 
-def makeHexQuant(rio):
-    if rio.objectType == _raveio.Rave_ObjectType_SCAN:
-        quants = rave_hexquant.qFromScan(rio.object)
-    elif rio.objectType == _raveio.Rave_ObjectType_PVOL:
-        quants = rave_hexquant.qFromPvol(rio.object)
+def makeHexQuant(rio, quants=None):
+    if quants is None:
+        if rio.objectType == _raveio.Rave_ObjectType_SCAN:
+            quants = rave_hexquant.qFromScan(rio.object)
+        elif rio.objectType == _raveio.Rave_ObjectType_PVOL:
+            quants = rave_hexquant.qFromPvol(rio.object)
     return rave_hexquant.q2hex(quants)
 
 
@@ -227,8 +229,10 @@ def RoundDT(DATE, TIME):
 ## Creates a file name with complete path for a polar SCAN or PVOL
 # @param RaveIOCore object
 # @param boolean, whether to make the path if it doesn't already exist
+# @param list of the quantities in the payload, or None to find them in it, e.g. when
+# rio holds only the top-level attributes of a volume written by ec_nexrad.writeLevelII
 # @returns string full path and file name
-def MakePolarFileName(rio, root=ECROOT, makepath=False, Round=False):
+def MakePolarFileName(rio, root=ECROOT, makepath=False, Round=False, quants=None):
     global ECDATA
     ECDATA = root
     s = odim_source.ODIM_Source(rio.object.source)
@@ -267,7 +271,7 @@ def MakePolarFileName(rio, root=ECROOT, makepath=False, Round=False):
         elif rio.objectType == _raveio.Rave_ObjectType_PVOL:
             fstr = '%s_pvol' % fstr
 
-    hexq = makeHexQuant(rio)
+    hexq = makeHexQuant(rio, quants)
 
 #    fstr = '%s_%sT%sZ.h5' % (fstr, DATE, TIME[:-2]) # Time the script is run.
 #    fstr = '%s_%sT%s%sZ_%s.h5' % (fstr, DATE, TIME[:2], path.split("/")[-2], hexq)
@@ -38,9 +38,12 @@ RECORD_LENGTH = 2048
 SEGMENT_LENGTH = 19
 SEGMENTS = 107
 NRAYS = 360
+NBINS = 120+(60*2)+(60*4)  # 1 km gates of each ray, as expanded by makeScans
+DATA_SLOTS = 30  # Data segment types, 1 to 30
 SCANT = 10  # Time in seconds to acquire a sweep.
 QUANTITIES = {1 : "DBZH", 4 : "VRADH", 16 : "ZDR", 17 : "PHIDP",
               18 : "RHOHV", 19 : "KDP"}  # Only 1 and 4 are available
+BIN_MAPS = {}  # Segment to gate index maps, keyed by number of gates, see getBinMap
 
 # esteps are the times in seconds between tilts in the ascending scan strategy
 # These are real times from an acquisition in April 2012. They are used to 
@@ -59,6 +62,76 @@ class McGill(object):
         pass
 
 
+## Volume header fields, in file order: name, type and number of values, where None
+# stands for one value per elevation. Fields without a name are skipped.
+HEADER_FIELDS = (("", uint8, 46*2),
+                 ("number_Logical_Records", int16, 1),
+                 ("", uint8, 3*2),
+                 ("Volume_Scan_Format", int16, 1),
+                 ("", uint8, 5*2),
+                 ("hours", int32, 1),
+                 ("minutes", int32, 1),
+                 ("seconds", int32, 1),
+                 ("day", int32, 1),
+                 ("month", int32, 1),
+                 ("year", int32, 1),
+                 ("radar_Id", int32, 1),
+                 ("radar_latitude", float32, 1),
+                 ("radar_longitude", float32, 1),
+                 ("number_elevations", int32, 1),
+                 ("elevation_angles", float32, None),
+                 ("azimuth_offset", int16, 1),
+                 ("viraq_flag", uint8, 2),
+                 ("clutter_filter", uint8, 2),
+                 ("", uint8, 315*2),
+                 ("met_param", int16, 1),
+                 ("", uint8, 2),
+                 ("value_offset", float32, 1),
+                 ("cal_slope", float32, 1),
+                 ("antenna_programme", int16, 1),
+                 ("", uint8, 2*2),
+                 ("cscan_format", int16, 1),
+                 ("range_unfolded", int16, 1),
+                 ("vad_velocity_unfolded", int16, 1),
+                 ("numb_vad_unf_pts", int16, None),
+                 ("numb_range_unf_pts", int16, None),
+                 ("range_bins_array_size", int16, 1),
+                 ("", uint8, 2),
+                 ("shift_cscan_flag", int16, 1),
+                 ("shift_speed", int16, 1),
+                 ("shift_dir", int16, 1),
+                 ("", uint8, 48*4),
+                 ("vert_grad_unfolded", int16, 1),
+                 ("numb_vert_grad_unf_pts", int16, None),
+                 ("", uint8, 12),  # documentation says 2 bytes for the first of three, but it's 4
+                 ("radial_grad_unfolded", int16, 1),
+                 ("numb_radial_grad_unf_pts", int16, None),
+                 ("prf1", int16, None),
+                 ("prf2", int16, None),
+                 ("nyq_range", int16, None),
+                 ("max_range", int16, None),
+                 ("nyq_vel", float32, None),
+                 ("max_vel", float32, None),
+                 ("usable_elv", uint8, None),
+                 ("prev_sub_area_speed", int16, 9),
+                 ("prev_sub_area_dir", int16, 9))
+NELEV_OFFSET = 148  # Byte offset of number_elevations, which sizes the rest of the header
+STRING_FIELDS = ("viraq_flag", "clutter_filter")
+
+## Segment of a logical record: the segment type N, followed by the radial number
+# and 16 bins of data for data segments
+SEGMENT_DTYPE = dtype([("N", uint8), ("high", uint8), ("low", uint8), ("data", uint8, 16)])
+
+## Logical record: the record number, last record flag and elevation numbers,
+# followed by the segments
+RECORD_DTYPE = dtype({"names" : ["high", "low", "last_record",
+                                 "beginning_elevation_number", "end_elevation_number",
+                                 "segments"],
+                      "formats" : [uint8, uint8, uint8, uint8, uint8, (SEGMENT_DTYPE, SEGMENTS)],
+                      "offsets" : [0, 1, 2, 3, 4, 14],
+                      "itemsize" : RECORD_LENGTH})
+
+
 ## Is this a McGill file?
 # @param string containing the input file name
 # @returns True if the file is a McGill file, otherwise False
@@ -69,226 +142,167 @@ def isMcGill(filename):
     return s == "mcgill"
 
 
+## Structured type of the volume header, which depends on the number of elevations
+# @param int number of elevations
+# @returns numpy dtype with one field per named entry in HEADER_FIELDS
+def headerDtype(nelev):
+    names, formats, offsets, pos = [], [], [], 0
+    for name, ftype, count in HEADER_FIELDS:
+        if count is None: count = nelev
+        if count == 1: fdtype = dtype(ftype)
+        else: fdtype = dtype((ftype, (count,)))
+        if name:
+            names.append(name)
+            formats.append(fdtype)
+            offsets.append(pos)
+        pos += fdtype.itemsize
+    return dtype({"names" : names, "formats" : formats, "offsets" : offsets, "itemsize" : pos})
+
 
 ## Reads the contents of a McGill file, according to
 # http://deneb.tor.ec.gc.ca/urpdoc/reference/science/mcgill_volume_scan.html
 # Attribute naming follows this document.
 # The generic container is used to represent the contents of the file as:
-# mobj : top-level McGill() object
-# mobj.logical_records : a list of McGill objects containing one logical record each
-# mobj.logical_records[index].segments : a list of 107 McGill objects, each 
-# representing a segment
+# mobj : top-level McGill() object, with the header fields as attributes
+# mobj.logical_records : structured array of logical records, of RECORD_DTYPE,
+# whose 'segments' field is an (nrecords, 107) array of SEGMENT_DTYPE
+# mobj.segments : structured array of the documented segments (N > 0), in file order
+# mobj.data_segments : structured array of the data segments (1 <= N <= 30), each
+# preceded by an elevation segment (31 <= N <= 55). End-of-data segments (N == 63)
+# are ignored. For each data segment, the following arrays contain its:
+# mobj.bin_number : first bin (base 0), mobj.radial_number, and
+# mobj.elevation_number : elevation number of the last elevation segment before it
 # @param string input file name
 # @returns McGill object representing the file contents
 def readMcGill(filename):
     mobj = McGill()
-    fd = open(filename)
+    fd = open(filename, "rb")
+    buf = fd.read()
+    fd.close()
 
-    # Start reading header
-    fd.seek(46*2)
-    #mobj.dum0 = fd.read(46*2)
-    mobj.number_Logical_Records = int(fromstring(fd.read(2), int16))
-    fd.seek(3*2, 1)
-    #mobj.dum1 = fd.read(3*2)
-    mobj.Volume_Scan_Format = int(fromstring(fd.read(2), int16))
-    fd.seek(5*2, 1)
-    #mobj.dum2 = fd.read(2*5)
-    mobj.hours = int(fromstring(fd.read(4), int32))
-    mobj.minutes = int(fromstring(fd.read(4), int32))
-    mobj.seconds = int(fromstring(fd.read(4), int32))
-    mobj.day = int(fromstring(fd.read(4), int32))
-    mobj.month = int(fromstring(fd.read(4), int32))
-    mobj.year = int(fromstring(fd.read(4), int32))
-    mobj.radar_Id = int(fromstring(fd.read(4), int32))
-    mobj.radar_latitude = float(fromstring(fd.read(4), float32))
-    mobj.radar_longitude = float(fromstring(fd.read(4), float32))
-    mobj.number_elevations = int(fromstring(fd.read(4), int32))
-    mobj.elevation_angles = []
-    for i in range(mobj.number_elevations):
-        mobj.elevation_angles.append(float(fromstring(fd.read(4), float32)))
-    mobj.azimuth_offset = int(fromstring(fd.read(2), int16))
-    mobj.viraq_flag = fd.read(2)
-    mobj.clutter_filter = fd.read(2)
-    fd.seek(315*2, 1)
-    #mobj.dum3 = fd.read(315*2)
-    mobj.met_param = int(fromstring(fd.read(2), int16))
-    fd.seek(2 ,1)
-    #mobj.dum4 = fd.read(2)
-    mobj.value_offset = float(fromstring(fd.read(4), float32))
-    mobj.cal_slope = float(fromstring(fd.read(4), float32))
-    mobj.antenna_programme = int(fromstring(fd.read(2), int16))
-    fd.seek(4, 1)
-    #mobj.dum5 = fd.read(2)
-    #mobj.dum6 = fd.read(2)
-    mobj.cscan_format = int(fromstring(fd.read(2), int16))
-    mobj.range_unfolded = int(fromstring(fd.read(2), int16))
-    mobj.vad_velocity_unfolded = int(fromstring(fd.read(2), int16))
-    mobj.numb_vad_unf_pts = []
-    for i in range(mobj.number_elevations):
-        mobj.numb_vad_unf_pts.append(int(fromstring(fd.read(2), int16)))
-    mobj.numb_range_unf_pts = []
-    for i in range(mobj.number_elevations):
-        mobj.numb_range_unf_pts.append(int(fromstring(fd.read(2), int16)))
-    mobj.range_bins_array_size = int(fromstring(fd.read(2), int16))
-    fd.seek(2, 1)
-    #mobj.dum7 = fd.read(2)
-    mobj.shift_cscan_flag = int(fromstring(fd.read(2), int16))
-    mobj.shift_speed = int(fromstring(fd.read(2), int16))
-    mobj.shift_dir = int(fromstring(fd.read(2), int16))
-    fd.seek(48*4, 1)
-    #mobj.dum8 = fd.read(24*4)
-    #mobj.dum9 = fd.read(24*4)
-    mobj.vert_grad_unfolded = int(fromstring(fd.read(2), int16))
-    mobj.numb_vert_grad_unf_pts = []
-    for i in range(mobj.number_elevations):
-        mobj.numb_vert_grad_unf_pts.append(int(fromstring(fd.read(2), int16)))
-    fd.seek(12, 1)
-    #mobj.dum10 = fd.read(4)  # documentation says 2 bytes, but it's 4
-    #mobj.dum11 = fd.read(4)
-    #mobj.dum12 = fd.read(4)
-    mobj.radial_grad_unfolded = int(fromstring(fd.read(2), int16))
-    mobj.numb_radial_grad_unf_pts = []
-    for i in range(mobj.number_elevations):
-        mobj.numb_radial_grad_unf_pts.append(int(fromstring(fd.read(2), int16)))
-    mobj.prf1 = []
-    for i in range(mobj.number_elevations):
-        mobj.prf1.append(int(fromstring(fd.read(2), int16)))
-    mobj.prf2 = []
-    for i in range(mobj.number_elevations):
-        mobj.prf2.append(int(fromstring(fd.read(2), int16)))
-    mobj.nyq_range = []
-    for i in range(mobj.number_elevations):
-        mobj.nyq_range.append(int(fromstring(fd.read(2), int16)))
-    mobj.max_range = []
-    for i in range(mobj.number_elevations):
-        mobj.max_range.append(int(fromstring(fd.read(2), int16)))
-    mobj.nyq_vel = []
-    for i in range(mobj.number_elevations):
-        mobj.nyq_vel.append(float(fromstring(fd.read(4), float32)))
-    mobj.max_vel = []
-    for i in range(mobj.number_elevations):
-        mobj.max_vel.append(float(fromstring(fd.read(4), float32)))
-    mobj.usable_elv = []
-    for i in range(mobj.number_elevations):
-        mobj.usable_elv.append(int(fromstring(fd.read(1), uint8)))
-    mobj.prev_sub_area_speed, mobj.prev_sub_area_dir = [], []
-    for i in range(9):
-        mobj.prev_sub_area_speed.append(int(fromstring(fd.read(2), int16)))
-    for i in range(9):
-        mobj.prev_sub_area_dir.append(int(fromstring(fd.read(2), int16)))
-    #mobj.dum_pad = fd.read(1166*2)
-
-    # Start reading data, by logical record
-    mobj.logical_records = []
-
-    fd.seek(HEADER_LENGTH)
-    last_record = 0
-    while last_record == 0:
-        lr = McGill()
-        record = fd.read(RECORD_LENGTH)
-        lr.high = int(fromstring(record[0], uint8))
-        lr.low = int(fromstring(record[1], uint8))
-        lr.logical_record_number = 64 * lr.high + lr.low
-        last_record = int(fromstring(record[2], uint8))
-        lr.beginning_elevation_number = int(fromstring(record[3], uint8))
-        lr.end_elevation_number = int(fromstring(record[4], uint8))
-        lr.segstr = record[14:2047]
-        lr.segments = []
-
-        # Read SEGMENTS, each SEGMENT_LENGTH bytes long.
-        segpos = 0
-        for i in range(SEGMENTS):
-            seg = McGill()
-            this_seg = lr.segstr[segpos:segpos+SEGMENT_LENGTH]
-            seg.N = int(fromstring(this_seg[0], uint8))
-
-            # Data segment
-            if 1 <= seg.N <= 30:
-                seg.type = "data"
-                seg.high = int(fromstring(this_seg[1], uint8))
-                seg.low = int(fromstring(this_seg[2], uint8))
-                seg.bin_number = 16 * (seg.N - 1)# + 1
-                seg.radial_number = 64 * seg.high + seg.low
-                seg.data = fromstring(this_seg[3:], uint8)
-
-            # Elevation segment
-            elif 31 <= seg.N <= 55:
-                seg.type = "elevation"
-                seg.elevation_number = seg.N - 31
-                seg.elevation_angle = mobj.elevation_angles[seg.elevation_number-1]
-
-            # End-of-data segment can be ignored
-            elif seg.N == 63:
-                seg.type = "eod"
-
-            # For some reason, there are segments of type 0, which are 
-            # undocumented. Ignore these.
-            if seg.N > 0:
-                lr.segments.append(seg)
-            segpos += SEGMENT_LENGTH
-
-        mobj.logical_records.append(lr)
+    # Header, in one read
+    nelev = int(frombuffer(buf, int32, 1, NELEV_OFFSET)[0])
+    header = frombuffer(buf, headerDtype(nelev), 1)[0]
+    for name in header.dtype.names:
+        setattr(mobj, name, header[name].tolist())
+    for name in STRING_FIELDS:
+        setattr(mobj, name, header[name].tobytes())
+
+    # Logical records, up to and including the last one
+    nrecords = (len(buf) - HEADER_LENGTH) // RECORD_LENGTH
+    records = frombuffer(buf, RECORD_DTYPE, nrecords, HEADER_LENGTH)
+    last = flatnonzero(records["last_record"])
+    if len(last): records = records[:last[0]+1]
+    mobj.logical_records = records
+
+    # For some reason, there are segments of type 0, which are
+    # undocumented. Ignore these.
+    segments = records["segments"].ravel()
+    segments = segments[segments["N"] > 0]
+    mobj.segments = segments
+
+    # Classify segments. Elevation segment types always preceed data types,
+    # so each data segment belongs to the last elevation segment before it.
+    N = segments["N"].astype(int32)
+    isdata = (N >= 1) & (N <= 30)
+    iselev = (N >= 31) & (N <= 55)
+    last_elev = maximum.accumulate(where(iselev, arange(len(N)), -1))
+    isdata &= last_elev >= 0
+
+    mobj.data_segments = segments[isdata]
+    mobj.bin_number = 16 * (N[isdata] - 1)
+    mobj.radial_number = 64 * mobj.data_segments["high"].astype(int32) + mobj.data_segments["low"]
+    mobj.elevation_number = N[last_elev[isdata]] - 31
 
-    fd.close()
     return mobj
 
 
+## Expansion of the bins of one data segment to 1 km gates. The same rules as ever:
+# 1 km bins are copied, 2 km bins are repeated twice, and 4 km bins four times.
+# @param int bin_number of the segment's first bin (base 0)
+# @returns Python 2-tuple containing the first gate, and an int array with the index
+# of the segment's bin (0-15) that each gate from there on is taken from
+def expandSegment(bin_number):
+    bins = arange(16)
+
+    # Bins 112-119 are 1 km, 120-128 are 2 km, 112-135 km
+    if bin_number == 112:
+        return 112, concatenate([bins[:8], repeat(bins[8:], 2)])
+
+    # All 2 km, 136-231 km
+    elif 128 <= bin_number < 176:
+        diff = (bin_number - 128) / 16.0
+        return int(136 + 32 * diff), repeat(bins, 2)  # 16 and 32 combo makes no sense?
+
+    # Bins 176-179 are 2 km, 180-239 are 4 km, 232-287 km
+    elif bin_number == 176:
+        return 232, concatenate([repeat(bins[:4], 2), repeat(bins[4:], 4)])
+
+    # All 4 km, 288- km
+    elif 192 <= bin_number:
+        diff = (bin_number - 192) / 32.0
+        return int(288 + 64 * diff), repeat(bins, 4)  # 32 and 64 combo makes no sense?
+
+    # All 1 km, 0-111 km
+    return bin_number, bins
+
+
+## Index map from the data segments of a ray to its gates, computed once for the range
+# configuration and cached in BIN_MAPS. Where the gates of several segment types overlap,
+# each gate has one layer per segment type covering it.
+# @param int number of gates
+# @returns Python 2-tuple of int arrays of shape (layers, gates). The first contains, for
+# each gate, the segment type slot (N-1) it can be taken from, the second the index of its
+# value in the ray's (slots, 16) segment data, flattened. Gates without a (further) source
+# have slot DATA_SLOTS, an empty slot.
+def getBinMap(nbins=NBINS):
+    if nbins not in BIN_MAPS:
+        sources = [[] for g in range(nbins)]
+        for slot in range(DATA_SLOTS):
+            frombin, bins = expandSegment(16 * slot)
+            for gate, b in zip(range(frombin, frombin + len(bins)), bins):
+                if gate < nbins: sources[gate].append((slot, b))
+        layers = max([len(l) for l in sources])
+        slots = zeros((layers, nbins), int32) + DATA_SLOTS
+        index = zeros((layers, nbins), int32) + DATA_SLOTS * 16
+        for gate, l in enumerate(sources):
+            for layer, (slot, b) in enumerate(l):
+                slots[layer, gate] = slot
+                index[layer, gate] = slot * 16 + b
+        BIN_MAPS[nbins] = slots, index
+    return BIN_MAPS[nbins]
+
+
 ## Takes the output of readMcGill and creates contiguous scans of data.
-# This is done by pasting the contents of each McGill segment into the 
-# equivalent position in the corresponding contiguous scan.
+# The segments of each ray are laid out by type, then expanded to uniform
+# 1 km gates in one gather over the whole volume, with the map from getBinMap.
+# Where segments overlap, each gate takes its value from the segment that
+# comes last in the file, as if the segments were pasted into the ray in order.
 # @param McGill object representing file contents
 def makeScans(mobj):
-    mobj.scans = []
-
-    # Create empty arrays for each scan
-    for i in range(mobj.number_elevations):
-        mobj.scans.append(zeros((NRAYS, 120+(60*2)+(60*4)), uint8))
-
-    # Populate them
-    for lr in mobj.logical_records:
-        for seg in lr.segments:
-
-            # Elevation segment types always preceed data types
-            if seg.type == "elevation":
-                scan = seg.elevation_number -1
-
-            elif seg.type == "data":
-                ray = seg.radial_number - 1
-
-                # Bins 112-119 are 1 km, 120-128 are 2 km, 112-135 km
-                if seg.bin_number == 112:
-                    part1 = seg.data[:8]
-                    part2 = repeat(seg.data[8:], 2)
-                    data = concatenate([part1, part2])
-                    frombin = 112
-
-                # All 2 km, 136-231 km
-                elif 128 <= seg.bin_number < 176:
-                    data = repeat(seg.data, 2)
-                    diff = (seg.bin_number - 128) / 16.0
-                    frombin = 136 + 32 * diff  # 16 and 32 combo makes no sense?
-
-                # Bins 176-179 are 2 km, 180-239 are 4 km, 232-287 km
-                elif seg.bin_number == 176:
-                    part1 = repeat(seg.data[:4], 2)
-                    part2 = repeat(seg.data[4:], 4)
-                    data = concatenate([part1, part2])
-                    frombin = 232
-
-                # All 4 km, 288- km
-                elif 192 <= seg.bin_number:
-                    data = repeat(seg.data, 4)
-                    diff = (seg.bin_number - 192) / 32.0
-                    frombin = 288 + 64 * diff  # 32 and 64 combo makes no sense?
-
-                # All 1 km, 0-111 km
-                else:
-                    data = seg.data
-                    frombin = seg.bin_number
-
-                tobin = int(frombin) + len(data)
-
-                mobj.scans[scan][ray][frombin:tobin] = data
+    nelev = mobj.number_elevations
+    slots, index = getBinMap(NBINS)
+
+    # Segment data and file position by scan, ray and type, with an extra empty type slot
+    segdata = zeros((nelev, NRAYS, DATA_SLOTS + 1, 16), uint8)
+    order = zeros((nelev, NRAYS, DATA_SLOTS + 1), int32) - 1
+    scan = mobj.elevation_number - 1
+    ray = mobj.radial_number - 1
+    slot = mobj.bin_number // 16
+    segdata[scan, ray, slot] = mobj.data_segments["data"]
+    order[scan, ray, slot] = arange(len(slot), dtype=int32)
+    segdata = segdata.reshape(nelev, NRAYS, -1)
+
+    # Expand, overwriting with the overlapping segments that come later in the file
+    data = segdata[:, :, index[0]]
+    last = order[:, :, slots[0]]
+    for layer in range(1, len(slots)):
+        later = order[:, :, slots[layer]]
+        take = later > last
+        data[take] = segdata[:, :, index[layer]][take]
+        last[take] = later[take]
+
+    mobj.scans = list(data)
 
 
 ## McGill data times are the end of data acquisition. This function guestimates
@@ -29,8 +29,14 @@ along with RAVE.  If not, see <http://www.gnu.org/licenses/>.
 
 # Thank you Py_ART!
 import nexrad_level2
+import ec_nexrad_cache
 
+import os
 import time
+import shutil
+import tempfile
+import traceback
+import multiprocessing
 from datetime import datetime, timedelta
 import _rave
 import _raveio
@@ -39,15 +45,33 @@ import _polarscan
 import _polarscanparam
 import numpy
 from Proj import dr, rd
-from rave_defines import UTF8
+from rave_defines import UTF8, H5RAD_VERSION, ODIM_VERSION, COMPRESSION_ZLIB_LEVEL
 import odim_source
 
-MSG18_LEN = 9468  # length in bytes of Message Type 18
+# Only writeLevelII needs h5py
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+JDCONSTANT = 2440586.5  # Modifled Julian date constant, only for NEXRAD?
+MSG18_LEN = nexrad_level2.MSG18_SIZE  # length in bytes of Message Type 18
 
 QUANTITIES = {'REF':'TH', 'VEL':'VRADH', 'SW':'WRADH', 
               'ZDR':'ZDR', 'PHI':'PHIDP', 'RHO':'RHOHV'}
 QKEYS = QUANTITIES.keys()
 
+AZIMUTH_REDUCERS = ("max", "mean", "nearest")  # See reduceRays
+SUPERRES = 1  # Message Type 31 azimuth resolution code of 0.5 degree rays
+SURVEILLANCE = 1  # Message Type 5 waveform type of contiguous surveillance (CS) cuts
+DOPPLER = (2, 3)  # Message Type 5 waveform types of contiguous Doppler (CD) cuts, with and without ambiguity resolution
+
+LUTS = {}  # Raw code to RAVE value look-up tables, see getLUT
+
+# Sweep arrays are passed from readLevelIIBatch workers through files here
+if os.path.isdir('/dev/shm'): SHMPATH = '/dev/shm'
+else: SHMPATH = None  # The default temporary directory
+
 
 ##
 #  Quantity metadata convenience class for managing metadata associated 
@@ -112,15 +136,15 @@ def isNEXRAD(filename):
 #  @param l2 object containing Level II data and metadata
 #  @param scan RAVE scan object to be populated
 #  @param int index of the scan in the volume
-def populateParams(l2, scan, index=0):
-    tsi = l2.scan_info()[index]
-    az = l2.get_azimuth_angles([index])
-    start_az_index = numpy.argmin(az)
-    ray_hdr_index = l2.scan_msgs[index][start_az_index]
-    ray_hdr       = l2.msg31s[ray_hdr_index]
+#  @param meta dictionary of scan metadata from getScanMeta, or None to compute it
+def populateParams(l2, scan, index=0, meta=None):
+    if meta is None: meta = getScanMeta(l2, index)
+    tsi = meta
+    start_az_index = meta['start_az_index']
+    ray_hdr       = meta['ray_hdr']
 
     for p in tsi['moments']:
-        if p in QKEYS:
+        if p in QKEYS and (meta['quantities'] is None or QUANTITIES[p] in meta['quantities']):
             param = _polarscanparam.new()
             param.quantity = QUANTITIES[p]
             #print p, param.quantity
@@ -135,28 +159,32 @@ def populateParams(l2, scan, index=0):
             param.undetect = qmd.undetect
         
             # Do our own masking, trying to separate nodata and undetect. Don't know about "range-folded" though ...
-            data  = l2.get_data(p, tsi['ngates'][tsi['moments'].index(p)], scans=[index]).data  # 32-byte float
-            rdata = l2.get_data(p, tsi['ngates'][tsi['moments'].index(p)], scans=[index], raw_data=True)  # 8-bit uint
-            mydata = numpy.where(numpy.equal(rdata, 0), param.undetect, (data - param.offset) / param.gain).astype(qmd.dtype)
-            mydata = numpy.where(numpy.equal(rdata, 1), param.nodata, mydata).astype(qmd.dtype)
-        
-            # Sort data according to azimuth angles, starting with the lowest angle from North, assuming clockwise ...
-            if start_az_index != 0:
-                begin = mydata[start_az_index:len(az)] 
-                end = mydata[:start_az_index]
-                mydata = numpy.concatenate((begin,end))
-                
+            # The raw codes are mapped straight to RAVE values through a look-up table
+            # Gates beyond the maximum range are never decoded
+            rdata = l2.get_data(p, min(tsi['ngates'][tsi['moments'].index(p)], meta['max_ngates']), scans=[index], raw_data=True, copy=False)  # 8-bit uint
+            rscale, roffset = l2.get_moment_scaling(p, [index])
+            lut = getLUT(qmd, rscale, roffset, rdata.dtype)
+            nrays, nbins = rdata.shape
+
             # Quirk: REF has longer range, so we need to pad the other moments with nodata because RAVE assumes same polar geometry for all quantities
             # Also assumes that, if the scan does not contain REF, that there is no need for padding
-            if "REF" in tsi['moments']:
-                if p == "REF":
-                    maxbins = data.shape[1]  # Assumes that REF always comes first, and that subsequent moments will relate to it 
-                if data.shape[1] < maxbins:
-                    dbins = maxbins-data.shape[1]
-#                   padding = numpy.full((data.shape[0],dbins), qmd.nodata, qmd.dtype)  # As of numpy 1.8
-                    padding = (numpy.zeros((data.shape[0],dbins)) + qmd.nodata).astype(qmd.dtype)
-                    mydata = numpy.concatenate((mydata, padding), 1)
+            maxbins = max(nbins, meta['pad_ngates'])
+            mydata = numpy.empty((nrays, maxbins), qmd.dtype)
+            mydata[:, nbins:] = qmd.nodata
+
+            # Sort data according to azimuth angles, starting with the lowest angle from North, assuming clockwise ...
+            # Rotation, scaling and padding are all written into the same output array
+            numpy.take(lut, rdata[start_az_index:], out=mydata[:nrays-start_az_index, :nbins], mode='clip')
+            numpy.take(lut, rdata[:start_az_index], out=mydata[nrays-start_az_index:, :nbins], mode='clip')
         
+            # Aggregate gates to a coarser range resolution, if requested
+            if meta['gate_factor'] > 1:
+                mydata = reduceBins(mydata, meta['gate_factor'], "mean" if p == "REF" else "nearest", qmd)
+
+            # Aggregate super-resolution rays to 1 degree, if requested
+            if meta['reducer']:
+                mydata = reduceRays(mydata, meta['reducer'] if p == "REF" else "nearest", qmd)
+
             param.setData(mydata)
             #print scan.elangle*rd, param.quantity, param.nrays, scan.nrays, param.nbins, scan.nbins
         
@@ -164,22 +192,35 @@ def populateParams(l2, scan, index=0):
             except: pass
 
 
+## Look-up table mapping every raw Level II code of a moment to its RAVE value, including
+#  undetect (0) and nodata (1). Tables are computed once per moment scaling and cached in LUTS.
+#  @param qmd QMeta object of the moment
+#  @param rscale float32 Level II scale of the moment
+#  @param roffset float32 Level II offset of the moment
+#  @param rtype numpy dtype of the raw data, uint8 or uint16 (PHI)
+#  @returns numpy array indexed by raw code
+def getLUT(qmd, rscale, roffset, rtype):
+    key = (qmd._name, float(rscale), float(roffset), numpy.dtype(rtype).str)
+    if key not in LUTS:
+        codes = numpy.arange(numpy.iinfo(rtype).max + 1).astype(rtype)
+        lut = numpy.where(numpy.equal(codes, 0), qmd.undetect, ((codes - roffset) / rscale - qmd.offset) / qmd.gain).astype(qmd.dtype)
+        lut = numpy.where(numpy.equal(codes, 1), qmd.nodata, lut).astype(qmd.dtype)
+        LUTS[key] = lut
+    return LUTS[key]
+
+
 ## Populates a RAVE scan object with everything except the moment/quantity/parameter data
 #  @param l2 object containing Level II data and metadata
 #  @param scan an empty RAVE scan object to be populated
 #  @param int index of the scan in the volume
-def populateScan(l2, scan, index=0):
-    tsi = l2.scan_info()[index]
+#  @param meta dictionary of scan metadata from getScanMeta, or None to compute it
+def populateScan(l2, scan, index=0, meta=None):
+    if meta is None: meta = getScanMeta(l2, index)
+    tsi = meta
     nrays = tsi['nrays']
+    start_az_index = meta['start_az_index']
 
-    # Determine starting ray
-    # Assumes that azimuth angles are centred on each ray
-    az = l2.get_azimuth_angles([index])
-    el = l2.get_elevation_angles([index])
-    start_az_index = numpy.argmin(az)
-
-    ray_hdr_index = l2.scan_msgs[index][start_az_index]
-    ray_hdr       = l2.msg31s[ray_hdr_index]
+    ray_hdr       = meta['ray_hdr']
     msg31_hdr     = ray_hdr['msg31_header']
     vol_hdr       = ray_hdr['VOL']  # Stays the same for the whole volume?
     elv_hdr       = ray_hdr['ELV']  # Stays the same for the whole scan?
@@ -188,25 +229,29 @@ def populateScan(l2, scan, index=0):
 
     # Get moments/quantities/parameters
     #print "SCAN %i" % index
-    populateParams(l2, scan, index)
+    populateParams(l2, scan, index, meta)
+    dop_hdr = rad_hdr
+    if meta['doppler'] is not None:  # Split cut, see mergeSplitCuts
+        populateParams(l2, scan, meta['doppler']['index'], meta['doppler'])
+        dop_hdr = meta['doppler']['ray_hdr']['RAD']
 
     # Now sort ray angle and time attributes
-    setRayAttributes(l2, scan, index)
+    setRayAttributes(l2, scan, index, meta)
 
     # Remaining scalar attributes
-    startms = l2.msg31s[l2.scan_msgs[index][0]]['msg31_header']['collect_ms']
-    endms   = l2.msg31s[l2.scan_msgs[index][tsi['nrays']-1]]['msg31_header']['collect_ms']
-    scan.startdate, scan.starttime = makeDateTime(l2.msg31s[l2.scan_msgs[index][0]]['msg31_header']['collect_date'], startms)
-    scan.enddate, scan.endtime = makeDateTime(l2.msg31s[l2.scan_msgs[index][tsi['nrays']-1]]['msg31_header']['collect_date'], endms)
-
-    scan.a1gate = int(start_az_index)
+    first, last = l2.scan_msgs[index][0], l2.scan_msgs[index][tsi['nrays']-1]
+    startms = int(l2.msg31_headers['collect_ms'][first])
+    endms   = int(l2.msg31_headers['collect_ms'][last])
+    dates, esecs = meta['dates'], meta['esecs']
+    scan.startdate, scan.starttime = dates[0], time.strftime("%H%M%S", time.gmtime(esecs[0]))
+    scan.enddate, scan.endtime = dates[tsi['nrays']-1], time.strftime("%H%M%S", time.gmtime(esecs[tsi['nrays']-1]))
+
+    if meta['reducer']: scan.a1gate = int(start_az_index // 2)
+    else: scan.a1gate = int(start_az_index)
     scan.elangle = round(l2.get_target_angles([index])[0], 1) * dr  # Round to nearest 10th of a degree (requested?), then radians
-    if "REF" in tsi['moments']:
-        p = "REF"
-    else: 
-        p = tsi['moments'][0]
-    scan.rscale = float(l2.get_range(index, p)[1] - l2.get_range(index, p)[0])  # metres
-    scan.rstart = (l2.get_range(index, p)[0] - (scan.rscale/2)) * 0.001  # kilometres. Py-ART puts the location in the bin's centre.
+    rscale = float(meta['range'][1] - meta['range'][0])  # metres
+    scan.rstart = (meta['range'][0] - (rscale/2)) * 0.001  # kilometres. Py-ART puts the location in the bin's centre.
+    scan.rscale = rscale * meta['gate_factor']  # Aggregated bins start where the first gate does
 
     scan.addAttribute('how/rpm', 60/((endms-startms)/1000.0))  # Work it out, assumng start and end are same day. FIXME?
 
@@ -220,12 +265,12 @@ def populateScan(l2, scan, index=0):
     scan.addAttribute('how/radconstV', abs(rad_hdr['radconstV']))
 #     scan.addAttribute('how/nomTXpower', )  # Maybe found in Message Type 3
 #     scan.addAttribute('how/powerdiff', )
-    scan.addAttribute('how/NI', rad_hdr['nyquist_vel']*0.01)
+    scan.addAttribute('how/NI', dop_hdr['nyquist_vel']*0.01)  # From the cut VRADH comes from
     scan.addAttribute('how/unambig_range', rad_hdr['unambig_range']*0.1)  # Not ODIM
 
 #     scan.addAttribute('how/Vsamples', )
     scan.addAttribute('how/scan_index', index)
-    scan.addAttribute('how/scan_count', l2.nscans)
+    scan.addAttribute('how/scan_count', meta['scan_count'])
 
     scan.addAttribute('how/astart', 0.0)  # Could contain the calculated error
 
@@ -261,11 +306,242 @@ def populateScan(l2, scan, index=0):
 #  either a PVOL or a SCAN
 #  @param string containing the input Level II file name
 #  @param return_l2 Python Boolean for returning the Level II object or not
+#  @param scans list of scan indices (0 based) to read, or None to read all of them.
+#  Only the parts of a compressed file holding these scans are decompressed.
+#  @param use_mmap Python Boolean for memory-mapping uncompressed files instead of reading them
+#  @param cachedir string directory of the decoded-volume cache, see ec_nexrad_cache, or None
+#  to read the file directly. Files already in the cache are memory-mapped from it.
+#  @param azimuth_reducer string, one of AZIMUTH_REDUCERS, for aggregating super-resolution (0.5 degree)
+#  sweeps to 1 degree, or None to keep them as they are. See reduceRays.
+#  @param rscale float range bin size in metres to aggregate gates to, a multiple of the native gate
+#  spacing, or None to keep the native gates. See reduceBins.
+#  @param quantities list of ODIM quantities (e.g. "TH", "VRADH") to read, or None to read all of them.
+#  Other moments are not decoded at all.
+#  @param max_range_km float maximum range in km, or None for no limit. Bins beyond it are not decoded,
+#  and are cut in the same way as ecWxR_trimRange does.
+#  @param merge_split_cuts Python Boolean for reading the surveillance and Doppler cuts of each
+#  split cut as one scan, or not. See mergeSplitCuts.
 #  @returns If return_l2 is True, then returns Python 2-tuple containing an object representing 
 #  the Level II data, and the corresponding RAVE object, otherwise returns just the RAVE object
-# as the payload of a RaveIO object
-def readLevelII(filename, return_l2=False):
-    l2 = nexrad_level2.NEXRADLevel2File(filename)
+# as the payload of a RaveIO object. In the latter case, each scan's decoded moments are released
+# as soon as the scan is built, and the Level II data before returning, so that only the RAVE
+# object remains in memory while it is processed and written.
+def readLevelII(filename, return_l2=False, scans=None, use_mmap=False, cachedir=None,
+                azimuth_reducer=None, rscale=None, quantities=None, max_range_km=None,
+                merge_split_cuts=False):
+    l2 = openLevelII(filename, scans, use_mmap, cachedir)
+    rio = level2ToRIO(l2, azimuth_reducer, rscale, quantities, max_range_km, merge_split_cuts,
+                      release=not return_l2)
+
+    if return_l2: return rio, l2
+    l2.close()
+    return rio
+
+
+## Converts Level II data to an ODIM_H5 file one scan at a time. The top-level what, where and
+#  how groups are written first, then each scan is built, written as the next dataset group and
+#  released, so that only one scan is in memory at a time instead of the whole volume, as with
+#  readLevelII and RaveIO.save. Requires h5py. Files holding a single scan are written as a SCAN,
+#  by RAVE.
+#  @param string containing the input Level II file name
+#  @param string containing the output ODIM_H5 file name, which only appears once it is complete
+#  @param scans list of scan indices (0 based) to read, or None, as in readLevelII
+#  @param use_mmap Python Boolean, as in readLevelII
+#  @param cachedir string directory of the decoded-volume cache, or None, as in readLevelII
+#  @param azimuth_reducer string, one of AZIMUTH_REDUCERS, or None, as in readLevelII
+#  @param rscale float range bin size in metres, or None, as in readLevelII
+#  @param quantities list of ODIM quantities to read, or None, as in readLevelII
+#  @param max_range_km float maximum range in km, or None, as in readLevelII
+#  @param merge_split_cuts Python Boolean, as in readLevelII
+#  @param unique_elangles Python Boolean for only writing the first scan at each elevation angle,
+#  like ecWxR_trimRange does, or writing all of them.
+#  @returns Python 2-tuple containing a RaveIO object and a list of the quantities written. For a
+#  PVOL, the RaveIO object holds its top-level attributes but no scans, for a SCAN, the scan itself.
+def writeLevelII(filename, ofstr, scans=None, use_mmap=False, cachedir=None,
+                 azimuth_reducer=None, rscale=None, quantities=None, max_range_km=None,
+                 merge_split_cuts=False, unique_elangles=False):
+    if h5py is None:
+        raise ImportError("writeLevelII requires h5py")
+    l2 = openLevelII(filename, scans, use_mmap, cachedir)
+    tmpfstr = ofstr + '.%i' % os.getpid()
+    written = []
+    try:
+        if l2.nscans == 1:
+            rio = level2ToRIO(l2, azimuth_reducer, rscale, quantities, max_range_km,
+                              merge_split_cuts, release=True)
+            rio.save(tmpfstr)
+            written = rio.object.getParameterNames()
+        else:
+            pvol = _polarvolume.new()
+            meta = populateTopLevel(l2, pvol, azimuth_reducer, rscale, quantities, max_range_km,
+                                    merge_split_cuts)
+            h5 = h5py.File(tmpfstr, 'w')
+            try:
+                writeTopLevel(h5, pvol)
+                count, elangles = 0, []
+                for scan in iterScans(l2, meta, release=True):
+                    if unique_elangles and scan.elangle in elangles:
+                        continue
+                    elangles.append(scan.elangle)
+                    count += 1
+                    writeScan(h5.create_group('dataset%i' % count), scan)
+                    written += [q for q in scan.getParameterNames() if q not in written]
+                    del scan
+            finally:
+                h5.close()
+            rio = _raveio.new()
+            rio.object = pvol
+        os.rename(tmpfstr, ofstr)
+    finally:
+        l2.close()
+        if os.path.isfile(tmpfstr): os.remove(tmpfstr)
+    return rio, written
+
+
+## Opens a Level II file, either directly or through the decoded-volume cache
+#  @param string containing the input Level II file name
+#  @param scans list of scan indices (0 based) to read, or None, as in readLevelII
+#  @param use_mmap Python Boolean, as in readLevelII
+#  @param cachedir string directory of the decoded-volume cache, or None, as in readLevelII
+#  @returns NEXRADLevel2File object
+def openLevelII(filename, scans=None, use_mmap=False, cachedir=None):
+    if cachedir:
+        return ec_nexrad_cache.readLevelII(filename, scans=scans, cachedir=cachedir)
+    return nexrad_level2.NEXRADLevel2File(filename, scans=scans, use_mmap=use_mmap)
+
+
+## Reads Level II data from LDM chunks as they arrive, and creates a RAVE object for
+#  each elevation cut as soon as the cut is complete, without waiting for the end of the volume.
+#  Each object is the same as the one returned by readLevelII for that scan alone.
+#  @param chunks iterable of strings, each containing one LDM chunk in order of arrival,
+#  starting with the chunk containing the volume header
+#  @param azimuth_reducer string, one of AZIMUTH_REDUCERS, or None, as in readLevelII
+#  @param rscale float range bin size in metres, or None, as in readLevelII
+#  @param quantities list of ODIM quantities to read, or None, as in readLevelII
+#  @param max_range_km float maximum range in km, or None, as in readLevelII
+#  @returns generator of Python 2-tuples containing the scan index (0 based) and a RaveIO
+#  object containing either a PVOL with that one scan, or a SCAN if it's the lowest one
+def readLevelIIChunks(chunks, azimuth_reducer=None, rscale=None, quantities=None, max_range_km=None):
+    assembler = nexrad_level2.NEXRADLevel2Assembler()
+    for chunk in chunks:
+        for index in assembler.add_chunk(chunk):
+            l2 = assembler.get_file(scans=[index])
+            # Only the scans received so far are in l2, the VCP has them all
+            yield index, level2ToRIO(l2, azimuth_reducer, rscale, quantities, max_range_km,
+                                     scan_count=l2.vcp['msg5_header']['num_cuts'])
+
+
+##
+#  Result of decoding one file with readLevelIIBatch. Sweep arrays are memory-mapped
+#  from shared memory, so they are not copied from the worker that decoded them.
+class BatchResult(object):
+    ## Initializer
+    # @param self - this object
+    # @param filename - string input file name
+    # @param seconds - float time taken to decode the file, in the worker
+    # @param error - string traceback if decoding failed, otherwise None
+    # @param sweeps - list with one dictionary per scan, empty for failed files. Each dictionary
+    # contains the raw (8-bit, or 16-bit for PHI) data of each moment as (nrays, nbins) arrays keyed
+    # by moment name, as well as 'azimuth' and 'elevation' angle arrays and 'scaling', a dictionary
+    # of (scale, offset) keyed by moment name, such that value = (raw - offset) / scale.
+    def __init__(self, filename, seconds, error=None, sweeps=None):
+        self.filename = filename
+        self.seconds = seconds
+        self.error = error
+        self.sweeps = sweeps or []
+
+
+## Decodes many Level II files in a pool of worker processes, reused from file to file.
+#  Sweep arrays are returned through files in shared memory (/dev/shm where available) which are
+#  memory-mapped by the calling process, instead of being pickled.
+#  @param paths list of input Level II file names
+#  @param workers int number of worker processes, defaults to the number of CPUs. With 1, files
+#  are decoded in the calling process.
+#  @param cachedir string directory of the decoded-volume cache, see ec_nexrad_cache, or None
+#  @returns list of BatchResult objects, in the same order as paths
+def readLevelIIBatch(paths, workers=None, cachedir=None):
+    if workers is None: workers = multiprocessing.cpu_count()
+    tmpdir = tempfile.mkdtemp(prefix='ec_nexrad_', dir=SHMPATH)
+    args = [(path, os.path.join(tmpdir, str(i)), cachedir) for i, path in enumerate(paths)]
+    try:
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            try:
+                decoded = pool.map(decodeForBatch, args, chunksize=1)
+            finally:
+                pool.terminate()
+        else:
+            decoded = map(decodeForBatch, args)
+        results = []
+        for filename, seconds, error, manifest in decoded:
+            results.append(BatchResult(filename, seconds, error, loadSweeps(manifest)))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)  # Mappings remain valid after unlinking
+    return results
+
+
+## Decodes one file in a readLevelIIBatch worker, writing its sweep arrays as .npy files
+#  @param Python 3-tuple containing the input file name, the output file string prefix, and
+#  the cache directory or None
+#  @returns Python 4-tuple containing the input file name, the decoding time in seconds, a
+#  traceback string or None, and a manifest with one dictionary per scan of the .npy file
+#  names of its arrays and of its scaling, keyed as in BatchResult.sweeps
+def decodeForBatch(args):
+    filename, prefix, cachedir = args
+    start = time.time()
+    manifest = []
+    try:
+        if cachedir:
+            l2 = ec_nexrad_cache.readLevelII(filename, cachedir=cachedir)
+        else:
+            l2 = nexrad_level2.NEXRADLevel2File(filename)
+        for index, tsi in enumerate(l2.scan_info()):
+            sweep = {'azimuth' : l2.get_azimuth_angles([index]),
+                     'elevation' : l2.get_elevation_angles([index])}
+            scaling = {}
+            for p, ngates in zip(tsi['moments'], tsi['ngates']):
+                sweep[p] = l2.get_data(p, ngates, scans=[index], raw_data=True, copy=False)
+                scale, offset = l2.get_moment_scaling(p, [index])
+                scaling[p] = (float(scale), float(offset))
+            files = {'scaling' : scaling}
+            for name, data in sweep.items():
+                files[name] = '%s_%i_%s.npy' % (prefix, index, name)
+                numpy.save(files[name], data)
+            manifest.append(files)
+        l2.close()
+    except Exception:
+        return filename, time.time() - start, traceback.format_exc(), []
+    return filename, time.time() - start, None, manifest
+
+
+## Memory-maps the sweep arrays written by decodeForBatch
+#  @param manifest list as returned by decodeForBatch
+#  @returns list of dictionaries, as BatchResult.sweeps
+def loadSweeps(manifest):
+    sweeps = []
+    for files in manifest:
+        sweep = {'scaling' : files['scaling']}
+        for name, fstr in files.items():
+            if name != 'scaling':
+                sweep[name] = numpy.load(fstr, mmap_mode='r')
+        sweeps.append(sweep)
+    return sweeps
+
+
+## Creates a RAVE object, either a PVOL or a SCAN, from Level II data and metadata
+#  @param l2 object containing Level II data and metadata
+#  @param azimuth_reducer string, one of AZIMUTH_REDUCERS, or None, as in readLevelII
+#  @param rscale float range bin size in metres, or None, as in readLevelII
+#  @param quantities list of ODIM quantities to read, or None, as in readLevelII
+#  @param max_range_km float maximum range in km, or None, as in readLevelII
+#  @param merge_split_cuts Python Boolean, as in readLevelII
+#  @param release Python Boolean for releasing the decoded moments of each scan once the scan is
+#  built, or keeping them memoized in l2 for later calls to l2.get_data
+#  @param scan_count int number of scans in the whole volume, written as how/scan_count, or None
+#  for the number of scans in l2
+#  @returns RaveIO object containing the PVOL or SCAN as its payload
+def level2ToRIO(l2, azimuth_reducer=None, rscale=None, quantities=None, max_range_km=None,
+                merge_split_cuts=False, release=False, scan_count=None):
     rio = _raveio.new()
 
     # Always assume we're reading volumes, not individual scans.
@@ -275,6 +551,33 @@ def readLevelII(filename, return_l2=False):
         rio.object = _polarscan.new()
     obj = rio.object
 
+    meta = populateTopLevel(l2, obj, azimuth_reducer, rscale, quantities, max_range_km,
+                            merge_split_cuts, scan_count)
+
+    if rio.objectType == _rave.Rave_ObjectType_SCAN:
+        populateScan(l2, obj, meta=meta[0])
+
+    elif rio.objectType == _rave.Rave_ObjectType_PVOL:
+        for scan in iterScans(l2, meta, release):
+            obj.addScan(scan)
+
+    return rio
+
+
+# Begin helper functions
+
+## Sets the source, location, date, time and top-level how attributes of a RAVE object
+#  @param l2 object containing Level II data and metadata
+#  @param obj either PVOL or SCAN
+#  @param azimuth_reducer string, one of AZIMUTH_REDUCERS, or None, as in readLevelII
+#  @param rscale float range bin size in metres, or None, as in readLevelII
+#  @param quantities list of ODIM quantities to read, or None, as in readLevelII
+#  @param max_range_km float maximum range in km, or None, as in readLevelII
+#  @param merge_split_cuts Python Boolean, as in readLevelII
+#  @param scan_count int number of scans in the whole volume, or None, as in level2ToRIO
+#  @returns list containing a dictionary from getScanMeta for each scan
+def populateTopLevel(l2, obj, azimuth_reducer=None, rscale=None, quantities=None,
+                     max_range_km=None, merge_split_cuts=False, scan_count=None):
     source = odim_source.SOURCE['us'+l2.volume_header['icao'][1:].lower()]
     obj.source = source.encode(UTF8)
 
@@ -288,94 +591,376 @@ def readLevelII(filename, return_l2=False):
 #    obj.date, obj.time = makeDateTime(l2.volume_header['date'], l2.volume_header['time'])
     obj.date, obj.time = get_times(l2)
     
-    getTopLevelHowAttrs(l2, obj)
+    # Scan metadata are determined once for the whole volume and passed down
+    meta = getVolumeMeta(l2, azimuth_reducer, rscale, quantities, max_range_km, merge_split_cuts)
+    if scan_count is not None:
+        for m in meta: m['scan_count'] = scan_count
+    getTopLevelHowAttrs(l2, obj, meta[l2.nscans-1])
+    return meta
 
-    if rio.objectType == _rave.Rave_ObjectType_SCAN:
-        populateScan(l2, obj)
 
-    elif rio.objectType == _rave.Rave_ObjectType_PVOL:
-        for i in range(l2.nscans):
-            scan = _polarscan.new()
-            populateScan(l2, scan, index=i)
-            if len(scan.getParameterNames()) > 0:  # Don't add the scan if there are no moments in it
-                obj.addScan(scan)
+## Builds the scans of a volume one at a time
+#  @param l2 object containing Level II data and metadata
+#  @param meta list containing a dictionary from getScanMeta for each scan
+#  @param release Python Boolean, as in level2ToRIO
+#  @returns generator of PolarScan objects, skipping scans which were not read, which are the
+#  Doppler part of a merged split cut, or which have no moments
+def iterScans(l2, meta, release=False):
+    for i in range(l2.nscans):
+        if meta[i]['nrays'] == 0 or meta[i]['merged'] is not None:  # Not read, or part of a split cut
+            continue
+        scan = _polarscan.new()
+        populateScan(l2, scan, index=i, meta=meta[i])
+        if release: l2.clear_cache()
+        if len(scan.getParameterNames()) > 0:  # Don't add the scan if there are no moments in it
+            yield scan
+
+
+## Writes the root attributes and the top-level what, where and how groups of a PVOL
+#  @param h5 h5py File object
+#  @param pvol PolarVolume object, whose scans are not written
+def writeTopLevel(h5, pvol):
+    writeAttribute(h5, 'Conventions', ODIM_VERSION)
+    what = h5.create_group('what')
+    writeAttribute(what, 'object', 'PVOL')
+    writeAttribute(what, 'version', H5RAD_VERSION)
+    writeAttribute(what, 'date', pvol.date)
+    writeAttribute(what, 'time', pvol.time)
+    writeAttribute(what, 'source', pvol.source)
+    where = h5.create_group('where')
+    writeAttribute(where, 'lon', pvol.longitude * rd)
+    writeAttribute(where, 'lat', pvol.latitude * rd)
+    writeAttribute(where, 'height', pvol.height)
+    h5.create_group('how')
+    if pvol.beamwidth: writeAttribute(h5['how'], 'beamwidth', pvol.beamwidth * rd)
+    writeAttributes(h5, pvol)
+
+
+## Writes a scan as a dataset group of a PVOL
+#  @param group h5py Group object of the dataset, e.g. /dataset1
+#  @param scan PolarScan object
+def writeScan(group, scan):
+    what = group.create_group('what')
+    writeAttribute(what, 'product', 'SCAN')
+    writeAttribute(what, 'startdate', scan.startdate)
+    writeAttribute(what, 'starttime', scan.starttime)
+    writeAttribute(what, 'enddate', scan.enddate)
+    writeAttribute(what, 'endtime', scan.endtime)
+    where = group.create_group('where')
+    writeAttribute(where, 'elangle', scan.elangle * rd)
+    writeAttribute(where, 'a1gate', scan.a1gate)
+    writeAttribute(where, 'nbins', scan.nbins)
+    writeAttribute(where, 'nrays', scan.nrays)
+    writeAttribute(where, 'rscale', scan.rscale)
+    writeAttribute(where, 'rstart', scan.rstart)
+    writeAttributes(group, scan)
+
+    for i, pname in enumerate(scan.getParameterNames()):
+        param = scan.getParameter(pname)
+        dgroup = group.create_group('data%i' % (i+1))
+        what = dgroup.create_group('what')
+        writeAttribute(what, 'quantity', param.quantity)
+        writeAttribute(what, 'gain', param.gain)
+        writeAttribute(what, 'offset', param.offset)
+        writeAttribute(what, 'nodata', param.nodata)
+        writeAttribute(what, 'undetect', param.undetect)
+        writeAttributes(dgroup, param)
+        writeData(dgroup, param.getData())
+        writeQualityFields(dgroup, param)
+    writeQualityFields(group, scan)
+
+
+## Writes the quality fields of a scan or parameter as quality groups, e.g. /dataset1/quality1
+#  @param group h5py Group object of the scan or parameter
+#  @param obj PolarScan or PolarScanParam object
+def writeQualityFields(group, obj):
+    for i in range(obj.getNumberOfQualityFields()):
+        field = obj.getQualityField(i)
+        qgroup = group.create_group('quality%i' % (i+1))
+        writeAttributes(qgroup, field)
+        writeData(qgroup, field.getData())
+
+
+## Writes a data array as a compressed image dataset
+#  @param group h5py Group object of the data or quality group
+#  @param data numpy array
+def writeData(group, data):
+    dataset = group.create_dataset('data', data=data, chunks=data.shape, compression='gzip',
+                                   compression_opts=COMPRESSION_ZLIB_LEVEL)
+    writeAttribute(dataset, 'CLASS', 'IMAGE')
+    writeAttribute(dataset, 'IMAGE_VERSION', '1.2')
+
+
+## Writes the attributes of a RAVE object, named like 'how/NI', to the subgroups of a group
+#  @param group h5py Group object
+#  @param obj RAVE object with getAttributeNames and getAttribute
+def writeAttributes(group, obj):
+    for aname in obj.getAttributeNames():
+        gname, name = aname.split('/', 1)
+        writeAttribute(group.require_group(gname), name, obj.getAttribute(aname))
+
+
+## Writes an attribute with the types RAVE uses: null-terminated strings, 64-bit integers and
+#  doubles, or arrays of these
+#  @param node h5py Group or Dataset object
+#  @param string attribute name
+#  @param value string, number, or numpy array
+def writeAttribute(node, name, value):
+    if isinstance(value, unicode): value = value.encode(UTF8)
+    if isinstance(value, str):
+        tid = h5py.h5t.C_S1.copy()
+        tid.set_size(len(value) + 1)
+        tid.set_strpad(h5py.h5t.STR_NULLTERM)
+        node.attrs.create(name, numpy.array(value, 'S%i' % (len(value) + 1)), dtype=h5py.Datatype(tid))
+    elif numpy.asarray(value).dtype.kind in 'iub':
+        node.attrs.create(name, numpy.asarray(value, numpy.int64))
+    else:
+        node.attrs.create(name, numpy.asarray(value, numpy.float64))
 
-    if return_l2: return rio, l2
-    else: return rio
 
+## Determines the metadata of every scan in a volume, once
+#  @param l2 object containing Level II data and metadata
+#  @param azimuth_reducer string, one of AZIMUTH_REDUCERS, or None, as in readLevelII
+#  @param rscale float range bin size in metres, or None, as in readLevelII
+#  @param quantities list of ODIM quantities to read, or None, as in readLevelII
+#  @param max_range_km float maximum range in km, or None, as in readLevelII
+#  @param merge_split_cuts Python Boolean, as in readLevelII
+#  @returns list containing a dictionary from getScanMeta for each scan
+def getVolumeMeta(l2, azimuth_reducer=None, rscale=None, quantities=None, max_range_km=None,
+                  merge_split_cuts=False):
+    meta = [getScanMeta(l2, i, tsi, azimuth_reducer, rscale, quantities, max_range_km)
+            for i, tsi in enumerate(l2.scan_info())]
+    if merge_split_cuts:
+        mergeSplitCuts(l2, meta)
+    return meta
+
+
+## Pairs the surveillance (CS) and Doppler (CD) cuts of each split cut, so that they are read
+#  as one scan with REF from the CS cut, and all other moments from the CD cut. Neither cut
+#  decodes the moments taken from the other one. Cuts are only paired when they follow each
+#  other at the same target elevation angle, with the same number of rays, first gate and gate
+#  spacing, so that the moments of the CD cut keep the bins they would have in their own scan.
+#  @param l2 object containing Level II data and metadata
+#  @param meta list containing a dictionary from getScanMeta for each scan, which are modified:
+#  the 'doppler' of a CS cut becomes the dictionary of its CD cut, and the 'merged' of the CD cut
+#  becomes the index of the CS cut.
+def mergeSplitCuts(l2, meta):
+    cp = l2.vcp['cut_parameters']
+    for cs in range(min(len(meta), len(cp)) - 1):
+        cd = cs + 1
+        if cp[cs]['waveform_type'] != SURVEILLANCE or cp[cd]['waveform_type'] not in DOPPLER:
+            continue
+        if cp[cs]['elevation_angle'] != cp[cd]['elevation_angle']:
+            continue
+        if meta[cs]['nrays'] == 0 or meta[cs]['nrays'] != meta[cd]['nrays']:
+            continue
+        if "REF" not in meta[cs]['moments'] or 'range' not in meta[cd]:
+            continue
+        if list(meta[cs]['range'][:2]) != list(meta[cd]['range'][:2]):  # first gate and spacing
+            continue
+
+        quantities = meta[cs]['quantities']
+        meta[cs]['quantities'] = [q for q in [QUANTITIES["REF"]] if quantities is None or q in quantities]
+        meta[cd]['quantities'] = [QUANTITIES[p] for p in meta[cd]['moments'] if p in QKEYS and p != "REF"
+                                  and (quantities is None or QUANTITIES[p] in quantities)]
+        meta[cd]['pad_ngates'] = meta[cs]['pad_ngates']  # Pad to the range of REF in the CS cut
+        meta[cs]['doppler'] = meta[cd]
+        meta[cd]['merged'] = cs
+
+
+## Determines the metadata of a scan which is needed to populate it
+#  @param l2 object containing Level II data and metadata
+#  @param int index of the scan in the volume
+#  @param tsi dictionary of scan information from l2.scan_info(), or None to look it up
+#  @param azimuth_reducer string, one of AZIMUTH_REDUCERS, or None, as in readLevelII
+#  @param rscale float range bin size in metres, or None, as in readLevelII
+#  @param quantities list of ODIM quantities to read, or None, as in readLevelII
+#  @param max_range_km float maximum range in km, or None, as in readLevelII
+#  @returns dictionary containing the keys of tsi ('nrays', 'moments', 'ngates'). Scans which
+#  have been read also contain 'azimuth' and 'elevation' angle arrays, 'start_az_index' of the
+#  ray with the lowest azimuth angle, 'ray_hdr' of that ray, 'range' array of the bins of REF (or
+#  the first moment), the 'dates' and 'esecs' of each ray from getRayTimes, and the 'reducer'
+#  to apply to the rays, which is None unless the scan is a super-resolution one, and the
+#  'gate_factor' by which to aggregate gates, which is 1 when they are kept as they are. Finally,
+#  'quantities' to read, 'max_ngates', the number of gates within the maximum range, and
+#  'pad_ngates', the number of gates to pad each moment to, which is that of REF. The 'index'
+#  of the scan, and its 'doppler' and 'merged' split cut keys are explained in mergeSplitCuts.
+#  'scan_count' is the number of scans in the volume, written as how/scan_count.
+def getScanMeta(l2, index, tsi=None, azimuth_reducer=None, rscale=None, quantities=None,
+                max_range_km=None):
+    if azimuth_reducer not in AZIMUTH_REDUCERS + (None,):
+        raise ValueError("Unknown azimuth reducer %s" % azimuth_reducer)
+    if tsi is None: tsi = l2.scan_info()[index]
+    meta = dict(tsi)
+    meta['index'] = index
+    meta['scan_count'] = l2.nscans
+    meta['doppler'] = None
+    meta['merged'] = None
+    meta['reducer'] = None
+    meta['gate_factor'] = 1
+    meta['quantities'] = quantities
+    meta['max_ngates'] = max(tsi['ngates'] + [0])
+    meta['pad_ngates'] = 0
+    if tsi['nrays'] == 0:  # Not read
+        return meta
+
+    # Assumes that azimuth angles are centred on each ray
+    meta['azimuth'] = l2.get_azimuth_angles([index])
+    meta['elevation'] = l2.get_elevation_angles([index])
+    meta['start_az_index'] = numpy.argmin(meta['azimuth'])
+    meta['ray_hdr'] = l2.msg31s[l2.scan_msgs[index][meta['start_az_index']]]
+    if "REF" in tsi['moments']:
+        meta['range'] = l2.get_range(index, "REF")
+    elif len(tsi['moments']):
+        meta['range'] = l2.get_range(index, tsi['moments'][0])
+    meta['dates'], meta['esecs'] = getRayTimes(l2, index)
+    if meta['ray_hdr']['msg31_header']['azimuth_resolution'] == SUPERRES:
+        meta['reducer'] = azimuth_reducer
+    if rscale and 'range' in meta:
+        gate_spacing = float(meta['range'][1] - meta['range'][0])
+        meta['gate_factor'] = int(round(rscale / gate_spacing))
+        if meta['gate_factor'] < 1 or abs(meta['gate_factor'] * gate_spacing - rscale) > 1e-3:
+            raise ValueError("rscale %s is not a multiple of the gate spacing %s" % (rscale, gate_spacing))
+    if max_range_km is not None and 'range' in meta:
+        maxbin = int(max_range_km*1000 / (float(meta['range'][1] - meta['range'][0]) * meta['gate_factor']))
+        meta['max_ngates'] = min(meta['max_ngates'], maxbin * meta['gate_factor'])
+    if "REF" in tsi['moments']:
+        meta['pad_ngates'] = min(tsi['ngates'][tsi['moments'].index("REF")], meta['max_ngates'])
+    return meta
+
+
+## Aggregates pairs of adjacent 0.5 degree rays to 1 degree rays. The first ray of the
+#  data is the one with the lowest azimuth angle, so each pair spans a whole degree.
+#  An odd last ray is kept on its own.
+#  @param data array of quantized data with one row per ray, in RAVE order
+#  @param reducer string, one of AZIMUTH_REDUCERS: "max" takes the largest value of each pair,
+#  "mean" averages in linear units (e.g. Z rather than dBZ), and "nearest" takes the first ray
+#  of each pair. Only REF is reduced with "max" or "mean", other moments take the nearest ray,
+#  because averaging velocities or polarimetric quantities across rays is not meaningful.
+#  @param qmd QMeta object of the moment
+#  @returns array with half as many rows, of the same type
+def reduceRays(data, reducer, qmd):
+    first, second = pairRays(data)
+    if reducer == "nearest":
+        return first.copy()
+    return reduceGroups(numpy.array([first, second]), reducer, qmd).astype(data.dtype)
+
+
+## Aggregates adjacent gates of each ray to bins a whole number of gates long. The last bin
+#  is padded with nodata if the number of gates is not a multiple of the factor.
+#  @param data array of quantized data with one row per ray
+#  @param factor int number of gates per bin
+#  @param reducer string, one of AZIMUTH_REDUCERS, as in reduceRays. "nearest" takes the gate
+#  at the centre of each bin, rounding towards the radar.
+#  @param qmd QMeta object of the moment
+#  @returns array with one bin per factor gates, of the same type
+def reduceBins(data, factor, reducer, qmd):
+    nrays, nbins = data.shape
+    if nbins % factor:
+        padding = numpy.zeros((nrays, factor - nbins % factor), data.dtype) + qmd.nodata
+        data = numpy.concatenate((data, padding), 1)
+    groups = data.reshape(nrays, -1, factor)
+    if reducer == "nearest":
+        return groups[:, :, (factor-1) // 2].copy()
+    return reduceGroups(numpy.rollaxis(groups, 2), reducer, qmd).astype(data.dtype)
+
+
+## Reduces groups of quantized values, ignoring undetect and nodata. A group without valid
+#  values becomes undetect if any of its values is, otherwise nodata.
+#  @param groups array whose first axis runs over the members of each group
+#  @param reducer string, "max" or "mean" (in linear units)
+#  @param qmd QMeta object of the moment
+#  @returns float array of quantized values, without the first axis
+def reduceGroups(groups, reducer, qmd):
+    valid = (groups != qmd.nodata) & (groups != qmd.undetect)
+    values = groups * qmd.gain + qmd.offset
+    if reducer == "max":
+        reduced = numpy.where(valid, values, -numpy.inf).max(axis=0)
+    else:
+        linear = numpy.where(valid, 10**(values/10.0), 0.0).sum(axis=0)
+        reduced = 10 * numpy.log10(numpy.maximum(linear, 1e-30) / numpy.maximum(valid.sum(axis=0), 1))
+    codes = numpy.clip(numpy.round((reduced - qmd.offset) / qmd.gain), qmd.undetect+1, qmd.nodata-1)
+    undetect = numpy.equal(groups, qmd.undetect).any(axis=0)
+    out = numpy.where(undetect, qmd.undetect, qmd.nodata)
+    return numpy.where(valid.any(axis=0), codes, out)
+
+
+## Splits rays into the first and second rays of adjacent pairs, repeating an odd last ray
+#  @param array with one row, or element, per ray
+#  @returns Python 2-tuple of arrays of the first and second rays of each pair
+def pairRays(a):
+    if len(a) % 2:
+        a = numpy.concatenate((a, a[-1:]))
+    return a[0::2], a[1::2]
 
-# Begin helper functions
 
 ## Sets angles and timing metadata for each ray
 #  @param l2 object containing Level II data and metadata
 #  @param scan an empty RAVE scan object to be populated
 #  @param int index of the scan in the volume
-def setRayAttributes(l2, scan, index):
-    startazA, stopazA, startazT, stopazT, elangles = [], [], [], [], []
-    
-    tsi = l2.scan_info()[index]
-    nrays = tsi['nrays']
-    if l2.msg18 != None:
+#  @param meta dictionary of scan metadata from getScanMeta, or None to compute it
+def setRayAttributes(l2, scan, index, meta=None):
+    if meta is None: meta = getScanMeta(l2, index)
+    if l2.msg18 is not None:
         half_bw = getFloat(l2, 1132) / 2.
     else:
         half_bw = 0.5
 
     # Determine starting ray
     # Assumes that azimuth angles are centred on each ray
-    az = l2.get_azimuth_angles([index])
-    el = l2.get_elevation_angles([index])
-    start_az_index = numpy.argmin(az)
-
-    for i in range(nrays):
-        startazA.append(az[i]-half_bw)
-        stopazA.append(az[i]+half_bw)
-        elangles.append(el[i]) # We only have one angle
-        omjd = l2.msg31s[l2.scan_msgs[index][i]]['msg31_header']['collect_date']
-        ms   = l2.msg31s[l2.scan_msgs[index][i]]['msg31_header']['collect_ms']
-        esecs = makeDateTime(omjd, ms, epochs=True)
-        startazT.append(esecs)  # We only have one time
-        stopazT.append(esecs)
-
-    if start_az_index > 0:  # Reshuffle
-        startazA = startazA[start_az_index:] + startazA[:start_az_index] 
-        stopazA  = stopazA[start_az_index:]  + stopazA[:start_az_index] 
-        elangles = elangles[start_az_index:] + elangles[:start_az_index] 
-        startazT = startazT[start_az_index:] + startazT[:start_az_index] 
-        stopazT  = stopazT[start_az_index:]  + stopazT[:start_az_index] 
-
-    scan.addAttribute('how/startazA', numpy.array(startazA, 'd'))
-    scan.addAttribute('how/stopazA',  numpy.array(stopazA,  'd'))
-    scan.addAttribute('how/elangles', numpy.array(elangles, 'd'))
-    scan.addAttribute('how/startazT', numpy.array(startazT, 'd'))
-    scan.addAttribute('how/stopazT',  numpy.array(stopazT,  'd'))
-
-
-## Quirks for dealing with Message Type 18
-# @param l2 object representing Level II data and metadata
-def getMsg18(l2):
-    try:
-        start18 = l2._buf.index('current')
-        l2.msg18 = l2._buf[start18 : start18+MSG18_LEN]
-    except ValueError:
-        try:
-            start18 = l2._buf.index('baseline')  # If both of these fail, then the payload has no Message 18
-            l2.msg18 = l2._buf[start18 : start18+MSG18_LEN]
-        except ValueError:
-            l2.msg18 = None
+    az = meta['azimuth'].astype('d')
+    el = meta['elevation'].astype('d')
+    start_az_index = meta['start_az_index']
+    esecs = meta['esecs']  # We only have one time
+
+    # Reshuffle so that the first ray is the one with the lowest azimuth angle
+    startazA = numpy.roll(az - half_bw, -start_az_index)
+    stopazA  = numpy.roll(az + half_bw, -start_az_index)
+    elangles = numpy.roll(el, -start_az_index)  # We only have one angle
+    startazT = numpy.roll(esecs, -start_az_index)
+    stopazT  = numpy.roll(esecs, -start_az_index)
+
+    # Aggregated rays span both rays of each pair
+    if meta['reducer']:
+        startazA, stopazA = pairRays(startazA)[0], pairRays(stopazA)[1]
+        elangles = (pairRays(elangles)[0] + pairRays(elangles)[1]) / 2
+        startazT, stopazT = pairRays(startazT)[0], pairRays(stopazT)[1]
+
+    scan.addAttribute('how/startazA', startazA)
+    scan.addAttribute('how/stopazA',  stopazA)
+    scan.addAttribute('how/elangles', elangles)
+    scan.addAttribute('how/startazT', startazT)
+    scan.addAttribute('how/stopazT',  stopazT)
+
+
+## Determines when each ray in a scan was collected, in the same way as makeDateTime does,
+#  but only converting each distinct day once
+#  @param l2 object containing Level II data and metadata
+#  @param int index of the scan in the volume
+#  @returns Python 2-tuple containing a list of dates (YYYYmmdd) as strings and a float64 array
+#  of day seconds, each with one element per ray, in the order of the rays in the file
+def getRayTimes(l2, index):
+    msgs = l2.scan_msgs[index]
+    days, inverse = numpy.unique(l2.msg31_headers['collect_date'][msgs], return_inverse=True)
+    ms = l2.msg31_headers['collect_ms'][msgs].astype('d')
+    dates = [str(julday2date(int(round(int(omjd)+JDCONSTANT, 0)))) for omjd in days]
+    day_seconds = numpy.array([makeDateTime(int(omjd), 0, epochs=True) for omjd in days], 'd')
+    return [dates[i] for i in inverse], day_seconds[inverse] + ms * 0.001
 
 
 ## Carrys over top-level optional metadata from Level II to RAVE
 #  @param l2 object representing Level II data and metadata
 #  @param obj either PVOL or SCAN
-def getTopLevelHowAttrs(l2, obj):
+#  @param tsi dictionary of scan information of the highest tilt, from either l2.scan_info() or
+#  getScanMeta, or None to look it up
+def getTopLevelHowAttrs(l2, obj, tsi=None):
     c = 299792458.0  # Speed of light
 
     vol_hdr = l2.msg31s[0]['VOL']  # Assume that this header is identical for all rays
-    getMsg18(l2)
-    if l2.msg18 != None: l2.atmos = ATMOS(l2)
+    if l2.msg18 is not None: l2.atmos = ATMOS(l2)
     else: l2.atmos = None
 
-    tsi = l2.scan_info()[l2.nscans-1]  # Highest tilt contains all moments
+    if tsi is None: tsi = l2.scan_info()[l2.nscans-1]  # Highest tilt contains all moments
     msg5_hdr = l2.vcp['msg5_header']
     
     obj.addAttribute('how/task', "VCP %i" % l2.vcp['msg5_header']['pattern_number'])  # Top level
@@ -393,7 +978,7 @@ def getTopLevelHowAttrs(l2, obj):
 
     obj.addAttribute('how/simulated', 'False')
 
-    if l2.msg18 != None:
+    if l2.msg18 is not None:
         tx_mhz = getInt(l2, 1092)
         obj.addAttribute('how/wavelength', c / (tx_mhz * 1000000.0) * 100)  # cm
         bw = getFloat(l2, 1132)
@@ -431,7 +1016,7 @@ class PATH_LOSSES(object):
     # @param self - this object
     # @param l2 - Level II data and metadata object
     def __init__(self, l2):
-        if l2.msg18 != None:
+        if l2.msg18 is not None:
             self.path_7  = getFloat(l2, 668)  # Vertical
             self.path_13 = getFloat(l2, 692)
             self.path_28 = getFloat(l2, 752)  # Horizontal
@@ -481,7 +1066,7 @@ class ATMOS(object):
         ## Initializer
         # @param self - this object
         # @param l2 - Level II data and metadata object
-        if l2.msg18 != None:
+        if l2.msg18 is not None:
             self.atmos_0  = {"min":-1.0, "max":-0.5, "atmos":getFloat(l2,  992)}
             self.atmos_1  = {"min":-0.5, "max": 0.0, "atmos":getFloat(l2,  996)}
             self.atmos_2  = {"min": 0.0, "max": 0.5, "atmos":getFloat(l2, 1000)}
@@ -508,20 +1093,32 @@ class ATMOS(object):
                 return k, i['atmos']
             
 
+## Decodes Message Type 18 once into big-endian float and int views of its
+#  4-byte words, kept on the Level II object for later lookups
+#  @param l2 - Level II data and metadata object
+#  @returns tuple of ndarrays (float32 words, int32 words)
+def getMsg18Words(l2):
+    words = getattr(l2, '_msg18_words', None)
+    if words is None:
+        words = (numpy.frombuffer(l2.msg18, '>f4'), numpy.frombuffer(l2.msg18, '>i4'))
+        l2._msg18_words = words
+    return words
+
+
 ## Convenience function, access a float scalar in Message Type 18
 #  @param l2 - Level II data and metadata object
-#  @param index - int index of the float in Message Type 18
+#  @param index - int byte offset of the float in Message Type 18, a multiple of 4
 #  @ returns float 
 def getFloat(l2, index):
-    return numpy.fromstring(l2.msg18[index:index+4], numpy.float32).byteswap().astype('d')[0]
+    return numpy.float64(getMsg18Words(l2)[0][index // 4])
 
 
 ## Convenience function, access an int scalar in Message Type 18
 #  @param l2 - Level II data and metadata object
-#  @param index - int index of the int in Message Type 18
+#  @param index - int byte offset of the int in Message Type 18, a multiple of 4
 #  @ returns int 
 def getInt(l2, index):
-    return numpy.fromstring(l2.msg18[index:index+4], numpy.int32).byteswap().astype('i')[0]
+    return numpy.int32(getMsg18Words(l2)[1][index // 4])
 
 
 def timesFromDaysSeconds(days, secs):
@@ -559,8 +1156,7 @@ def get_times(l2, scans=None, pa=False):
 #  @returns If epochs=True, returns day seconds as a float, else returns a 2-tuple 
 #  containing (YYYYmmdd, HHMMSS) as strings 
 def makeDateTime(omjd, ms, epochs=False):    
-    JDconstant = 2440586.5  # Modifled Julian date constant, only for NEXRAD?
-    MJD = int(round(omjd+JDconstant, 0))
+    MJD = int(round(omjd+JDCONSTANT, 0))
     Date = str(julday2date(MJD))
     tt = time.strptime(Date, "%Y%m%d")
     day_seconds = time.mktime(tt)
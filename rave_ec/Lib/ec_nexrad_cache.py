@@ -0,0 +1,302 @@
+'''
+Copyright (C) 2016 The Crown (i.e. Her Majesty the Queen in Right of Canada)
+
+This file is an add-on to RAVE.
+
+RAVE is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RAVE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RAVE.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+##
+#  On-disk cache of decoded NEXRAD Level II volumes, so that converting the
+#  same Archive II file again skips bz2 decompression, the record walk, the
+#  decoding of the msg31 headers and the gathering of the moment data.
+#
+#  Each entry is a directory holding the header columns of the volume (the
+#  message, msg31 and data block headers) and the raw data of each moment,
+#  gathered over all rays, as .npy files which are memory-mapped when read,
+#  and its volume header, VCP and Message 18 in a small pickle. Entries are
+#  keyed by the content hash of the original file and the reader version.
+#  The least recently used entries are evicted when the cache grows beyond
+#  its size. The cache is best-effort: an entry which cannot be read or
+#  written is skipped, and the file is decoded as usual.
+
+
+##
+# @file
+# @author Daniel Michelson, Environment and Climate Change Canada
+# @date 2016-12-12
+
+import os
+import glob
+import shutil
+import pickle
+import hashlib
+import tempfile
+import numpy
+import nexrad_level2
+
+## Bump this whenever nexrad_level2 decodes records differently, or entries
+#  are laid out differently, to invalidate existing entries
+READER_VERSION = 2
+
+CACHEDIR = os.path.join(tempfile.gettempdir(), 'nexrad_cache')
+MAXSIZE = 20 * 1024**3  # bytes
+BLOCKSIZE = 1024**2  # bytes read at a time when hashing
+HEADER = 'header.pkl'  # volume header, VCP, Message 18 and names of an entry
+
+
+## Computes the cache key of an Archive II file
+#  @param string input file name
+#  @returns string hexadecimal digest of the reader version and file content
+def contentKey(filename):
+    digest = hashlib.sha1(('nexrad_level2 %i\n' % READER_VERSION).encode())
+    fd = open(filename, 'rb')
+    try:
+        block = fd.read(BLOCKSIZE)
+        while block:
+            digest.update(block)
+            block = fd.read(BLOCKSIZE)
+    finally:
+        fd.close()
+    return digest.hexdigest()
+
+
+## Reads a Level II file through the cache. The whole volume is decoded and
+#  stored the first time a file is read, later reads map the stored entry.
+#  An entry which cannot be read, for example because another process is
+#  evicting it, is removed, and the file is decoded and stored again.
+#  @param string input file name
+#  @param scans list of scan indices (0 based) to read, or None to read all of them
+#  @param string cache directory
+#  @param int maximum size of the cache in bytes
+#  @returns NEXRADLevel2File object, a CachedLevel2File when read from the cache
+def readLevelII(filename, scans=None, cachedir=CACHEDIR, maxsize=MAXSIZE):
+    fstr = os.path.join(cachedir, contentKey(filename))
+    try:
+        if os.path.isdir(fstr):
+            os.utime(fstr, None)  # most recently used
+            return CachedLevel2File(fstr, scans)
+    except Exception:
+        shutil.rmtree(fstr, ignore_errors=True)  # decode the file instead
+
+    l2 = nexrad_level2.NEXRADLevel2File(filename)
+    if store(l2, fstr):
+        evict(cachedir, maxsize, keep=fstr)
+    if scans is None:
+        return l2
+    l2.close()
+    try:
+        return CachedLevel2File(fstr, scans)
+    except Exception:
+        return nexrad_level2.NEXRADLevel2File(filename, scans=scans)
+
+
+## Writes a cache entry. It is written to a temporary directory which is
+#  renamed, so that concurrent readers never see a partial entry. Failures,
+#  for example a full disk, are ignored and leave no files behind.
+#  @param l2 NEXRADLevel2File object holding the whole volume
+#  @param string entry directory
+#  @returns boolean, True if the entry was written
+def store(l2, fstr):
+    tmp = '%s.%i' % (fstr, os.getpid())
+    save = lambda name, data: numpy.save(os.path.join(tmp, name + '.npy'), data)
+    try:
+        if os.path.isdir(tmp): shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        blocks = sorted(l2._block_ptrs)
+        offsets, types = l2.record_index
+        save('offsets', offsets)
+        save('types', types)
+        save('msg_headers', l2.msg_headers)
+        save('msg31_records', l2._msg31_records)
+        save('msg31_headers', l2.msg31_headers)
+        save('ptrs', numpy.vstack([l2._block_ptrs[name] for name in blocks]))
+        for i, name in enumerate(blocks):
+            if name in l2.blocks: save('block%i' % i, l2.blocks[name])
+
+        # Raw data of each moment in message order, with as many gates as its longest ray
+        moments = []
+        order = numpy.concatenate(l2.scan_msgs)
+        for moment in nexrad_level2.MOMENTS:
+            if moment not in l2.blocks: continue
+            ngates = int(l2.blocks[moment]['ngates'].max())
+            if ngates == 0: continue
+            data = l2.get_data(moment, ngates, raw_data=True, copy=False)
+            stored = numpy.empty_like(data)
+            stored[order] = data
+            save('data%i' % len(moments), stored)
+            moments.append(moment)
+            l2.clear_cache()
+
+        fd = open(os.path.join(tmp, HEADER), 'wb')
+        try:
+            pickle.dump({'volume_header' : l2.volume_header, 'vcp' : l2.vcp,
+                         'msg18' : l2.msg18, 'blocks' : blocks, 'moments' : moments},
+                        fd, 2)
+        finally:
+            fd.close()
+        os.rename(tmp, fstr)
+        return True
+    except Exception:
+        return False  # e.g. a full disk, or the entry was stored by another process
+    finally:
+        l2.clear_cache()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+## Removes the least recently used entries until the cache fits its size.
+#  Anything else in the cache directory, such as entries of older reader
+#  versions or temporary directories left by a killed process, is evicted
+#  in the same way. Failures are ignored.
+#  @param string cache directory
+#  @param int maximum size of the cache in bytes
+#  @param string entry directory which is never removed
+def evict(cachedir, maxsize=MAXSIZE, keep=None):
+    entries = []
+    for fstr in glob.glob(os.path.join(cachedir, '*')):
+        try:
+            entries.append((os.path.getmtime(fstr), entrySize(fstr), fstr))
+        except OSError: pass  # removed by another process
+    entries.sort()
+    total = sum([size for mtime, size, fstr in entries])
+    for mtime, size, fstr in entries:
+        if total <= maxsize:
+            break
+        if fstr == keep:
+            continue
+        if os.path.isdir(fstr):
+            shutil.rmtree(fstr, ignore_errors=True)
+        else:
+            try: os.remove(fstr)
+            except OSError: pass
+        total -= size
+
+
+## Size of a cache entry
+#  @param string entry directory, or file
+#  @returns int size in bytes
+def entrySize(fstr):
+    if not os.path.isdir(fstr):
+        return os.path.getsize(fstr)
+    size = 0
+    for name in os.listdir(fstr):
+        size += os.path.getsize(os.path.join(fstr, name))
+    return size
+
+
+class CachedLevel2File(nexrad_level2.NEXRADLevel2File):
+    """
+    NEXRADLevel2File read from a cache entry written by store.  The header
+    columns and the moment data are memory-mapped from the entry, and
+    get_data looks up the moment data instead of decoding it.  Arrays
+    returned by get_data and msg31s do not view the mappings.
+
+    Parameters
+    ----------
+    fstr : str
+        Entry directory.
+    scans : list or None
+        Scans (0 based) to read.  None (the default) reads all scans, other
+        scans have no rays.
+
+    """
+    def __init__(self, fstr, scans=None):
+        """ initalize the object. """
+        load = lambda name: numpy.load(os.path.join(fstr, name + '.npy'), mmap_mode='r')
+        fd = open(os.path.join(fstr, HEADER), 'rb')
+        try:
+            header = pickle.load(fd)
+        finally:
+            fd.close()
+        self.volume_header = header['volume_header']
+        self.vcp = header['vcp']
+        self.msg18 = header['msg18']
+        self._fh = None
+        self._mmap = None
+        self._raw = None
+        self._start = 0
+        self._record_offsets = load('offsets')
+        self._record_types = load('types')
+        self.msg18_offsets = self._record_offsets[self._record_types == 18]
+        self.msg_headers = load('msg_headers')
+        self._msg31_records = load('msg31_records')
+        self.msg31_headers = load('msg31_headers')
+
+        # rows of the entry, one per msg31 record, which are read
+        self._rows = numpy.arange(len(self.msg31_headers))
+        if scans is not None:
+            elevation_numbers = numpy.asarray(scans) + 1
+            keep = (self.msg31_headers['elevation_number'][:, numpy.newaxis] ==
+                    elevation_numbers).any(axis=1)
+            self._rows = self._rows[keep]
+            self._msg31_records = self._msg31_records[keep]
+            self.msg31_headers = self.msg31_headers[keep]
+            if len(self._rows) == 0:
+                raise ValueError('No MSG31 records found for scans %s' %
+                                 (list(scans), ))
+
+        ptrs = load('ptrs')
+        self._block_ptrs, self.blocks = {}, {}
+        for i, name in enumerate(header['blocks']):
+            self._block_ptrs[name] = self._select(ptrs[i])
+            if os.path.isfile(os.path.join(fstr, 'block%i.npy' % i)):
+                self.blocks[name] = self._select(load('block%i' % i))
+        self._moments = dict([(moment, load('data%i' % i))
+                              for i, moment in enumerate(header['moments'])])
+        self._moment_cache = {}
+
+        elev_nums = self.msg31_headers['elevation_number']
+        self.scan_msgs = [numpy.where(elev_nums == i + 1)[0]
+                          for i in range(elev_nums.max())]
+        self.nscans = len(self.scan_msgs)
+
+    def _select(self, column):
+        """ Return the elements of an entry column for the rows read. """
+        if len(self._rows) == len(column):
+            return column
+        return column[self._rows]
+
+    def _get_raw_data(self, moment, max_ngates, scans):
+        """ Look up, instead of decoding, the raw moment data. """
+        key = (moment, tuple(scans), max_ngates)
+        if key in self._moment_cache:
+            return self._moment_cache[key]
+
+        # rays which lack the moment, and gates beyond the end of a ray,
+        # are stored as 1, like the decoder fills them
+        rows = self._rows[self._msg_nums(scans)]
+        dtype = 'u2' if moment == 'PHI' else 'u1'
+        data = numpy.ones((len(rows), max_ngates), dtype=dtype)
+        if moment in self._moments:
+            stored = self._moments[moment]
+            ngates = min(max_ngates, stored.shape[1])
+            data[:, :ngates] = stored[rows, :ngates]
+        data.flags.writeable = False
+        self._moment_cache[key] = data
+        return data
+
+    def _gate_data(self, moment, msg_num):
+        """ Return the gate data of a moment from a single radial. """
+        if self._block_ptrs[moment][msg_num] < 0:
+            return None
+        ngates = self.blocks[moment]['ngates'][msg_num]
+        data = self._moments[moment][self._rows[msg_num], :ngates]
+        if moment == 'PHI':
+            return data.astype('>u2')
+        return numpy.array(data)
+
+    def close(self):
+        """ Release the mappings of the entry. """
+        self._moments = {}
+        self._moment_cache = {}
@@ -28,6 +28,8 @@ along with RAVE.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
 import numpy
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import ec_RB_io
 import _raveio
 import _polarvolume
@@ -47,6 +49,8 @@ NAME2SOURCE = {"KING_CAX01" : "caxka",
 # File string parameter name, ODIM Quantity, gain, offset, undetect, nodata
 QGOUN = {"dBZ" : ("DBZH", 0.5, -32.0, 0.0, 255.0)}
 
+ELEV_TOLERANCE = 0.05  # Degrees within which a slice matches a requested elevation angle
+
 
 ## Determines if a given file is in RB5 format
 #  @param string name of the input file
@@ -58,51 +62,131 @@ def isRB5(filename):
     return s == '<volume'
 
 
-def readRBScanParameter(filename):
-    rb =  ec_RB_io.read_Rainbow(filename)['volume']
-
-    rbquant =  rb['scan']['slice']['slicedata']['rawdata']
-
-    param = _polarscanparam.new()
-    param.quantity, param.gain, param.offset, param.undetect, param.nodata = QGOUN[rbquant['@type']]
-
-    startangle=rb['scan']['slice']['slicedata']['rayinfo'][0]['data']
+## Looks up a slice parameter. Slices only contain the parameters that differ from
+#  the previous slice, so the previous slices are searched too, then the scan's pargroup.
+#  @param dictionary of the volume, from ec_RB_io.RainbowFile.header
+#  @param list of slice dictionaries, from ec_RB_io.RainbowFile.slices
+#  @param int index of the slice
+#  @param string name of the parameter
+#  @param string name of the parameter in the pargroup, or None
+#  @returns string
+def getSliceAttr(rb, slices, i, key, pargroup_key=None):
+    for sl in reversed(slices[:i+1]):
+        if key in sl:
+            return sl[key]
+    return rb['scan']['pargroup'][pargroup_key or key]
+
+
+## Reads and decompresses the rawdata of one slice, and sorts it according to azimuth
+#  angles, starting with the lowest angle from North, assuming clockwise ...
+#  Only numpy arrays are handled, so this can be run in threads.
+#  @param tuple containing the ec_RB_io.RainbowFile object and one of its rawdata dictionaries
+#  @returns numpy array
+def readSliceData(args):
+    rbf, rawdata = args
+    startangle = rbf.get_blob(rbf.slices[rawdata['slice']]['slicedata']['rayinfo'][0])
     start_az_index = numpy.argmin(startangle)
 
-    mydata = rbquant['data']
-    
-    # Sort data according to azimuth angles, starting with the lowest angle from North, assuming clockwise ...
+    mydata = rbf.get_blob(rawdata['blobdict'])
+
     if start_az_index != 0:
-        begin = mydata[start_az_index:len(startangle)] 
+        begin = mydata[start_az_index:len(startangle)]
         end = mydata[:start_az_index]
         mydata = numpy.concatenate((begin,end))
-    
+
+    return mydata
+
+
+## Creates a parameter from sorted slice data
+#  @param string Rainbow data type, a key in QGOUN
+#  @param numpy array from readSliceData
+#  @returns PolarScanParam
+def makeParameter(rbtype, mydata):
+    param = _polarscanparam.new()
+    param.quantity, param.gain, param.offset, param.undetect, param.nodata = QGOUN[rbtype]
     param.setData(mydata)
+    return param
+
+
+def readRBScanParameter(filename):
+    rbf = ec_RB_io.RainbowFile(filename)
+    rb = rbf.header['volume']
+
+    rawdata = rbf.rawdata[0]
+    param = makeParameter(rawdata['type'], readSliceData((rbf, rawdata)))
 
     return rb, param
 
 
-def makeScanFromRB(rb):
+def makeScanFromRB(rb, slices=None, i=0):
+    if slices is None:
+        slices = [rb['scan']['slice']]
+
     scan = _polarscan.new()
 
     scan.date = str(rb['@datetime'][:4]+rb['@datetime'][5:7]+rb['@datetime'][8:10])
     scan.time = str(rb['@datetime'][11:13]+rb['@datetime'][14:16]+rb['@datetime'][17:19])
 
     scan.beamwidth = float(rb['sensorinfo']['beamwidth']) * dr
-    scan.elangle = float(rb['scan']['pargroup']['posele']) * dr
-    scan.rscale = float(rb['scan']['slice']['rangestep']) * 1000.0
+    if len(slices) == 1:
+        scan.elangle = float(rb['scan']['pargroup']['posele']) * dr
+    else:
+        scan.elangle = float(getSliceAttr(rb, slices, i, 'posangle', 'posele')) * dr
+    scan.rscale = float(getSliceAttr(rb, slices, i, 'rangestep')) * 1000.0
 
     return scan
 
 
-def makePvolFromFiles(filenames):
+## Reads Rainbow 5 files, one per moment, each containing one or more slices, into a volume.
+#  Only the blobs of the requested quantities and elevations are decompressed, in a
+#  pool of threads, since zlib releases the GIL. RAVE objects are created in this thread.
+#  @param list of input file strings
+#  @param list of ODIM quantities to read, or None for all. Moments which QGOUN cannot map
+#  to an ODIM quantity are skipped.
+#  @param list of elevation angles in degrees to read, or None for all
+#  @param int number of threads, or None for the number of CPUs
+#  @returns PolarVolume
+def makePvolFromFiles(filenames, quantities=None, elevations=None, nthreads=None):
     pvol = _polarvolume.new()
 
+    tasks, scans = [], []
     for fstr in filenames:
-        rb, param = readRBScanParameter(fstr)
-        scan = makeScanFromRB(rb)
-        scan.addParameter(param)
-        pvol.addScan(scan)
+        rbf = ec_RB_io.RainbowFile(fstr)
+        rb = rbf.header['volume']
+        for rawdata in rbf.rawdata:
+            if rawdata['type'] not in QGOUN:
+                continue  # No ODIM quantity to map it to
+            if quantities is not None and QGOUN[rawdata['type']][0] not in quantities:
+                continue
+            scan = makeScanFromRB(rb, rbf.slices, rawdata['slice'])
+            if elevations is not None:
+                elangle = scan.elangle * rd
+                if not [e for e in elevations if abs(elangle - e) < ELEV_TOLERANCE]:
+                    continue
+            tasks.append((rbf, rawdata))
+            scans.append(scan)
+
+    if nthreads is None:
+        nthreads = multiprocessing.cpu_count()
+    if len(tasks) > 1 and nthreads > 1:
+        pool = ThreadPool(min(nthreads, len(tasks)))
+        try:
+            datasets = pool.map(readSliceData, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        del pool
+    else:
+        datasets = map(readSliceData, tasks)
+
+    # Moments of the same sweep, from different files, are merged into one scan
+    merged = {}
+    for (rbf, rawdata), scan, mydata in zip(tasks, scans, datasets):
+        key = (scan.date, scan.time, scan.elangle)
+        if key not in merged:
+            merged[key] = scan
+            pvol.addScan(scan)
+        merged[key].addParameter(makeParameter(rawdata['type'], mydata))
 
     pvol.sortByElevations(1)
 
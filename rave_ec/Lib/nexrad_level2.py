@@ -7,15 +7,27 @@ pyart.io.nexrad_level2
     :template: dev_template.rst
 
     NEXRADLevel2File
+    NEXRADLevel2Assembler
 
 .. autosummary::
     :toctree: generated/
 
+    _from_records
+    _gather_gates
+    _has_fileno
     _decompress_records
+    _locate_chunks
+    _decompress_chunks
+    _decompress_scan_chunks
+    _decompress_sequentially
+    _locate_records
+    _locate_msg31_blocks
     _get_record_from_buf
     _get_msg31_data_block
     _structure_size
+    _structure_dtype
     _unpack_from_buf
+    _unpack_array
     _unpack_structure
 
 
@@ -75,10 +87,14 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 import bz2
+import mmap
 import struct
 from datetime import datetime, timedelta
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 
 
 class NEXRADLevel2File(object):
@@ -96,11 +112,38 @@ class NEXRADLevel2File(object):
     ----------
     filename : str
         Filename of Archive II file to read.
+    scans : list or None
+        Scans (0 based) to read.  None (the default) reads all scans.  For
+        BZ2 compressed files only the chunks which hold radials of these
+        scans are decompressed and parsed, other scans have no rays.
+    use_mmap : bool
+        True to memory-map uncompressed files instead of reading them, so
+        that gate data is only copied when get_data gathers it or a msg31s
+        element is built.  No array returned by this class views the
+        mapping, so all remain valid after the file is closed.  Ignored for
+        compressed files and for file-like objects without a file
+        descriptor.
+    record_index : tuple of arrays or None
+        Offsets and message types of the records of an uncompressed file,
+        as given by the record_index attribute when the same records were
+        read before.  Locating the records is then skipped.  None (the
+        default) locates them.  Ignored for compressed files.
 
     Attributes
     ----------
-    msg31s : list
-        Message 31 message in the file.
+    msg31s : sequence
+        Message 31 message in the file, as dictionaries.  These are built
+        on demand from the structured arrays below when an element is
+        accessed.
+    msg_headers : structured ndarray
+        Message headers of all records in the file.
+    msg31_headers : structured ndarray
+        Message 31 headers of all radials in the file.  Each field is a
+        column with one element per radial.
+    blocks : dict
+        Structured arrays of the VOL, ELV and RAD data blocks and of the
+        moment data block descriptors, keyed by block name, with one element
+        per radial.  Elements of radials which lack a block are zero.
     nscans : int
         Number of scans in the file.
     scan_msgs : list of arrays
@@ -110,10 +153,30 @@ class NEXRADLevel2File(object):
         Volume header.
     vcp : dict
         VCP information dictionary.
-    _records : list
-        A list of all records (message) in the file.
+    msg18_offsets : ndarray
+        Offsets of the Message 18 (RDA adaptation data) segments in the
+        decompressed buffer, in order.
+    msg18 : bytes or None
+        Message 18 adaptation data, MSG18_SIZE bytes starting at the
+        'current' or 'baseline' label found in the first segment.  None
+        when the file has no Message 18.
+    record_index : tuple of arrays
+        Offset, relative to the first record, and message type of every
+        record in the file.
+    _record_offsets : ndarray
+        Offset of every record (message) in the decompressed buffer.
+    _record_types : ndarray
+        Message type of every record in the decompressed buffer.
+    _block_ptrs : dict
+        Offsets of the data blocks of every radial in the decompressed
+        buffer, keyed by block name, -1 where a radial lacks the block.
+    _moment_cache : dict
+        Raw moment data already decoded by get_data, keyed by moment,
+        scans and number of gates.
     _fh : file-like
         File like object from which data is read.
+    _mmap : mmap or None
+        Memory map of an uncompressed file, None if the file was read.
 
     References
     ----------
@@ -123,7 +186,8 @@ class NEXRADLevel2File(object):
 
 
     """
-    def __init__(self, filename):
+    def __init__(self, filename, scans=None, use_mmap=False,
+                 record_index=None):
         """ initalize the object. """
         # read in the volume header and compression_record
         if hasattr(filename, 'read'):
@@ -136,41 +200,180 @@ class NEXRADLevel2File(object):
 
         # read the records in the file, decompressing as needed
         s = slice(CONTROL_WORD_SIZE, CONTROL_WORD_SIZE + 2)
+        self._fh = fh
+        self._mmap = None
         if compression_record[s] == b'BZ':
-            buf = _decompress_records(fh)
+            self._read_records(_decompress_records(fh, scans=scans), scans)
         elif compression_record[s] == b'\x00\x00':
-            buf = fh.read()
+            if use_mmap and _has_fileno(fh):
+                # the records start after the volume header and the
+                # compression record, offsets are relative to the mapping
+                self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+                self._read_records(self._mmap, scans,
+                                   size + COMPRESSION_RECORD_SIZE,
+                                   record_index)
+            else:
+                self._read_records(fh.read(), scans, 0, record_index)
         else:
             raise IOError('unknown compression record')
-        self._fh = fh
-        self._buf = buf  # Added by Daniel Michelson
 
-        # read the records from the buffer
-        self._records = []
-        buf_length = len(buf)
-        pos = 0
-        while pos < buf_length:
-            pos, dic = _get_record_from_buf(buf, pos)
-            self._records.append(dic)
+    def _read_records(self, buf, scans=None, start=0, record_index=None):
+        """ Decode the records of the decompressed buffer. """
+        self._start = start
+        self._raw = np.frombuffer(buf, dtype='u1')
 
-        # pull out msg31 records which contain the moment data.
-        self.msg31s = [r for r in self._records if r['header']['type'] == 31]
-        if len(self.msg31s) == 0:
+        # locate the records in the buffer, then decode the headers of all
+        # msg31 records, which contain the moment data, at once.
+        if record_index is None:
+            record_index = _locate_records(buf, start)
+        else:
+            record_index = (record_index[0] + start, record_index[1])
+        self._record_offsets, self._record_types = record_index
+        self.msg18_offsets = self._record_offsets[self._record_types == 18]
+        self.msg18 = _get_msg18(self._raw, self.msg18_offsets)
+        self.msg_headers = _unpack_array(self._raw, self._record_offsets,
+                                         MSG_HEADER)
+        self._msg31_records = np.where(self._record_types == 31)[0]
+        if len(self._msg31_records) == 0:
             raise ValueError('No MSG31 records found, cannot read file')
-        elev_nums = np.array([m['msg31_header']['elevation_number']
-                             for m in self.msg31s])
+        msg31_pos = (self._record_offsets[self._msg31_records] +
+                     _structure_size(MSG_HEADER))
+        self.msg31_headers = _unpack_array(self._raw, msg31_pos, MSG_31)
+        if scans is not None:
+            elevation_numbers = np.asarray(scans) + 1
+            keep = (self.msg31_headers['elevation_number'][:, np.newaxis] ==
+                    elevation_numbers).any(axis=1)
+            self._msg31_records = self._msg31_records[keep]
+            msg31_pos = msg31_pos[keep]
+            self.msg31_headers = self.msg31_headers[keep]
+            if len(self._msg31_records) == 0:
+                raise ValueError('No MSG31 records found for scans %s' %
+                                 (list(scans), ))
+        self._block_ptrs = _locate_msg31_blocks(self._raw, msg31_pos,
+                                                self.msg31_headers)
+        self.blocks = {}
+        for block_name, ptrs in self._block_ptrs.items():
+            if block_name not in DATA_BLOCKS:
+                continue
+            present = ptrs >= 0
+            dtype = _structure_dtype(DATA_BLOCKS[block_name])
+            self.blocks[block_name] = np.zeros(len(ptrs), dtype=dtype)
+            self.blocks[block_name][present] = _unpack_array(
+                self._raw, ptrs[present], DATA_BLOCKS[block_name])
+
+        # moment data is decoded when first requested, see get_data
+        self._moment_cache = {}
+
+        elev_nums = self.msg31_headers['elevation_number']
         self.scan_msgs = [np.where(elev_nums == i + 1)[0]
                           for i in range(elev_nums.max())]
         self.nscans = len(self.scan_msgs)
 
         # pull out the vcp record
-        self.vcp = [r for r in self._records if r['header']['type'] == 5][0]
+        vcp_pos = self._record_offsets[self._record_types == 5][0]
+        self.vcp = _get_record_from_buf(buf, vcp_pos)[1]
 
         return
 
+    @property
+    def record_index(self):
+        """ Offsets and message types of all records. """
+        return self._record_offsets - self._start, self._record_types
+
+    @property
+    def msg31s(self):
+        """ Message 31 messages as a sequence of dictionaries. """
+        return _Msg31Sequence(self)
+
+    def _get_raw_data(self, moment, max_ngates, scans):
+        """ Decode, or look up the already decoded, raw moment data. """
+        key = (moment, tuple(scans), max_ngates)
+        if key in self._moment_cache:
+            return self._moment_cache[key]
+
+        # extract the data of all rays at once, rays which lack the moment
+        # are filled with 1 like gates beyond the end of a ray
+        msg_nums = self._msg_nums(scans)
+        word_size = 2 if moment == 'PHI' else 1
+        if moment in self.blocks:
+            ptrs = (self._block_ptrs[moment][msg_nums] +
+                    _structure_size(GENERIC_DATA_BLOCK))
+            ptrs[self._block_ptrs[moment][msg_nums] < 0] = -1
+            ngates = self.blocks[moment]['ngates'][msg_nums]
+        else:
+            ptrs = np.empty(len(msg_nums), dtype=np.intp)
+            ptrs.fill(-1)
+            ngates = np.zeros(len(msg_nums), dtype=np.intp)
+        data = _gather_gates(self._raw, ptrs, ngates, max_ngates, word_size)
+        data.flags.writeable = False
+        self._moment_cache[key] = data
+        return data
+
+    def _gate_data(self, moment, msg_num):
+        """ Return the gate data of a moment from a single radial. """
+        ptr = self._block_ptrs[moment][msg_num]
+        if ptr < 0:
+            return None
+        ngates = self.blocks[moment]['ngates'][msg_num]
+        ptr2 = ptr + _structure_size(GENERIC_DATA_BLOCK)
+        # copied, so that the file can be closed, or its buffer released
+        if moment == 'PHI':
+            return self._raw[ptr2: ptr2 + ngates * 2].view('>u2').copy()
+        return self._raw[ptr2: ptr2 + ngates].copy()
+
+    def _msg31_dict(self, msg_num):
+        """ Return a msg31 record as a dictionary, like _get_record_from_buf.
+        """
+        dic = {
+            'header': _array_dict(self.msg_headers,
+                                  self._msg31_records[msg_num]),
+            'msg31_header': _array_dict(self.msg31_headers, msg_num)}
+        for block_name, ptrs in self._block_ptrs.items():
+            if ptrs[msg_num] < 0:
+                continue
+            if block_name not in self.blocks:
+                dic[block_name] = {}
+                continue
+            dic[block_name] = _array_dict(self.blocks[block_name], msg_num)
+            if block_name in MOMENTS:
+                dic[block_name]['data'] = self._gate_data(block_name, msg_num)
+        return dic
+
+    def clear_cache(self):
+        """
+        Forget the moment data already decoded by get_data, so that its
+        memory can be released once it is no longer used elsewhere.  Data
+        requested again is decoded again.
+        """
+        self._moment_cache = {}
+
     def close(self):
         """ Close the file. """
-        self._fh.close()
+        if self._mmap is not None:
+            self._raw = None
+            self._mmap.close()
+            self._mmap = None
+        if self._fh is not None:
+            self._fh.close()
+
+    def save_uncompressed(self, filename):
+        """
+        Write the records as an uncompressed Archive II file, which can
+        later be opened with use_mmap, for example on local disk.
+
+        Parameters
+        ----------
+        filename : str
+            Filename of the uncompressed Archive II file to write.
+
+        """
+        fmt = '>' + ''.join([i[1] for i in VOLUME_HEADER])
+        volume_header = struct.pack(fmt, *[self.volume_header[i[0]]
+                                           for i in VOLUME_HEADER])
+        with open(filename, 'wb') as fh:
+            fh.write(volume_header)
+            fh.write(b'\x00' * COMPRESSION_RECORD_SIZE)
+            fh.write(self._raw[self._start:].tobytes())
 
     def location(self):
         """
@@ -186,8 +389,9 @@ class NEXRADLevel2File(object):
             Height of radar and feedhorn in meters above mean sea level.
 
         """
-        dic = self.msg31s[0]['VOL']
-        return dic['lat'], dic['lon'], dic['height'] + dic['feedhorn_height']
+        vol = self.blocks['VOL'][0]
+        return (float(vol['lat']), float(vol['lon']),
+                int(vol['height']) + int(vol['feedhorn_height']))
 
     def scan_info(self):
         """
@@ -207,13 +411,15 @@ class NEXRADLevel2File(object):
         info = []
         for scan in range(self.nscans):
             nrays = self.get_nrays(scan)
+            if nrays == 0:  # scan not read
+                info.append({'nrays': 0, 'ngates': [], 'moments': []})
+                continue
 
             msg31_number = self.scan_msgs[scan][0]
-            msg = self.msg31s[msg31_number]
-
-            nexrad_moments = ['REF', 'VEL', 'SW', 'ZDR', 'PHI', 'RHO']
-            moments = [f for f in nexrad_moments if f in msg]
-            ngates = [msg[f]['ngates'] for f in moments]
+            moments = [f for f in MOMENTS if f in self.blocks and
+                       self._block_ptrs[f][msg31_number] >= 0]
+            ngates = [int(self.blocks[f]['ngates'][msg31_number])
+                      for f in moments]
             info.append({
                 'nrays': nrays,
                 'ngates': ngates,
@@ -254,10 +460,10 @@ class NEXRADLevel2File(object):
             Range in meters from the antenna to the center of gate (bin).
 
         """
-        dic = self.msg31s[self.scan_msgs[scan_num][0]][moment]
-        ngates = dic['ngates']
-        first_gate = dic['first_gate']
-        gate_spacing = dic['gate_spacing']
+        dic = self.blocks[moment][self.scan_msgs[scan_num][0]]
+        ngates = int(dic['ngates'])
+        first_gate = int(dic['first_gate'])
+        gate_spacing = int(dic['gate_spacing'])
         return np.arange(ngates) * gate_spacing + first_gate
 
     # helper functions for looping over scans
@@ -270,16 +476,14 @@ class NEXRADLevel2File(object):
         Return an array of msg31 header elements for all rays in scans.
         """
         msg_nums = self._msg_nums(scans)
-        t = [self.msg31s[i]['msg31_header'][key] for i in msg_nums]
-        return np.array(t)
+        return _native(self.msg31_headers[key][msg_nums])
 
     def _msg31_rad_array(self, scans, key):
         """
         Return an array of msg31 RAD elements for all rays in scans.
         """
         msg_nums = self._msg_nums(scans)
-        t = [self.msg31s[i]['RAD'][key] for i in msg_nums]
-        return np.array(t)
+        return _native(self.blocks['RAD'][key][msg_nums])
 
     def get_times(self, scans=None):
         """
@@ -418,7 +622,39 @@ class NEXRADLevel2File(object):
             scans = range(self.nscans)
         return self._msg31_rad_array(scans, 'unambig_range') * 0.1
 
-    def get_data(self, moment, max_ngates, scans=None, raw_data=False):
+    def get_moment_scaling(self, moment, scans=None):
+        """
+        Retrieve the scale and offset of a moment in a given set of scans.
+
+        Parameters
+        ----------
+        moment : 'REF', 'VEL', 'SW', 'ZDR', 'PHI', or 'RHO'
+            Moment of interest.
+        scans : list or None.
+            Scans (0 based) to search for the moment.  None (the default)
+            searches all scans in the volume.
+
+        Returns
+        -------
+        scale, offset : float32
+            Scale and offset which convert raw data to values as
+            (raw - offset) / scale, taken from the first ray of the first
+            scan which contains the moment.  None if no scan contains it.
+
+        """
+        if scans is None:
+            scans = range(self.nscans)
+        for scan in scans:  # find a scan which contains the moment
+            if len(self.scan_msgs[scan]) == 0:
+                continue
+            msg_num = self.scan_msgs[scan][0]
+            if moment in self.blocks and self._block_ptrs[moment][msg_num] >= 0:
+                return (np.float32(self.blocks[moment]['scale'][msg_num]),
+                        np.float32(self.blocks[moment]['offset'][msg_num]))
+        return None
+
+    def get_data(self, moment, max_ngates, scans=None, raw_data=False,
+                 raw_mask=False, copy=True):
         """
         Retrieve moment data for a given set of scans.
 
@@ -441,64 +677,465 @@ class NEXRADLevel2File(object):
         scans : list or None.
             Scans to retrieve data from (0 based).  None (the default) will
             get the data for all scans in the volume.
+        raw_mask : bool
+            True to return the raw data together with a boolean array which
+            is True where the data would be masked, instead of a scaled
+            masked array.  Use get_moment_scaling to scale the raw data.
+        copy : bool
+            The raw data is decoded from the file the first time it is
+            requested for a set of scans and kept for later calls.  True
+            (the default) returns a copy of it when raw_data or raw_mask is
+            True.  False returns the kept array itself, which is read-only
+            and shared by every caller asking for the same data.
 
         Returns
         -------
         data : ndarray
+            Moment data.
+        mask : ndarray
+            Only returned when raw_mask is True.
 
         """
         if scans is None:
             scans = range(self.nscans)
-
-        # determine the number of rays
-        msg_nums = self._msg_nums(scans)
-        nrays = len(msg_nums)
-
-        # extract the data
-        if moment != 'PHI':
-            data = np.ones((nrays, max_ngates), dtype='u1')
-        else:
-            data = np.ones((nrays, max_ngates), dtype='u2')
-        for i, msg_num in enumerate(msg_nums):
-            msg = self.msg31s[msg_num]
-            if moment not in msg.keys():
-                continue
-            ngates = msg[moment]['ngates']
-            data[i, :ngates] = msg[moment]['data']
+        data = self._get_raw_data(moment, max_ngates, scans)
 
         # return raw data if requested
         if raw_data:
-            return data
+            return data.copy() if copy else data
+        if raw_mask:
+            return (data.copy() if copy else data), data <= 1
 
         # mask, scan and offset, assume that the offset and scale
         # are the same in all scans/gates
-        for scan in scans:  # find a scan which contains the moment
-            msg_num = self.scan_msgs[scan][0]
-            msg = self.msg31s[msg_num]
-            if moment in msg.keys():
-                offset = np.float32(msg[moment]['offset'])
-                scale = np.float32(msg[moment]['scale'])
-                return (np.ma.masked_less_equal(data, 1) - offset) / (scale)
+        scaling = self.get_moment_scaling(moment, scans)
+        if scaling is not None:
+            scale, offset = scaling
+            return (np.ma.masked_less_equal(data, 1) - offset) / (scale)
 
         # moment is not present in any scan, mask all values
         return np.ma.masked_less_equal(data, 1)
 
 
-def _decompress_records(file_handler):
+class NEXRADLevel2Assembler(object):
+    """
+    Class for assembling a NEXRAD Level II volume from the chunks of an LDM
+    feed as they arrive.
+
+    Over LDM a volume arrives as a start chunk, holding the volume header
+    and the compressed metadata records, followed by chunks of compressed
+    radials.  The radials of each chunk are located as soon as it is added,
+    so that every elevation cut can be read as soon as it is complete,
+    without waiting for the end of the volume.
+
+    Attributes
+    ----------
+    volume_header : dict
+        Volume header, None until the start chunk has been added.
+    completed : list
+        Scans (0 based) completed so far, in order of completion.
+    _parts : list
+        Decompressed records of every compressed chunk added.
+    _part_elevations : list of arrays
+        Elevation numbers of the radials held by each element of _parts.
+    _elevation : int
+        Elevation number of the last radial added.
+
+    """
+    def __init__(self):
+        """ initalize the object. """
+        self.volume_header = None
+        self.completed = []
+        self._parts = []
+        self._part_elevations = []
+        self._elevation = 0
+
+    def add_chunk(self, chunk):
+        """
+        Add a chunk received from LDM.
+
+        Parameters
+        ----------
+        chunk : bytes
+            Either the start chunk, holding the volume header followed by
+            the compressed metadata records, or a chunk of compressed
+            radials.  Compressed records are preceded by their control word.
+
+        Returns
+        -------
+        scans : list
+            Scans (0 based) completed by the radials in this chunk.
+
+        """
+        pos = 0
+        if chunk[:3] == b'AR2' or chunk[:7] == b'ARCHIVE':
+            pos = _structure_size(VOLUME_HEADER)
+            self.volume_header = _unpack_structure(chunk[:pos], VOLUME_HEADER)
+        scans = []
+        while pos < len(chunk):
+            size = abs(struct.unpack_from('>i', chunk, pos)[0])
+            pos += CONTROL_WORD_SIZE
+            scans.extend(self._add_records(bz2.decompress(chunk[pos:pos + size])))
+            pos += size
+        return scans
+
+    def _add_records(self, data):
+        """ Add the decompressed records of a chunk, return completed scans.
+        """
+        offsets, types = _locate_records(data, COMPRESSION_RECORD_SIZE)
+        offsets = offsets[types == 31]
+        raw = np.frombuffer(data, dtype='u1')
+        elevations = raw[offsets + MSG31_ELEVATION_NUMBER]
+        radial_status = raw[offsets + MSG31_RADIAL_STATUS]
+        self._parts.append(data)
+        self._part_elevations.append(elevations)
+
+        scans = []
+        for elevation, status in zip(elevations.tolist(),
+                                     radial_status.tolist()):
+            # a new elevation number also ends the previous cut
+            if elevation != self._elevation:
+                scans.extend(self._complete(self._elevation))
+                self._elevation = elevation
+            if status in (END_OF_ELEVATION, END_OF_VOLUME):
+                scans.extend(self._complete(elevation))
+        return scans
+
+    def _complete(self, elevation):
+        """ Mark the scan of an elevation number as complete. """
+        scan = elevation - 1
+        if elevation == 0 or scan in self.completed:
+            return []
+        self.completed.append(scan)
+        return [scan]
+
+    def get_file(self, scans=None):
+        """
+        Return the radials received so far.
+
+        Parameters
+        ----------
+        scans : list or None
+            Scans (0 based) to include.  None (the default) includes the
+            radials of all scans received so far.
+
+        Returns
+        -------
+        nfile : NEXRADLevel2File
+            Level II file object holding the metadata records and the
+            requested radials.
+
+        """
+        if self.volume_header is None:
+            raise ValueError('No volume header received, cannot read chunks')
+        if scans is None:
+            parts = self._parts
+        else:
+            elevations = set(i + 1 for i in scans)
+            parts = [part for part, part_elevations in
+                     zip(self._parts, self._part_elevations)
+                     if len(part_elevations) == 0 or
+                     elevations.intersection(part_elevations.tolist())]
+        buf = b''.join([parts[0][COMPRESSION_RECORD_SIZE:]] + parts[1:])
+        return _from_records(self.volume_header, buf, scans)
+
+
+def _from_records(volume_header, buf, scans=None):
+    """
+    Create a NEXRADLevel2File from a volume header and the decompressed
+    records which follow it.
+    """
+    nfile = NEXRADLevel2File.__new__(NEXRADLevel2File)
+    nfile.volume_header = volume_header
+    nfile._fh = None
+    nfile._mmap = None
+    nfile._read_records(buf, scans)
+    return nfile
+
+
+def _gather_gates(raw, ptrs, ngates, max_ngates, word_size):
+    """
+    Gather the gate data of many rays into a (nrays, max_ngates) array.
+    Gates beyond the end of a ray, and rays with a negative pointer, are
+    filled with 1.
+    """
+    nrays = len(ptrs)
+    ngates = np.minimum(ngates, max_ngates)
+    ngates[ptrs < 0] = 0
+    data = np.empty((nrays, max_ngates * word_size), dtype='u1')
+
+    # rays of a cut are evenly spaced in the buffer and have the same
+    # number of gates, copy each such run through a strided view
+    step = np.diff(ptrs)
+    new_run = np.ones(nrays, dtype=bool)
+    new_run[1:] = ngates[1:] != ngates[:-1]
+    new_run[2:] |= step[1:] != step[:-1]
+    bounds = np.append(np.flatnonzero(new_run), nrays)
+    runs = list(zip(bounds[:-1], bounds[1:]))
+    for start, end in runs:
+        nbytes = ngates[start] * word_size
+        if nbytes == 0:
+            continue
+        if end - start > 1 and step[start] > 0:
+            data[start:end, :nbytes] = as_strided(
+                raw[ptrs[start]:], (end - start, nbytes), (step[start], 1))
+        else:
+            for i in range(start, end):
+                data[i, :nbytes] = raw[ptrs[i]:ptrs[i] + nbytes]
+
+    if word_size == 2:  # big-endian
+        data = data.view('>u2').astype('u2')
+    for start, end in runs:
+        data[start:end, ngates[start]:] = 1
+    return data
+
+
+def _has_fileno(file_handler):
+    """ Return True if a file-like object has a file descriptor. """
+    try:
+        file_handler.fileno()
+    except (AttributeError, IOError, ValueError):
+        return False
+    return True
+
+
+def _decompress_records(file_handler, threads=None, scans=None):
     """
     Decompressed the records from an BZ2 compressed Archive 2 file.
+
+    The chunks are located using their control words and decompressed
+    concurrently by a pool of threads, bz2 releases the GIL while it works.
+    When scans are given only the metadata chunks and the chunks holding
+    radials of those scans are decompressed.
     """
+    if threads is None:
+        threads = min(DECOMPRESS_THREADS, cpu_count())
     file_handler.seek(0)
     cbuf = file_handler.read()    # read all data from the file
+    chunks = _locate_chunks(cbuf)
+    if chunks is None:
+        parts = _decompress_sequentially(cbuf)
+    elif scans is not None:
+        parts = _decompress_scan_chunks(_ChunkIndex(cbuf, chunks), scans)
+    else:
+        parts = _decompress_chunks(cbuf, chunks, threads)
+    del cbuf    # release the compressed data before joining the parts
+    parts[0] = parts[0][COMPRESSION_RECORD_SIZE:]
+    return _join_releasing(parts)
+
+
+def _join_releasing(parts):
+    """
+    Join decompressed parts into one buffer, releasing each part as soon
+    as it is copied, so that the parts and the joined buffer are never
+    held in memory in full at the same time.
+    """
+    buf = bytearray(sum(len(part) for part in parts))
+    pos = 0
+    for i in range(len(parts)):
+        buf[pos:pos + len(parts[i])] = parts[i]
+        pos += len(parts[i])
+        parts[i] = None
+    return buf
+
+
+def _locate_chunks(cbuf):
+    """
+    Find the offset and size of the BZ2 compressed chunks of an Archive 2
+    file from their control words.  Returns None if the control words are
+    not consistent with the file.
+    """
+    chunks = []
+    pos = _structure_size(VOLUME_HEADER)
+    while pos < len(cbuf):
+        if pos + CONTROL_WORD_SIZE > len(cbuf):
+            return None
+        size = abs(struct.unpack_from('>i', cbuf, pos)[0])
+        pos += CONTROL_WORD_SIZE
+        if size == 0 or pos + size > len(cbuf) or cbuf[pos:pos + 2] != b'BZ':
+            return None
+        chunks.append((pos, size))
+        pos += size
+    return chunks
+
+
+def _decompress_chunks(cbuf, chunks, threads):
+    """ Decompress located BZ2 chunks, using a pool of threads. """
+    def decompress(chunk):
+        pos, size = chunk
+        return bz2.decompress(cbuf[pos:pos + size])
+
+    if threads <= 1 or len(chunks) == 1:
+        return [decompress(chunk) for chunk in chunks]
+    pool = ThreadPool(min(threads, len(chunks)))
+    try:
+        return pool.map(decompress, chunks)
+    finally:
+        pool.close()
+
+
+def _decompress_scan_chunks(index, scans):
+    """
+    Decompress the metadata chunks and the chunks which hold radials of
+    the requested scans.  Radials are stored in order of elevation number,
+    so chunks below the lowest requested scan are skipped by bisection
+    and the search stops past the highest requested scan.
+    """
+    elevations = set(i + 1 for i in scans)
+    lowest = min(elevations)
+    highest = max(elevations)
+
+    # the metadata chunks precede the first chunk holding radials
+    first = 0
+    while first < len(index.chunks) and len(index.elevations(first)) == 0:
+        first += 1
+    selected = list(range(first))
+
+    # find the last chunk starting below the lowest requested elevation
+    lo, hi = first, len(index.chunks)
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if index.first_elevation(mid) < lowest:
+            lo = mid
+        else:
+            hi = mid
+
+    for i in range(lo, len(index.chunks)):
+        chunk_elevations = index.elevations(i)
+        if len(chunk_elevations) and chunk_elevations[0] > highest:
+            break
+        if elevations.intersection(chunk_elevations.tolist()):
+            selected.append(i)
+    return [index.data(i) for i in selected]
+
+
+def _decompress_sequentially(cbuf):
+    """
+    Decompress the BZ2 chunks of an Archive 2 file one after the other,
+    relying on the decompressor to find where each chunk ends.
+    """
     decompressor = bz2.BZ2Decompressor()
     skip = _structure_size(VOLUME_HEADER) + CONTROL_WORD_SIZE
-    buf = decompressor.decompress(cbuf[skip:])
+    parts = [decompressor.decompress(cbuf[skip:])]
     while len(decompressor.unused_data):
         cbuf = decompressor.unused_data
         decompressor = bz2.BZ2Decompressor()
-        buf += decompressor.decompress(cbuf[CONTROL_WORD_SIZE:])
+        parts.append(decompressor.decompress(cbuf[CONTROL_WORD_SIZE:]))
+    return parts
 
-    return buf[COMPRESSION_RECORD_SIZE:]
+
+class _ChunkIndex(object):
+    """
+    Index of the BZ2 compressed chunks of an Archive 2 file and of the
+    elevation numbers of the radials held by each chunk.  Chunks are
+    decompressed when first needed.
+    """
+    def __init__(self, cbuf, chunks):
+        self._cbuf = cbuf
+        self.chunks = chunks
+        self._data = {}
+        self._elevations = {}
+
+    def data(self, i):
+        """ Return the decompressed records of a chunk. """
+        if i not in self._data:
+            pos, size = self.chunks[i]
+            self._data[i] = bz2.decompress(self._cbuf[pos:pos + size])
+        return self._data[i]
+
+    def elevations(self, i):
+        """ Return the elevation numbers of the radials in a chunk. """
+        if i not in self._elevations:
+            data = self.data(i)
+            offsets, types = _locate_records(data, COMPRESSION_RECORD_SIZE)
+            offsets = offsets[types == 31] + MSG31_ELEVATION_NUMBER
+            self._elevations[i] = np.frombuffer(data, dtype='u1')[offsets]
+        return self._elevations[i]
+
+    def first_elevation(self, i):
+        """ Elevation number of the first radial in a chunk, 0 if none. """
+        chunk_elevations = self.elevations(i)
+        if len(chunk_elevations) == 0:
+            return 0
+        return chunk_elevations[0]
+
+
+class _Msg31Sequence(object):
+    """
+    Sequence of msg31 dictionaries built on demand from the structured
+    header arrays of a NEXRADLevel2File.
+    """
+    def __init__(self, nfile):
+        self._nfile = nfile
+
+    def __len__(self):
+        return len(self._nfile.msg31_headers)
+
+    def __getitem__(self, msg_num):
+        if not -len(self) <= msg_num < len(self):
+            raise IndexError('msg31 index out of range')
+        return self._nfile._msg31_dict(msg_num)
+
+
+def _locate_records(buf, pos=0):
+    """ Find the offset and message type of every record in a buffer. """
+    msg_header_size = _structure_size(MSG_HEADER)
+    offsets = []
+    types = []
+    buf_length = len(buf)
+    while pos < buf_length:
+        size, msg_type = struct.unpack_from('>HxB', buf, pos)
+        offsets.append(pos)
+        types.append(msg_type)
+        if msg_type == 31:
+            pos += msg_header_size + size * 2 - 4
+        else:
+            pos += RECORD_SIZE
+    return np.array(offsets, dtype=np.intp), np.array(types, dtype='u1')
+
+
+def _get_msg18(raw, msg18_offsets):
+    """
+    Copy the Message 18 adaptation data out of a byte array, from its label
+    in the first segment.  None if there is no Message 18.
+    """
+    if len(msg18_offsets) == 0:
+        return None
+    pos = msg18_offsets[0]
+    segment = raw[pos:pos + RECORD_SIZE].tobytes()
+    start = segment.find(b'current')
+    if start < 0:
+        start = segment.find(b'baseline')
+    if start < 0:
+        return None
+    msg18 = raw[pos + start:pos + start + MSG18_SIZE].tobytes()
+    if len(msg18) != MSG18_SIZE:
+        return None
+    return msg18
+
+
+def _locate_msg31_blocks(raw, msg31_pos, msg31_headers):
+    """
+    Find the offsets of the data blocks of all msg31 records, keyed by
+    block name.
+    """
+    nmsgs = len(msg31_pos)
+    name_chars = np.arange(1, 4)
+    block_ptrs = {}
+    for i in range(1, 10):
+        block_pointer = msg31_headers['block_pointer_%i' % i].astype(np.intp)
+        present = np.where(block_pointer > 0)[0]
+        ptrs = msg31_pos[present] + block_pointer[present]
+        names = raw[ptrs[:, np.newaxis] + name_chars].view('S3')[:, 0]
+        for name in np.unique(names):
+            # restore the NULs which NumPy strips, like _get_msg31_data_block
+            block_name = name.ljust(3, b'\x00').decode('ascii').strip()
+            if block_name not in block_ptrs:
+                block_ptrs[block_name] = np.empty(nmsgs, dtype=np.intp)
+                block_ptrs[block_name].fill(-1)
+            match = names == name
+            block_ptrs[block_name][present[match]] = ptrs[match]
+    return block_ptrs
 
 
 def _get_record_from_buf(buf, pos):
@@ -568,12 +1205,60 @@ def _structure_size(structure):
     return struct.calcsize('>' + ''.join([i[1] for i in structure]))
 
 
+def _structure_dtype(structure):
+    """ Find the big-endian NumPy dtype equivalent to a structure. """
+    formats = []
+    for name, fmt in structure:
+        if fmt.endswith('s'):
+            formats.append('S' + fmt[:-1])
+        else:
+            formats.append(DTYPE_CODES[fmt])
+    return np.dtype({'names': [i[0] for i in structure], 'formats': formats})
+
+
 def _unpack_from_buf(buf, pos, structure):
     """ Unpack a structure from a buffer. """
     size = _structure_size(structure)
     return _unpack_structure(buf[pos:pos + size], structure)
 
 
+def _unpack_array(raw, offsets, structure):
+    """
+    Unpack the structure found at each offset of a byte array into a
+    structured array.
+    """
+    dtype = _structure_dtype(structure)
+    index = offsets[:, np.newaxis] + np.arange(dtype.itemsize)
+    return raw[index].view(dtype)[:, 0]
+
+
+def _array_dict(array, index):
+    """
+    Return an element of a structured array as a dictionary, with the same
+    values as _unpack_structure: int for integers and the raw bytes of
+    strings, including the trailing NULs which NumPy strips.
+    """
+    dic = {}
+    for name, value in zip(array.dtype.names, array[index].item()):
+        field = array.dtype.fields[name][0]
+        if field.kind == 'S':
+            value = value.ljust(field.itemsize, b'\x00')
+        elif field.kind in 'iu':
+            value = int(value)
+        dic[name] = value
+    return dic
+
+
+def _native(column):
+    """
+    Return a column of a structured array with the native types that
+    struct.unpack produces, float64 for reals and int for integers.
+    """
+    if column.dtype.kind == 'f':
+        return column.astype(np.float64)
+    return column.astype(np.int_)
+
+
 def _unpack_structure(string, structure):
     """ Unpack a structure from a string """
     fmt = '>' + ''.join([i[1] for i in structure])  # NEXRAD is big-endian
@@ -593,6 +1278,11 @@ def _unpack_structure(string, structure):
 RECORD_SIZE = 2432
 COMPRESSION_RECORD_SIZE = 12
 CONTROL_WORD_SIZE = 4
+MSG18_SIZE = 9468   # RDA adaptation data, spread over several records
+
+# Maximum number of threads used to decompress the BZ2 chunks of a file,
+# never more than the number of CPUs
+DECOMPRESS_THREADS = 4
 
 # format of structure elements
 # section 3.2.1, page 3-2
@@ -607,6 +1297,18 @@ SINT1 = 'b'
 SINT2 = 'h'
 SINT4 = 'i'
 
+# NumPy equivalents of the structure element formats, big-endian
+DTYPE_CODES = {
+    'B': 'u1',
+    'H': '>u2',
+    'I': '>u4',
+    'f': '>f4',
+    'd': '>f8',
+    'b': 'i1',
+    'h': '>i2',
+    'i': '>i4',
+}
+
 # Figure 1 in Interface Control Document for the Archive II/User
 # page 7-2
 VOLUME_HEADER = (
@@ -765,3 +1467,25 @@ RADIAL_DATA_BLOCK = (
     ('radconstH', REAL4),  # Added by Daniel Michelson
     ('radconstV', REAL4)   # Added by Daniel Michelson
 )
+
+# Moments in a msg31 record, in block pointer order
+MOMENTS = ('REF', 'VEL', 'SW', 'ZDR', 'PHI', 'RHO')
+
+# Structures of the msg31 data blocks, keyed by block name
+DATA_BLOCKS = dict((moment, GENERIC_DATA_BLOCK) for moment in MOMENTS)
+DATA_BLOCKS['VOL'] = VOLUME_DATA_BLOCK
+DATA_BLOCKS['ELV'] = ELEVATION_DATA_BLOCK
+DATA_BLOCKS['RAD'] = RADIAL_DATA_BLOCK
+
+# Offsets of the elevation number and of the radial status of a msg31
+# record from its message header.  The radial status is the field named
+# radial_spacing in MSG_31.
+MSG31_ELEVATION_NUMBER = (_structure_size(MSG_HEADER) +
+                          _structure_dtype(MSG_31).fields['elevation_number'][1])
+MSG31_RADIAL_STATUS = (_structure_size(MSG_HEADER) +
+                       _structure_dtype(MSG_31).fields['radial_spacing'][1])
+
+# Radial status values which end an elevation cut
+# Table XVII-A, page 3-87
+END_OF_ELEVATION = 2
+END_OF_VOLUME = 4
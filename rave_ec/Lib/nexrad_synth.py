@@ -0,0 +1,322 @@
+'''
+Copyright (C) 2016 The Crown (i.e. Her Majesty the Queen in Right of Canada)
+
+This file is an add-on to RAVE.
+
+RAVE is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RAVE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RAVE.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+##
+#  Generates synthetic NEXRAD Archive II files, bz2-compressed in LDM chunks
+#  the way they arrive from NOAA, or uncompressed, using the structures defined
+#  in nexrad_level2. The moment data are deterministic noise, not weather, so
+#  the files are only good for testing and benchmarking the decoder.
+
+
+##
+# @file
+# @author Daniel Michelson, Environment and Climate Change Canada
+# @date 2016-12-12
+
+import bz2
+import struct
+import numpy
+import nexrad_level2
+
+RADIALS_PER_CHUNK = 120  # as in the LDM feed
+METADATA_RECORDS = 134  # Message Types 15, 13, 18, 3, 5 and 2 precede the radials
+ADAPTATION_SEGMENTS = 4  # Message Type 18 segments written, the real thing has more
+
+## Elevation angles (degrees) of the synthetic VCPs, and how many of the lowest
+#  ones are split cuts, i.e. a surveillance cut followed by a Doppler cut
+VCPS = {212 : ([0.5, 0.9, 1.3, 1.8, 2.4, 3.1, 4.0, 5.1, 6.4, 8.0, 10.0, 12.5, 15.6, 19.5], 3),
+        215 : ([0.5, 0.9, 1.3, 1.8, 2.4, 3.1, 4.0, 5.1, 6.4, 8.0, 10.0, 12.0, 14.0, 16.7, 19.5], 4),
+        32 : ([0.5, 1.5, 2.5, 3.5, 4.5], 2)}
+
+## Word size, scale and offset of each moment (Table XVII-I)
+MOMENT_SCALING = {'REF' : (8,  2.0,    66.0),
+                  'VEL' : (8,  2.0,   129.0),
+                  'SW'  : (8,  2.0,   129.0),
+                  'ZDR' : (8, 16.0,   128.0),
+                  'PHI' : (16, 2.8361, 2.0),
+                  'RHO' : (8, 300.0, -60.5)}
+DUALPOL = ['ZDR', 'PHI', 'RHO']
+
+SURVEILLANCE = 1  # Message Type 5 waveform types
+DOPPLER = 2
+BATCH = 4
+
+LONG_RANGE_GATES = 1832  # REF of surveillance cuts, 460 km
+GATES = 1192  # everything else, 300 km
+GATE_SPACING = 250  # metres
+FIRST_GATE = 2125  # metres
+
+DATE = 17000  # NEXRAD modified Julian date of the volume, days since 1969-12-31
+START_MS = 43200000  # Collection time of the first radial, ms after midnight
+RAY_MS = 25  # Time between radials
+
+
+##
+#  One elevation cut in a synthetic volume coverage pattern.
+class Cut(object):
+    ## Initializer
+    # @param self - this object
+    # @param elangle - float target elevation angle in degrees
+    # @param waveform - int Message Type 5 waveform type
+    # @param moments - list of NEXRAD moment names
+    # @param nrays - int number of radials, 720 for super resolution, otherwise 360
+    # @param ngates - int number of gates of REF, other moments have at most GATES
+    # @param first_gate - int range of the first gate in metres
+    def __init__(self, elangle, waveform, moments, nrays, ngates, first_gate=FIRST_GATE):
+        self.elangle = elangle
+        self.waveform = waveform
+        self.moments = moments
+        self.nrays = nrays
+        self.ngates = ngates
+        self.first_gate = first_gate
+
+
+## Builds the cuts of a volume coverage pattern
+#  @param int VCP number, one of VCPS
+#  @param boolean whether the split cuts are super resolution (0.5 degree)
+#  @param boolean whether dual-polarization moments are included
+#  @param int number of elevation angles to include, or None for all of them
+#  @returns list of Cut objects
+def makeVCP(vcp=212, superres=True, dualpol=True, nelev=None):
+    if vcp not in VCPS:
+        raise ValueError("Unknown VCP %s, use one of %s" % (vcp, sorted(VCPS.keys())))
+    angles, nsplit = VCPS[vcp]
+    pol = dualpol and DUALPOL or []
+    cuts = []
+    for i, angle in enumerate(angles[:nelev]):
+        if i < nsplit:
+            nrays = superres and 720 or 360
+            cuts.append(Cut(angle, SURVEILLANCE, ['REF'] + pol, nrays, LONG_RANGE_GATES))
+            cuts.append(Cut(angle, DOPPLER, ['REF', 'VEL', 'SW'] + pol, nrays, GATES))
+        else:
+            cuts.append(Cut(angle, BATCH, ['REF', 'VEL', 'SW'] + pol, 360, GATES))
+    return cuts
+
+
+## Packs a structure defined in nexrad_level2
+#  @param structure tuple of (name, format) pairs
+#  @param dictionary of values, missing names are zero
+#  @returns string of packed bytes
+def pack(structure, values):
+    fmt = '>' + ''.join([i[1] for i in structure])
+    args = []
+    for name, code in structure:
+        if code[-1] == 's':
+            args.append(values.get(name, b''))
+        else:
+            args.append(values.get(name, 0))
+    return struct.pack(fmt, *args)
+
+
+## Size of the payload of a fixed-length record
+#  @returns int number of bytes following the message header
+def payloadSize():
+    return (nexrad_level2.RECORD_SIZE - nexrad_level2.COMPRESSION_RECORD_SIZE -
+            nexrad_level2._structure_size(nexrad_level2.MSG_HEADER))
+
+
+## Wraps a message in its control word and message header
+#  @param int message type
+#  @param string message payload
+#  @param boolean whether the record is padded to the fixed record size, which all
+#  messages except Message Type 31 are
+#  @param int segment number
+#  @param int number of segments of the message
+#  @returns string containing the record
+def makeRecord(msg_type, payload, fixed=True, seg_num=1, segments=1):
+    if fixed:
+        payload = payload.ljust(payloadSize(), b'\0')
+    size = (nexrad_level2._structure_size(nexrad_level2.MSG_HEADER) + len(payload)) // 2
+    hdr = pack(nexrad_level2.MSG_HEADER, {'size' : size, 'channels' : 8, 'type' : msg_type,
+                                          'date' : DATE, 'segments' : segments,
+                                          'seg_num' : seg_num})
+    return b'\0' * nexrad_level2.CONTROL_WORD_SIZE * 3 + hdr + payload
+
+
+## Message Type 5, the volume coverage pattern
+#  @param list of Cut objects
+#  @param int VCP number
+#  @returns string containing the record
+def makeMsg5(cuts, vcp):
+    payload = pack(nexrad_level2.MSG_5, {'pattern_type' : 2, 'pattern_number' : vcp,
+                                         'num_cuts' : len(cuts), 'pulse_width' : 2})
+    for cut in cuts:
+        payload += pack(nexrad_level2.MSG_5_ELEV,
+                        {'elevation_angle' : int(round(cut.elangle * 65536 / 360.)),
+                         'waveform_type' : cut.waveform,
+                         'super_resolution' : cut.nrays == 720 and 11 or 0})
+    return makeRecord(5, payload)
+
+
+## Message Type 18, the adaptation data, with the values read by ec_nexrad:
+#  path losses, beamwidth, antenna gain and transmitter frequency
+#  @returns list of strings containing the records of each segment
+def makeMsg18():
+    data = numpy.zeros(ADAPTATION_SEGMENTS * payloadSize(), numpy.uint8)
+    data[:8] = numpy.frombuffer(b'current\0', numpy.uint8)
+    words = data.view('>f4')
+    for offset in range(668, 1044, 4):
+        words[offset // 4] = offset / 1000.
+    words[1132 // 4] = 0.95
+    words[1136 // 4] = 45.5
+    data[1092:1096] = numpy.frombuffer(struct.pack('>i', 2800), numpy.uint8)
+    payload = data.tobytes()
+    step = payloadSize()
+    return [makeRecord(18, payload[i*step:(i+1)*step], seg_num=i+1, segments=ADAPTATION_SEGMENTS)
+            for i in range(ADAPTATION_SEGMENTS)]
+
+
+## Message Type 31, one radial of a cut
+#  @param Cut object
+#  @param int elevation number (1 based)
+#  @param int radial number in the cut (0 based)
+#  @param int collection time, ms after midnight
+#  @param numpy.random.RandomState for the moment data
+#  @param boolean whether this is the last cut of the volume
+#  @param int VCP number
+#  @returns string containing the record
+def makeMsg31(cut, elev_num, ray, ms, rng, last_cut, vcp=212):
+    blocks = [pack(nexrad_level2.VOLUME_DATA_BLOCK,
+                   {'block_type' : b'R', 'data_name' : b'VOL', 'lrtup' : 44,
+                    'version_major' : 1, 'lat' : 45.5, 'lon' : -73.5,
+                    'height' : 100, 'feedhorn_height' : 20, 'power_h' : 750.,
+                    'diff_refl_calib' : 0.2, 'vcp' : vcp}),
+              pack(nexrad_level2.ELEVATION_DATA_BLOCK,
+                   {'block_type' : b'R', 'data_name' : b'ELV', 'lrtup' : 12,
+                    'atmos' : -12, 'refl_calib' : -44.}),
+              pack(nexrad_level2.RADIAL_DATA_BLOCK,
+                   {'block_type' : b'R', 'data_name' : b'RAD', 'lrtup' : 28,
+                    'unambig_range' : 4660, 'noise_h' : -80., 'noise_v' : -81.,
+                    'nyquist_vel' : 2650, 'radconstH' : -33., 'radconstV' : -34.})]
+    for m in cut.moments:
+        word, scale, offset = MOMENT_SCALING[m]
+        if m == 'REF': ngates = cut.ngates
+        else: ngates = min(cut.ngates, GATES)
+        if word == 16:
+            data = rng.randint(0, 1024, ngates).astype('>u2')
+        else:
+            data = rng.randint(0, 256, ngates).astype('u1')
+        block = pack(nexrad_level2.GENERIC_DATA_BLOCK,
+                     {'block_type' : b'D', 'data_name' : m.ljust(3).encode('ascii'),
+                      'ngates' : ngates, 'first_gate' : cut.first_gate, 'gate_spacing' : GATE_SPACING,
+                      'word_size' : word, 'scale' : scale, 'offset' : offset})
+        block += data.tobytes()
+        if len(block) % 2:
+            block += b'\0'
+        blocks.append(block)
+
+    hdr = {'id' : b'KABC', 'collect_ms' : ms, 'collect_date' : DATE,
+           'azimuth_number' : ray + 1, 'elevation_number' : elev_num,
+           'elevation_angle' : cut.elangle + 0.01, 'block_count' : len(blocks),
+           'azimuth_resolution' : cut.nrays == 720 and 1 or 2}
+    pos = nexrad_level2._structure_size(nexrad_level2.MSG_31)
+    for i, block in enumerate(blocks):
+        hdr['block_pointer_%i' % (i+1)] = pos
+        pos += len(block)
+    hdr['radial_length'] = pos
+
+    # Radial status: start of volume, start of elevation, intermediate, end of elevation, end of volume
+    if ray == 0: hdr['radial_spacing'] = elev_num == 1 and 3 or 0
+    elif ray == cut.nrays - 1: hdr['radial_spacing'] = last_cut and 4 or 2
+    else: hdr['radial_spacing'] = 1
+
+    # Each cut starts a third of the way round rather than at north, as real cuts do
+    width = 360. / cut.nrays
+    hdr['azimuth_angle'] = ((ray + cut.nrays // 3) % cut.nrays) * width + width / 2
+    return makeRecord(31, pack(nexrad_level2.MSG_31, hdr) + b''.join(blocks), fixed=False)
+
+
+## Generates the records of a volume, grouped in LDM chunks
+#  @param list of Cut objects
+#  @param int VCP number
+#  @param int seed for the moment data
+#  @returns list of strings, each containing the uncompressed records of one chunk,
+#  the first of which holds the metadata records
+def makeChunks(cuts, vcp=212, seed=42):
+    rng = numpy.random.RandomState(seed)
+    meta = [makeMsg5(cuts, vcp)] + makeMsg18()
+    meta += [makeRecord(2, b'')] * (METADATA_RECORDS - len(meta))
+    chunks = [b''.join(meta)]
+    radials = []
+    ms = START_MS
+    for e, cut in enumerate(cuts):
+        for ray in range(cut.nrays):
+            radials.append(makeMsg31(cut, e+1, ray, ms, rng, e == len(cuts)-1, vcp))
+            ms += RAY_MS
+    for i in range(0, len(radials), RADIALS_PER_CHUNK):
+        chunks.append(b''.join(radials[i:i+RADIALS_PER_CHUNK]))
+    return chunks
+
+
+## Volume header record (Figure 1 in the Archive II ICD)
+#  @param string ICAO identifier of the radar
+#  @returns string containing the volume header
+def volumeHeader(icao=b'KABC'):
+    return pack(nexrad_level2.VOLUME_HEADER, {'tape' : b'AR2V0006.', 'extension' : b'001',
+                                              'date' : DATE, 'time' : START_MS, 'icao' : icao})
+
+
+## Compresses one chunk and prefixes its control word, which is negative for the last chunk
+#  @param string uncompressed chunk
+#  @param boolean whether this is the last chunk of the volume
+#  @returns string containing the compressed chunk
+def compressChunk(chunk, last=False):
+    cdata = bz2.compress(chunk)
+    if last: size = -len(cdata)
+    else: size = len(cdata)
+    return struct.pack('>i', size) + cdata
+
+
+## Writes a synthetic Archive II file
+#  @param string output file name
+#  @param list of Cut objects, or None for makeVCP(vcp)
+#  @param boolean True for bz2-compressed LDM chunks, False for an uncompressed file
+#  @param int VCP number
+#  @param int seed for the moment data
+#  @returns string output file name
+def writeArchive2(filename, cuts=None, compress=True, vcp=212, seed=42):
+    if cuts is None:
+        cuts = makeVCP(vcp)
+    chunks = makeChunks(cuts, vcp, seed)
+    fd = open(filename, 'wb')
+    fd.write(volumeHeader())
+    if compress:
+        for i, chunk in enumerate(chunks):
+            fd.write(compressChunk(chunk, i == len(chunks)-1))
+    else:
+        fd.write(b''.join(chunks))
+    fd.close()
+    return filename
+
+
+## Generates a synthetic volume as the LDM products it would arrive in: a first
+#  product with the volume header and the metadata chunk, then one per radial chunk.
+#  These can be fed to ec_nexrad.readLevelIIChunks.
+#  @param list of Cut objects, or None for makeVCP(vcp)
+#  @param int VCP number
+#  @param int seed for the moment data
+#  @returns list of strings, one per LDM product
+def ldmChunks(cuts=None, vcp=212, seed=42):
+    if cuts is None:
+        cuts = makeVCP(vcp)
+    chunks = makeChunks(cuts, vcp, seed)
+    out = [volumeHeader() + compressChunk(chunks[0])]
+    for i, chunk in enumerate(chunks[1:]):
+        out.append(compressChunk(chunk, i == len(chunks)-2))
+    return out
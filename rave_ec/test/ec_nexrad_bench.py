@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2016 The Crown (i.e. Her Majesty the Queen in Right of Canada)
+
+This file is an add-on to RAVE.
+
+RAVE is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RAVE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RAVE.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+##
+#  Benchmarks decoding and converting NEXRAD Level II data, using synthetic
+#  Archive II files from nexrad_synth, so that no real data are needed.
+#  Results can be saved as JSON and compared against a saved baseline.
+#
+#  Run from rave_ec/test, with the modules under test on the path:
+#  PYTHONPATH=../Lib python ec_nexrad_bench.py -o after.json -b before.json
+
+
+##
+# @file
+# @author Daniel Michelson, Environment and Climate Change Canada
+# @date 2016-12-12
+
+import os, time, json, shutil, platform, tempfile, resource
+import multiprocessing
+import numpy
+import nexrad_level2
+import nexrad_synth
+
+# Scan conversion needs RAVE, the decoder does not
+try:
+    import _polarscan, _polarvolume
+    import ec_nexrad
+except ImportError:
+    ec_nexrad = None
+
+CASES = ('open', 'get_data', 'populateScan', 'readLevelII')
+REPEAT = 5
+MB = 1024.0**2
+
+
+## Times a function
+#  @param function taking no arguments
+#  @param int number of times to call it
+#  @param function taking no arguments, called before each timed call, or None
+#  @returns list of float seconds taken by each call
+def timeit(func, repeat, setup=None):
+    seconds = []
+    for i in range(repeat):
+        if setup: setup()
+        start = time.time()
+        func()
+        seconds.append(time.time() - start)
+    return seconds
+
+
+## Forgets the moment data already decoded from a file, on readers which memoize them
+#  @param NEXRADLevel2File object
+#  @returns function taking no arguments
+def clearCache(l2):
+    if hasattr(l2, 'clear_cache'):
+        return l2.clear_cache
+    return lambda: None
+
+
+## Runs one benchmark case on one file. Cases are run in a process of their own,
+#  see runIsolated, so that peak memory is that of the case alone.
+#  @param string case, one of CASES
+#  @param string input Archive II file name
+#  @param int number of times to repeat it
+#  @returns list of dictionaries containing the 'case' name, including the moment for
+#  get_data, and the 'seconds' taken by each repetition
+def runCase(case, filename, repeat=REPEAT):
+    if case == 'open':
+        def func():
+            nexrad_level2.NEXRADLevel2File(filename).close()
+        return [{'case' : case, 'seconds' : timeit(func, repeat)}]
+
+    if case == 'get_data':
+        l2 = nexrad_level2.NEXRADLevel2File(filename)
+        results = []
+        moments = []
+        for t in l2.scan_info():
+            moments += [m for m in t['moments'] if m not in moments]
+        for moment in moments:
+            ngates = [t['ngates'][t['moments'].index(moment)] for t in l2.scan_info()
+                      if moment in t['moments']]
+            func = lambda: l2.get_data(moment, max(ngates))
+            results.append({'case' : '%s:%s' % (case, moment),
+                            'seconds' : timeit(func, repeat, clearCache(l2))})
+        return results
+
+    if ec_nexrad is None:
+        return [{'case' : case, 'skipped' : 'RAVE is not available'}]
+
+    if case == 'populateScan':
+        l2 = nexrad_level2.NEXRADLevel2File(filename)
+        clear = clearCache(l2)
+        if hasattr(ec_nexrad, 'getVolumeMeta'):
+            meta = ec_nexrad.getVolumeMeta(l2)
+            ec_nexrad.getTopLevelHowAttrs(l2, _polarvolume.new(), meta[-1])  # Adaptation data used by scans
+            def func():
+                for i in range(l2.nscans):
+                    ec_nexrad.populateScan(l2, _polarscan.new(), i, meta[i])
+                    clear()
+        else:  # Older trees look the scan metadata up in populateScan
+            ec_nexrad.getTopLevelHowAttrs(l2, _polarvolume.new())
+            def func():
+                for i in range(l2.nscans):
+                    ec_nexrad.populateScan(l2, _polarscan.new(), i)
+                    clear()
+        return [{'case' : case, 'seconds' : timeit(func, repeat)}]
+
+    if case == 'readLevelII':
+        func = lambda: ec_nexrad.readLevelII(filename)
+        return [{'case' : case, 'seconds' : timeit(func, repeat)}]
+
+    raise ValueError("Unknown case %s, use one of %s" % (case, ", ".join(CASES)))
+
+
+## Runs one benchmark case in a process of its own and adds throughput and memory to its results
+#  @param Python 3-tuple containing the case, input file name and number of repetitions
+#  @returns list of dictionaries from runCase, each also containing the 'file' name, 'median_s' and
+#  'min_s' seconds, 'volumes_per_s' and 'mb_per_s' (of the input file) at the median, and
+#  'peak_rss_mb' of the process and its 'rss_increase_mb' during the case
+def runIsolated(args):
+    case, filename, repeat = args
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # kB on Linux
+    results = runCase(case, filename, repeat)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    size = os.path.getsize(filename) / MB
+    for result in results:
+        result['file'] = os.path.basename(filename)
+        if 'skipped' in result: continue
+        median = float(numpy.median(result['seconds']))
+        result['median_s'] = median
+        result['min_s'] = min(result['seconds'])
+        result['volumes_per_s'] = 1 / median
+        result['mb_per_s'] = size / median
+        result['peak_rss_mb'] = peak_rss
+        result['rss_increase_mb'] = peak_rss - start_rss
+    return results
+
+
+## Generates the synthetic input files, one bz2-compressed and one uncompressed
+#  @param string directory to write them to
+#  @param int VCP number, one of nexrad_synth.VCPS
+#  @param boolean whether the split cuts are super resolution
+#  @param boolean whether dual-polarization moments are included
+#  @returns dictionary with a description of each file, keyed by file name
+def makeFiles(workdir, vcp=212, superres=True, dualpol=True):
+    files = {}
+    cuts = nexrad_synth.makeVCP(vcp, superres, dualpol)
+    for ext, compress in (('ar2v', True), ('raw', False)):
+        fstr = os.path.join(workdir, 'vcp%i.%s' % (vcp, ext))
+        nexrad_synth.writeArchive2(fstr, cuts, compress, vcp)
+        files[fstr] = {'bytes' : os.path.getsize(fstr), 'vcp' : vcp, 'compressed' : compress,
+                       'superres' : superres, 'dualpol' : dualpol}
+    return files
+
+
+## Runs the benchmark suite
+#  @param string directory for the synthetic input files, or None for a temporary one
+#  @param list of cases, see CASES
+#  @param int number of repetitions of each case
+#  @param int VCP number, one of nexrad_synth.VCPS
+#  @param boolean whether the split cuts are super resolution
+#  @param boolean whether dual-polarization moments are included
+#  @returns dictionary with the environment, the 'files' and the 'results' of all cases
+def run(workdir=None, cases=CASES, repeat=REPEAT, vcp=212, superres=True, dualpol=True):
+    tmpdir = None
+    if workdir is None:
+        workdir = tmpdir = tempfile.mkdtemp(prefix='ec_nexrad_bench_')
+    try:
+        files = makeFiles(workdir, vcp, superres, dualpol)
+        results = []
+        for fstr in sorted(files.keys()):
+            for case in cases:
+                pool = multiprocessing.Pool(1)  # A fresh process for each case
+                try:
+                    results += pool.apply(runIsolated, ((case, fstr, repeat),))
+                finally:
+                    pool.terminate()
+    finally:
+        if tmpdir: shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return {'created' : time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            'host' : platform.node(), 'cpus' : multiprocessing.cpu_count(),
+            'python' : platform.python_version(), 'numpy' : numpy.__version__,
+            'repeat' : repeat,
+            'files' : dict([(os.path.basename(k), v) for k, v in files.items()]),
+            'results' : results}
+
+
+## Formats results as a table, with the speedup relative to a baseline where both have the case
+#  @param dictionary returned by run
+#  @param dictionary returned by run for the baseline, or None
+#  @returns string
+def report(bench, baseline=None):
+    before = {}
+    if baseline:
+        for result in baseline['results']:
+            if 'median_s' in result:
+                before[(result['case'], result['file'])] = result['median_s']
+
+    lines = ["%-18s %-12s %10s %10s %10s %10s %8s" % ("case", "file", "median s", "volumes/s",
+                                                      "MB/s", "peak MB", "speedup")]
+    for result in bench['results']:
+        if 'skipped' in result:
+            lines.append("%-18s %-12s skipped: %s" % (result['case'], result['file'], result['skipped']))
+            continue
+        speedup = ""
+        key = (result['case'], result['file'])
+        if key in before:
+            speedup = "%.2fx" % (before[key] / result['median_s'])
+        lines.append("%-18s %-12s %10.4f %10.2f %10.1f %10.1f %8s" % (result['case'], result['file'],
+                     result['median_s'], result['volumes_per_s'], result['mb_per_s'],
+                     result['peak_rss_mb'], speedup))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+
+    usage = "usage: %prog [-o <output JSON> -b <baseline JSON> -v <VCP> -r <repeat> -c <cases> -d <work dir> -S -D] [h]"
+    usage += "\n\nBenchmarks decoding and converting synthetic NEXRAD Level II volumes."
+    parser = OptionParser(usage=usage)
+
+    parser.add_option("-o", "--output", dest="ofile",
+                      help="Name of the JSON file to write the results to.")
+
+    parser.add_option("-b", "--baseline", dest="baseline",
+                      help="Name of a JSON file written earlier, to compare the results with.")
+
+    parser.add_option("-v", "--vcp", dest="vcp", type="int", default=212,
+                      help="VCP of the synthetic volume, one of: %s. Defaults to 212." % ", ".join(map(str, sorted(nexrad_synth.VCPS.keys()))))
+
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=REPEAT,
+                      help="Number of times to repeat each case. Defaults to %i." % REPEAT)
+
+    parser.add_option("-c", "--cases", dest="cases", default=",".join(CASES),
+                      help="Comma-separated cases to run. Defaults to all of: %s" % ",".join(CASES))
+
+    parser.add_option("-d", "--workdir", dest="workdir",
+                      help="Directory to write the synthetic files to, for example on the disk the data usually come from. Defaults to a temporary directory.")
+
+    parser.add_option("-S", "--no-superres", dest="superres", action="store_false", default=True,
+                      help="Generate 1 degree split cuts instead of super-resolution ones.")
+
+    parser.add_option("-D", "--no-dualpol", dest="dualpol", action="store_false", default=True,
+                      help="Generate legacy volumes without dual-polarization moments.")
+
+    (options, args) = parser.parse_args()
+
+    baseline = None
+    if options.baseline:
+        baseline = json.load(open(options.baseline))
+
+    bench = run(options.workdir, options.cases.split(","), options.repeat, options.vcp,
+                options.superres, options.dualpol)
+    print(report(bench, baseline))
+
+    if options.ofile:
+        fd = open(options.ofile, 'w')
+        json.dump(bench, fd, indent=2, sort_keys=True)
+        fd.close()
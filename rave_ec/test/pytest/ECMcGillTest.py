@@ -0,0 +1,192 @@
+'''
+Copyright (C) 2016 The Crown (i.e. Her Majesty the Queen in Right of Canada)
+
+This file is an add-on to RAVE.
+
+RAVE is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RAVE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RAVE.  If not, see <http://www.gnu.org/licenses/>.
+------------------------------------------------------------------------*/
+
+Tests reading McGill volume scan files, using synthetic files
+
+@file
+@author Daniel Michelson, Environment and Climate Change Cananda
+@date 2017-05-02
+'''
+import unittest
+import os
+import shutil
+import tempfile
+import ec_mcgill
+from numpy import *
+
+class PyMcGillTest(unittest.TestCase):
+    NELEV = 4
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fstr = os.path.join(self.tmpdir, "vol.mcgill")
+        self.segments = writeMcGill(self.fstr, self.NELEV)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+    def testIsMcGill(self):
+        self.assertTrue(ec_mcgill.isMcGill(self.fstr))
+        fstr = os.path.join(self.tmpdir, "other")
+        open(fstr, "wb").write("\0" * 16)
+        self.assertFalse(ec_mcgill.isMcGill(fstr))
+
+
+    def testReadHeader(self):
+        mobj = ec_mcgill.readMcGill(self.fstr)
+        self.assertEqual((mobj.hours, mobj.minutes, mobj.seconds), (12, 34, 56))
+        self.assertEqual((mobj.year, mobj.month, mobj.day), (2016, 5, 18))
+        self.assertEqual(mobj.radar_Id, 7)
+        self.assertAlmostEqual(mobj.radar_latitude, 45.42, 5)
+        self.assertAlmostEqual(mobj.radar_longitude, -73.94, 5)
+        self.assertEqual(mobj.number_elevations, self.NELEV)
+        self.assertTrue(allclose(mobj.elevation_angles, ELANGLES[:self.NELEV]))
+        self.assertEqual((mobj.viraq_flag, mobj.clutter_filter), ("Y\0", "Nx"))
+        self.assertEqual(mobj.met_param, 1)
+        self.assertEqual((mobj.value_offset, mobj.cal_slope), (-32.0, 0.5))
+        self.assertEqual((mobj.range_unfolded, mobj.vad_velocity_unfolded), (2, 3))
+        self.assertEqual(mobj.shift_dir, 270)
+        self.assertEqual(mobj.prf1, [1200] * self.NELEV)
+        self.assertEqual(mobj.prf2, [900] * self.NELEV)
+        self.assertEqual(mobj.max_vel, [i * 0.25 for i in range(self.NELEV)])
+        self.assertEqual(mobj.prev_sub_area_dir, range(10, 19))
+
+
+    def testReadSegments(self):
+        mobj = ec_mcgill.readMcGill(self.fstr)
+        elev, ray, N, data = zip(*self.segments)
+        self.assertEqual(mobj.elevation_number.tolist(), list(elev))
+        self.assertEqual(mobj.radial_number.tolist(), list(ray))
+        self.assertEqual(mobj.bin_number.tolist(), [16 * (n - 1) for n in N])
+        self.assertTrue(array_equal(mobj.data_segments["data"], array(data)))
+        self.assertEqual(mobj.logical_records["last_record"].tolist()[-1], 1)
+        nrecords = (os.path.getsize(self.fstr) - ec_mcgill.HEADER_LENGTH) // ec_mcgill.RECORD_LENGTH
+        self.assertEqual(len(mobj.logical_records), nrecords - 1)  # Not the blank record after the last
+
+
+
+    def testMakeScans(self):
+        mobj = ec_mcgill.readMcGill(self.fstr)
+        ec_mcgill.makeScans(mobj)
+        self.assertEqual(len(mobj.scans), self.NELEV)
+        self.assertTrue(array_equal(array(mobj.scans), pasteSegments(self.segments, self.NELEV)))
+
+
+    def testMakeScansShuffled(self):
+        # Overlapping segments take the value of the one which comes last in the file
+        segments = writeMcGill(self.fstr, self.NELEV, shuffle=True)
+        mobj = ec_mcgill.readMcGill(self.fstr)
+        ec_mcgill.makeScans(mobj)
+        self.assertTrue(array_equal(array(mobj.scans), pasteSegments(segments, self.NELEV)))
+
+
+    def testFile2pvol(self):
+        pvol = ec_mcgill.file2pvol(self.fstr)
+        scans = pasteSegments(self.segments, self.NELEV)
+        self.assertEqual(pvol.getNumberOfScans(), self.NELEV)
+        for i in range(self.NELEV):
+            param = pvol.getScan(i).getParameter("DBZH")
+            self.assertEqual((param.gain, param.offset), (0.5, -32.0))
+            self.assertTrue(array_equal(param.getData(), scans[i]))
+
+
+ELANGLES = [0.5, 1.0, 1.5, 2.5, 3.5, 5.0]
+
+
+## Expands data segments to scans of 1 km gates by pasting each one into its ray in turn,
+#  as ec_mcgill.makeScans did segment by segment
+#  @param list of segments as returned by writeMcGill
+#  @param int number of elevations
+#  @returns uint8 array of shape (elevations, rays, gates)
+def pasteSegments(segments, nelev):
+    scans = zeros((nelev, ec_mcgill.NRAYS, ec_mcgill.NBINS), uint8)
+    for elev, ray, N, data in segments:
+        data, bin_number = array(data, uint8), 16 * (N - 1)
+        if bin_number == 112:
+            data, frombin = concatenate([data[:8], repeat(data[8:], 2)]), 112
+        elif 128 <= bin_number < 176:
+            data, frombin = repeat(data, 2), 136 + 32 * (bin_number - 128) / 16.0
+        elif bin_number == 176:
+            data, frombin = concatenate([repeat(data[:4], 2), repeat(data[4:], 4)]), 232
+        elif 192 <= bin_number:
+            data, frombin = repeat(data, 4), 288 + 64 * (bin_number - 192) / 32.0
+        else:
+            frombin = bin_number
+        frombin = int(frombin)
+        gates = scans[elev - 1, ray - 1, frombin:frombin + len(data)]
+        gates[:] = data[:len(gates)]
+    return scans
+
+
+## Writes a synthetic McGill volume scan file with one elevation segment per scan, followed
+#  by the data segments of each of its rays, a few of which are missing or interleaved with
+#  segments of the undocumented type 0, then an end-of-data segment. A blank record follows
+#  the last one.
+#  @param string output file name
+#  @param int number of elevations
+#  @param boolean whether to write the data segments of each ray in a random order
+#  @returns list of Python 4-tuples containing the elevation number, radial number, type and
+#  data of each data segment, in file order
+def writeMcGill(fstr, nelev, shuffle=False):
+    rng = random.RandomState(1)
+    header = zeros(ec_mcgill.HEADER_LENGTH, uint8)
+    fields = {"hours" : 12, "minutes" : 34, "seconds" : 56, "day" : 18, "month" : 5, "year" : 2016,
+              "radar_Id" : 7, "radar_latitude" : 45.42, "radar_longitude" : -73.94,
+              "number_elevations" : nelev, "elevation_angles" : ELANGLES[:nelev], "azimuth_offset" : 3,
+              "viraq_flag" : [ord("Y"), 0], "clutter_filter" : [ord("N"), ord("x")], "met_param" : 1,
+              "value_offset" : -32.0, "cal_slope" : 0.5, "antenna_programme" : 1, "cscan_format" : 1,
+              "range_unfolded" : 2, "vad_velocity_unfolded" : 3, "range_bins_array_size" : 240,
+              "shift_speed" : 5, "shift_dir" : 270, "prf1" : [1200] * nelev, "prf2" : [900] * nelev,
+              "max_vel" : [i * 0.25 for i in range(nelev)], "prev_sub_area_dir" : range(10, 19)}
+    values = zeros(1, ec_mcgill.headerDtype(nelev))
+    for name, value in fields.items():
+        values[name] = value
+    header[:values.itemsize] = frombuffer(values.tostring(), uint8)
+    header[:6] = frombuffer("mcgill", uint8)
+
+    segments, written = [], []
+    for e in range(1, nelev + 1):
+        segments.append([31 + e] + [0] * 18)
+        for ray in range(1, ec_mcgill.NRAYS + 1):
+            N = range(1, (e < nelev - 1 and 15 or 10) + 1)
+            if shuffle: N = rng.permutation(N).tolist()
+            for n in N:
+                if rng.rand() < 0.1: continue  # Missing segment
+                data = rng.randint(0, 256, 16).tolist()
+                segments.append([n, ray // 64, ray % 64] + data)
+                written.append((e, ray, n, data))
+            if rng.rand() < 0.05: segments.append([0] * 19)  # Undocumented type 0
+    segments.append([63] + [0] * 18)
+
+    records = []
+    for i in range(0, len(segments), ec_mcgill.SEGMENTS):
+        record = zeros(ec_mcgill.RECORD_LENGTH, uint8)
+        n = i // ec_mcgill.SEGMENTS
+        record[:5] = [n // 64, n % 64, 0, 1, 2]
+        body = array(segments[i:i + ec_mcgill.SEGMENTS], uint8).ravel()
+        record[14:14 + len(body)] = body
+        records.append(record)
+    records[-1][2] = 1  # Last record
+    records.append(zeros(ec_mcgill.RECORD_LENGTH, uint8))
+
+    fd = open(fstr, "wb")
+    fd.write(header.tostring() + concatenate(records).tostring())
+    fd.close()
+    return written
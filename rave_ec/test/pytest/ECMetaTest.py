@@ -0,0 +1,88 @@
+'''
+Copyright (C) 2016 The Crown (i.e. Her Majesty the Queen in Right of Canada)
+
+This file is an add-on to RAVE.
+
+RAVE is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RAVE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RAVE.  If not, see <http://www.gnu.org/licenses/>.
+------------------------------------------------------------------------*/
+
+Tests reading PRECIP-ET META files, using synthetic files
+
+@file
+@author Daniel Michelson, Environment and Climate Change Cananda
+@date 2017-04-25
+'''
+import unittest
+import os
+import shutil
+import tempfile
+import ecWxR_meta
+from Proj import dr
+from numpy import *
+
+class PyMetaTest(unittest.TestCase):
+    NRAYS = 360
+    NBINS = 240
+    FSTR = "201704251200~~PRECIPET.meta"  # URP file names start with YYYYMMDDHHmm
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = random.RandomState(1).randint(0, 256, (self.NRAYS, self.NBINS)).astype(uint8)
+        self.data[::7, ::3] = 1
+        self.header = ["Theta %i" % self.NRAYS, "Range %i" % self.NBINS, "PPIAngle deg 0.4",
+                       "LonCentre -79.57", "LatCentre 43.96", "GroundHeight 300", "HornHeight 25.5"]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+    def testReadMeta2Scan(self):
+        scan = ecWxR_meta.readMeta2Scan(self.writeMeta(self.FSTR, self.header))
+        self.assertAlmostEqual(scan.elangle, 0.4 * dr, 6)
+        self.assertAlmostEqual(scan.height, 325.5, 6)
+        self.assertAlmostEqual(scan.longitude, -79.57 * dr, 6)
+        self.assertAlmostEqual(scan.latitude, 43.96 * dr, 6)
+        param = scan.getParameter("DBZH")
+        self.assertTrue(array_equal(param.getData(), where(equal(self.data, 1), 0, self.data)))
+
+
+    def testReadMetaHeader(self):
+        header = self.header + ["RangeResolution km 0.5", "ValidityDate 20170425 1210"]
+        info = ecWxR_meta.readMetaHeader(self.writeMeta(self.FSTR, header))
+        scan = ecWxR_meta.readMeta2Scan(self.writeMeta(self.FSTR, header))
+        self.assertEqual(info["nrays"], self.NRAYS)
+        self.assertEqual(info["nbins"], self.NBINS)
+        self.assertEqual(info["bytes"], self.data.size)
+        self.assertAlmostEqual(info["elangle"] * dr, scan.elangle, 6)
+        self.assertAlmostEqual(info["height"], scan.height, 6)
+        self.assertEqual(info["rscale"], 500.0)
+        self.assertEqual((info["date"], info["time"]), ("20170425", "121000"))
+
+
+    def testReadMetaHeaderFallback(self):
+        info = ecWxR_meta.readMetaHeader(self.writeMeta(self.FSTR, self.header))
+        self.assertEqual(info["rscale"], None)
+        self.assertEqual((info["date"], info["time"]), ("20170425", "120000"))
+
+        info = ecWxR_meta.readMetaHeader(self.writeMeta("PRECIPET.meta", self.header))
+        self.assertEqual((info["date"], info["time"]), (None, None))
+
+
+    def writeMeta(self, fstr, header):
+        fstr = os.path.join(self.tmpdir, fstr)
+        lines = header + ["TableLabels a b c", "SizeInBytes %i" % self.data.size]
+        fd = open(fstr, "wb")
+        fd.write("\n".join(lines) + "\n" + self.data.tostring())
+        fd.close()
+        return fstr
@@ -0,0 +1,443 @@
+'''
+Copyright (C) 2016 The Crown (i.e. Her Majesty the Queen in Right of Canada)
+
+This file is an add-on to RAVE.
+
+RAVE is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RAVE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RAVE.  If not, see <http://www.gnu.org/licenses/>.
+------------------------------------------------------------------------*/
+
+Tests reading NEXRAD Level II data, using synthetic Archive II files
+
+@file
+@author Daniel Michelson, Environment and Climate Change Cananda
+@date 2016-12-12
+'''
+import unittest
+import os
+import shutil
+import tempfile
+import nexrad_level2
+import nexrad_synth
+import ec_nexrad
+import ec_nexrad_cache
+import ecWxR_trimRange
+import _rave
+import _ravefield
+from numpy import *
+
+class PyNexradTest(unittest.TestCase):
+    NELEV = 4  # Three split cuts and one batch cut
+    NGATES = 100  # Short rays, so that compressing the volume is quick
+    SCANS = [1, 3]
+
+    # The synthetic volumes are written once, each test writes to its own directory
+    @classmethod
+    def setUpClass(cls):
+        cls.voldir = tempfile.mkdtemp()
+        cuts = nexrad_synth.makeVCP(nelev=cls.NELEV)
+        for cut in cuts:
+            cut.ngates = cls.NGATES
+        cls.nrays = [cut.nrays for cut in cuts]
+        cls.compressed = nexrad_synth.writeArchive2(os.path.join(cls.voldir, "vol.ar2v"), cuts, True)
+        cls.uncompressed = nexrad_synth.writeArchive2(os.path.join(cls.voldir, "vol.raw"), cuts, False)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.voldir, ignore_errors=True)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+    def testScanInfo(self):
+        l2c = nexrad_level2.NEXRADLevel2File(self.compressed)
+        l2u = nexrad_level2.NEXRADLevel2File(self.uncompressed)
+        self.assertEqual(l2c.nscans, len(self.nrays))
+        self.assertEqual(l2c.scan_info(), l2u.scan_info())
+
+
+    def testGetData(self):
+        l2c = nexrad_level2.NEXRADLevel2File(self.compressed)
+        l2u = nexrad_level2.NEXRADLevel2File(self.uncompressed)
+        for moment, ngates in maxGates(l2c).items():
+            c = l2c.get_data(moment, ngates, raw_data=True)
+            u = l2u.get_data(moment, ngates, raw_data=True)
+            self.assertTrue(array_equal(c, u), moment)
+
+
+    def testAzimuthAngles(self):
+        l2c = nexrad_level2.NEXRADLevel2File(self.compressed)
+        l2u = nexrad_level2.NEXRADLevel2File(self.uncompressed)
+        self.assertTrue(array_equal(l2c.get_azimuth_angles(), l2u.get_azimuth_angles()))
+
+
+    def testScansSubset(self):
+        for fstr in (self.compressed, self.uncompressed):
+            full = nexrad_level2.NEXRADLevel2File(fstr)
+            part = nexrad_level2.NEXRADLevel2File(fstr, scans=self.SCANS)
+            self.assertEqual(part.nscans, max(self.SCANS) + 1)
+            for scan in range(part.nscans):
+                if scan in self.SCANS:
+                    self.assertEqual(part.get_nrays(scan), full.get_nrays(scan))
+                else:
+                    self.assertEqual(part.get_nrays(scan), 0)
+            for moment, ngates in maxGates(full).items():
+                a = part.get_data(moment, ngates, self.SCANS, raw_data=True)
+                b = full.get_data(moment, ngates, self.SCANS, raw_data=True)
+                self.assertTrue(array_equal(a, b), moment)
+            self.assertTrue(array_equal(part.get_azimuth_angles(self.SCANS),
+                                        full.get_azimuth_angles(self.SCANS)))
+
+
+    def testNoReducer(self):
+        pvol = ec_nexrad.readLevelII(self.uncompressed).object
+        nrays = [pvol.getScan(i).nrays for i in range(pvol.getNumberOfScans())]
+        self.assertEqual(sorted(nrays), sorted(self.nrays))
+
+
+    def testReducers(self):
+        for reducer in ec_nexrad.AZIMUTH_REDUCERS:
+            pvol = ec_nexrad.readLevelII(self.uncompressed, azimuth_reducer=reducer).object
+            self.assertEqual(pvol.getNumberOfScans(), len(self.nrays))
+            for i in range(pvol.getNumberOfScans()):
+                self.assertEqual(pvol.getScan(i).nrays, 360, reducer)
+
+
+    def testQuantization(self):
+        l2 = nexrad_level2.NEXRADLevel2File(self.uncompressed)
+        pvol = ec_nexrad.readLevelII(self.uncompressed).object
+        quantities = []
+        for index, tsi in enumerate(l2.scan_info()):
+            scan = pvol.getScan(index)
+            for moment in tsi['moments']:
+                qmd = quantMeta(l2, index, moment)
+                param = scan.getParameter(ec_nexrad.QUANTITIES[moment])
+                self.assertEqual((param.gain, param.offset, param.nodata, param.undetect),
+                                 (qmd.gain, qmd.offset, qmd.nodata, qmd.undetect))
+                self.assertTrue(array_equal(param.getData(), quantize(l2, index, moment, scan.nbins)), moment)
+                quantities.append(moment)
+        self.assertTrue('PHI' in quantities)  # 16-bit
+
+
+    def testLUT(self):
+        l2 = nexrad_level2.NEXRADLevel2File(self.uncompressed)
+        for index, tsi in enumerate(l2.scan_info()):
+            for moment, ngates in zip(tsi['moments'], tsi['ngates']):
+                qmd = quantMeta(l2, index, moment)
+                rscale, roffset = l2.get_moment_scaling(moment, [index])
+                rtype = l2.get_data(moment, ngates, scans=[index], raw_data=True).dtype
+                codes = arange(iinfo(rtype).max + 1).astype(rtype)
+                data = (ma.masked_less_equal(codes, 1) - roffset) / rscale  # As NEXRADLevel2File.get_data
+                ref = where(equal(codes, 0), qmd.undetect, (data - qmd.offset) / qmd.gain).astype(qmd.dtype)
+                ref = where(equal(codes, 1), qmd.nodata, ref).astype(qmd.dtype)
+                self.assertTrue(array_equal(ec_nexrad.getLUT(qmd, rscale, roffset, rtype), ref), moment)
+
+
+    def testRangeAggregation(self):
+        factor = 3  # 100 gates are not a multiple of it, so the last bin is padded
+        native = ec_nexrad.readLevelII(self.uncompressed).object
+        rscale = native.getScan(0).rscale * factor
+        pvol = ec_nexrad.readLevelII(self.uncompressed, rscale=rscale).object
+        self.assertEqual(pvol.getNumberOfScans(), native.getNumberOfScans())
+        for i in range(pvol.getNumberOfScans()):
+            scan, ref = pvol.getScan(i), native.getScan(i)
+            self.assertEqual(scan.rscale, rscale)
+            self.assertEqual(scan.rstart, ref.rstart)
+            self.assertEqual(scan.nbins, (ref.nbins + factor - 1) // factor)
+            self.assertEqual(sorted(scan.getParameterNames()), sorted(ref.getParameterNames()))
+            for pname in ref.getParameterNames():
+                param, refparam = scan.getParameter(pname), ref.getParameter(pname)
+                expected = aggregateGates(refparam, factor, "mean" if pname == "TH" else "nearest")
+                self.assertTrue(array_equal(param.getData(), expected), pname)
+        self.assertRaises(ValueError, ec_nexrad.readLevelII, self.uncompressed, rscale=rscale + 1)
+
+
+    def testQuantitiesAndMaxRange(self):
+        for maxr in (10, 1000):  # Trimmed, and beyond the last bin
+            rio = ec_nexrad.readLevelII(self.uncompressed, quantities=ecWxR_trimRange.PARAMS, max_range_km=maxr)
+            ref = ecWxR_trimRange.generate("bobbe", maxr=maxr, RIO=ec_nexrad.readLevelII(self.uncompressed))
+            pvol = ecWxR_trimRange.generate("bobbe", maxr=maxr, RIO=rio).object
+            self.assertEqual(dumpVolume(pvol), dumpVolume(ref.object))
+
+        pvol = ec_nexrad.readLevelII(self.uncompressed, quantities=["VRADH"]).object
+        ref = ec_nexrad.readLevelII(self.uncompressed).object
+        nscans = 0
+        for i in range(ref.getNumberOfScans()):
+            if "VRADH" in ref.getScan(i).getParameterNames():
+                scan = pvol.getScan(nscans)
+                self.assertEqual(scan.getParameterNames(), ["VRADH"])
+                self.assertTrue(array_equal(scan.getParameter("VRADH").getData(),
+                                            ref.getScan(i).getParameter("VRADH").getData()))
+                nscans += 1
+        self.assertEqual(pvol.getNumberOfScans(), nscans)  # Scans without VRADH are left out
+
+
+    def testMergeSplitCuts(self):
+        cuts = nexrad_synth.makeVCP(nelev=self.NELEV)
+        for cut in cuts:
+            cut.ngates = self.NGATES
+        cuts[1].nrays = 360  # Doppler cut of the first split cut at another azimuth resolution
+        cuts[3].first_gate += nexrad_synth.GATE_SPACING  # and of the second one at another range
+        fstr = nexrad_synth.writeArchive2(os.path.join(self.tmpdir, "vol.raw"), cuts, False)
+
+        for fstr, merged in ((self.uncompressed, [0, 2, 4]), (fstr, [4])):
+            ref = ec_nexrad.readLevelII(fstr).object
+            pvol = ec_nexrad.readLevelII(fstr, merge_split_cuts=True).object
+            cs = [i for i in range(ref.getNumberOfScans()) if i-1 not in merged]
+            self.assertEqual(pvol.getNumberOfScans(), len(cs))
+            for scan, i in zip([pvol.getScan(n) for n in range(len(cs))], cs):
+                names = ref.getScan(i).getParameterNames()
+                if i in merged:
+                    doppler = ref.getScan(i+1)
+                    self.assertEqual(scan.getAttribute('how/NI'), doppler.getAttribute('how/NI'))
+                    names = ["TH"] + [name for name in doppler.getParameterNames() if name != "TH"]
+                self.assertEqual(sorted(scan.getParameterNames()), sorted(names))
+                for name in names:
+                    source = ref.getScan(i+1) if i in merged and name != "TH" else ref.getScan(i)
+                    self.assertTrue(array_equal(scan.getParameter(name).getData(),
+                                                source.getParameter(name).getData()), name)
+
+
+    def testReadLevelIIChunks(self):
+        cuts = nexrad_synth.makeVCP(nelev=self.NELEV)
+        for cut in cuts:
+            cut.ngates = self.NGATES
+        indices = []
+        for index, rio in ec_nexrad.readLevelIIChunks(nexrad_synth.ldmChunks(cuts)):
+            indices.append(index)
+            ref = ec_nexrad.readLevelII(self.compressed, scans=[index])
+            scans, refs = getScans(rio), getScans(ref)
+            self.assertEqual(len(scans), 1)
+            # how/scan_count comes from the VCP, rather than from the scans read so far
+            self.assertEqual(scans[0].getAttribute('how/scan_count'), len(self.nrays))
+            refs[0].addAttribute('how/scan_count', len(self.nrays))
+            self.assertEqual(dumpScan(scans[0]), dumpScan(refs[0]))
+        self.assertEqual(indices, range(len(self.nrays)))
+
+
+    def testReadLevelIIBatch(self):
+        missing = os.path.join(self.tmpdir, "missing.ar2v")
+        paths = [self.compressed, missing, self.uncompressed]
+        for workers in (1, 2):
+            results = ec_nexrad.readLevelIIBatch(paths, workers=workers)
+            self.assertEqual([result.filename for result in results], paths)
+            self.assertTrue(results[1].error is not None)
+            self.assertEqual(results[1].sweeps, [])
+            for result in (results[0], results[2]):
+                self.assertTrue(result.error is None)
+                l2 = nexrad_level2.NEXRADLevel2File(result.filename)
+                self.assertEqual(len(result.sweeps), l2.nscans)
+                for index, (tsi, sweep) in enumerate(zip(l2.scan_info(), result.sweeps)):
+                    self.assertTrue(array_equal(sweep['azimuth'], l2.get_azimuth_angles([index])))
+                    self.assertTrue(array_equal(sweep['elevation'], l2.get_elevation_angles([index])))
+                    self.assertEqual(sorted(sweep['scaling'].keys()), sorted(tsi['moments']))
+                    for moment, ngates in zip(tsi['moments'], tsi['ngates']):
+                        raw = l2.get_data(moment, ngates, scans=[index], raw_data=True)
+                        self.assertTrue(isinstance(sweep[moment], memmap), moment)  # Not copied from the worker
+                        self.assertTrue(array_equal(sweep[moment], raw), moment)
+                        scale, offset = sweep['scaling'][moment]
+                        data = l2.get_data(moment, ngates, scans=[index])
+                        self.assertTrue(allclose(((raw - offset) / scale)[~data.mask], data.compressed()), moment)
+
+
+    def testCacheMissHit(self):
+        cachedir = os.path.join(self.tmpdir, "cache")
+        ref = nexrad_level2.NEXRADLevel2File(self.compressed)
+        miss = ec_nexrad_cache.readLevelII(self.compressed, cachedir=cachedir)
+        hit = ec_nexrad_cache.readLevelII(self.compressed, cachedir=cachedir)
+        self.assertFalse(isinstance(miss, ec_nexrad_cache.CachedLevel2File))
+        self.assertTrue(isinstance(hit, ec_nexrad_cache.CachedLevel2File))
+        self.assertEqual(os.listdir(cachedir), [ec_nexrad_cache.contentKey(self.compressed)])
+        self.assertEqual(hit.scan_info(), ref.scan_info())
+        self.assertEqual(hit.vcp, ref.vcp)
+        self.assertTrue(array_equal(hit.msg31_headers, ref.msg31_headers))
+        self.assertTrue(array_equal(hit.get_azimuth_angles(), ref.get_azimuth_angles()))
+        for moment, ngates in maxGates(ref).items():
+            for n in (ngates // 2, ngates, ngates + 10):
+                self.assertTrue(array_equal(hit.get_data(moment, n, raw_data=True),
+                                            ref.get_data(moment, n, raw_data=True)), moment)
+        for msgs in ref.scan_msgs:
+            for moment in nexrad_level2.MOMENTS:
+                data = ref.msg31s[msgs[0]].get(moment, {}).get('data')
+                self.assertTrue(array_equal(hit.msg31s[msgs[0]].get(moment, {}).get('data'), data))
+
+        part = ec_nexrad_cache.readLevelII(self.compressed, scans=self.SCANS, cachedir=cachedir)
+        self.assertEqual(part.scan_info(), nexrad_level2.NEXRADLevel2File(self.compressed, scans=self.SCANS).scan_info())
+
+        pvol = ec_nexrad.readLevelII(self.compressed, cachedir=cachedir).object
+        self.assertEqual(dumpVolume(pvol), dumpVolume(ec_nexrad.readLevelII(self.compressed).object))
+
+
+    def testCacheEvict(self):
+        cachedir = os.path.join(self.tmpdir, "cache")
+        ec_nexrad_cache.readLevelII(self.compressed, cachedir=cachedir)
+        key = ec_nexrad_cache.contentKey(self.compressed)
+        os.utime(os.path.join(cachedir, key), (0, 0))  # least recently used
+        ec_nexrad_cache.readLevelII(self.uncompressed, cachedir=cachedir, maxsize=1)
+        self.assertEqual(os.listdir(cachedir), [ec_nexrad_cache.contentKey(self.uncompressed)])
+        ec_nexrad_cache.evict(cachedir, 1)
+        self.assertEqual(os.listdir(cachedir), [])
+
+
+    def testCacheBestEffort(self):
+        # An unusable cache directory, below a file, leaves decoding unaffected
+        l2 = ec_nexrad_cache.readLevelII(self.compressed, cachedir=os.path.join(self.uncompressed, "cache"))
+        self.assertEqual(l2.scan_info(), nexrad_level2.NEXRADLevel2File(self.compressed).scan_info())
+
+        # A broken entry is decoded and stored again, without leaving temporary files
+        cachedir = os.path.join(self.tmpdir, "cache")
+        ec_nexrad_cache.readLevelII(self.compressed, cachedir=cachedir)
+        key = ec_nexrad_cache.contentKey(self.compressed)
+        os.remove(os.path.join(cachedir, key, "msg31_headers.npy"))
+        l2 = ec_nexrad_cache.readLevelII(self.compressed, cachedir=cachedir)
+        self.assertFalse(isinstance(l2, ec_nexrad_cache.CachedLevel2File))
+        self.assertEqual(os.listdir(cachedir), [key])
+        self.assertTrue(isinstance(ec_nexrad_cache.readLevelII(self.compressed, cachedir=cachedir),
+                                   ec_nexrad_cache.CachedLevel2File))
+
+
+    @unittest.skipIf(ec_nexrad.h5py is None, "writeLevelII requires h5py")
+    def testWriteLevelII(self):
+        ofstr = os.path.join(self.tmpdir, "vol.h5")
+        rio, quantities = ec_nexrad.writeLevelII(self.compressed, ofstr)
+        pvol = ec_nexrad.readLevelII(self.compressed).object
+        self.assertEqual(rio.object.source, pvol.source)
+        self.assertEqual(rio.object.getAttribute('how/task'), pvol.getAttribute('how/task'))
+        self.assertEqual(readDatasets(ofstr), dumpDatasets(pvol))
+        self.assertEqual(sorted(quantities), sorted(set([q for scan in dumpDatasets(pvol) for q, data in scan[2]])))
+
+
+    @unittest.skipIf(ec_nexrad.h5py is None, "writeLevelII requires h5py")
+    def testWriteLevelIITrimmed(self):
+        ofstr = os.path.join(self.tmpdir, "vol.h5")
+        rio, quantities = ec_nexrad.writeLevelII(self.compressed, ofstr, quantities=ecWxR_trimRange.PARAMS,
+                                                 max_range_km=10, unique_elangles=True)
+        rio = ec_nexrad.readLevelII(self.compressed, quantities=ecWxR_trimRange.PARAMS, max_range_km=10)
+        pvol = ecWxR_trimRange.generate("bobbe", maxr=10, RIO=rio).object
+        self.assertEqual(readDatasets(ofstr), dumpDatasets(pvol))
+
+
+    @unittest.skipIf(ec_nexrad.h5py is None, "writeLevelII requires h5py")
+    def testWriteQualityFields(self):
+        scan = ec_nexrad.readLevelII(self.uncompressed, scans=[0]).object
+        field = _ravefield.new()
+        field.setData(zeros((scan.nrays, scan.nbins), uint8) + 7)
+        field.addAttribute("how/task", "ca.ec.test")
+        scan.addQualityField(field)
+        h5 = ec_nexrad.h5py.File(os.path.join(self.tmpdir, "scan.h5"), "w")
+        try:
+            ec_nexrad.writeScan(h5.create_group("dataset1"), scan)
+            quality = h5["dataset1/quality1"]
+            self.assertEqual(quality["how"].attrs["task"], "ca.ec.test")
+            self.assertTrue(array_equal(quality["data"][...], field.getData()))
+        finally:
+            h5.close()
+
+
+## Largest number of gates of each moment in a volume
+def maxGates(l2):
+    ngates = {}
+    for info in l2.scan_info():
+        for moment, n in zip(info['moments'], info['ngates']):
+            ngates[moment] = max(ngates.get(moment, 0), n)
+    return ngates
+
+
+## Parameter data and where/how attributes of each scan in a volume, for comparisons
+def dumpVolume(pvol):
+    return [dumpScan(pvol.getScan(i)) for i in range(pvol.getNumberOfScans())]
+
+
+## QMeta object of a moment in a scan, as chosen by ec_nexrad.populateParams
+def quantMeta(l2, index, moment):
+    scale = l2.msg31s[l2.scan_msgs[index][0]][moment]['scale']
+    if moment == "VEL" and scale == 1.0: return ec_nexrad.QMD['VEL1']
+    elif moment == "VEL" and scale == 2.0: return ec_nexrad.QMD['VEL2']
+    return ec_nexrad.QMD[moment]
+
+
+## Quantized data of a moment in a scan, masked, rotated and padded to nbins as in
+#  ec_nexrad.populateParams before look-up tables were used
+def quantize(l2, index, moment, nbins):
+    tsi = l2.scan_info()[index]
+    ngates = tsi['ngates'][tsi['moments'].index(moment)]
+    qmd = quantMeta(l2, index, moment)
+    data = l2.get_data(moment, ngates, scans=[index]).data
+    rdata = l2.get_data(moment, ngates, scans=[index], raw_data=True)
+    mydata = where(equal(rdata, 0), qmd.undetect, (data - qmd.offset) / qmd.gain).astype(qmd.dtype)
+    mydata = where(equal(rdata, 1), qmd.nodata, mydata).astype(qmd.dtype)
+    start = argmin(l2.get_azimuth_angles([index]))
+    mydata = concatenate((mydata[start:], mydata[:start]))
+    padding = (zeros((mydata.shape[0], nbins - ngates)) + qmd.nodata).astype(qmd.dtype)
+    return concatenate((mydata, padding), 1)
+
+
+## Gates of a parameter aggregated to bins of factor gates, either taking the gate at the centre
+#  of each bin, or averaging the valid gates in linear units
+def aggregateGates(param, factor, reducer):
+    data = param.getData()
+    nrays, nbins = data.shape
+    nbins = (nbins + factor - 1) // factor * factor
+    padded = zeros((nrays, nbins), data.dtype) + param.nodata
+    padded[:, :data.shape[1]] = data
+    groups = padded.reshape(nrays, -1, factor)
+    if reducer == "nearest":
+        return groups[:, :, (factor-1) // 2]
+    values = ma.masked_where((groups == param.nodata) | (groups == param.undetect), groups * param.gain + param.offset)
+    mean = 10 * ma.log10((10**(values / 10.0)).mean(axis=2))
+    codes = clip(around((mean - param.offset) / param.gain), param.undetect+1, param.nodata-1)
+    empty = where((groups == param.undetect).any(axis=2), param.undetect, param.nodata)
+    return where(ma.getmaskarray(codes), empty, codes.filled(0))
+
+
+## Scans of a RaveIO object containing either a PVOL or a SCAN
+def getScans(rio):
+    if rio.objectType == _rave.Rave_ObjectType_SCAN:
+        return [rio.object]
+    return [rio.object.getScan(i) for i in range(rio.object.getNumberOfScans())]
+
+
+## Parameter data and where/how attributes of a scan
+def dumpScan(scan):
+    return (scan.elangle, scan.nrays, scan.nbins, scan.rscale,
+            [(pname, scan.getParameter(pname).getData().tolist()) for pname in sorted(scan.getParameterNames())],
+            sorted([(name, str(scan.getAttribute(name))) for name in scan.getAttributeNames()]))
+
+
+## Elevation angle, number of bins, and quantities and data of each scan of a volume
+def dumpDatasets(pvol):
+    scans = []
+    for i in range(pvol.getNumberOfScans()):
+        scan = pvol.getScan(i)
+        scans.append((round(scan.elangle * 180 / pi, 6), scan.nbins,
+                      sorted([(pname, scan.getParameter(pname).getData().tolist()) for pname in scan.getParameterNames()])))
+    return scans
+
+
+## As dumpDatasets, for an ODIM_H5 file written by ec_nexrad.writeLevelII
+def readDatasets(fstr):
+    h5 = ec_nexrad.h5py.File(fstr, "r")
+    scans = []
+    try:
+        while "dataset%i" % (len(scans) + 1) in h5:
+            dataset = h5["dataset%i" % (len(scans) + 1)]
+            scans.append((round(float(dataset["where"].attrs["elangle"]), 6), int(dataset["where"].attrs["nbins"]),
+                          sorted([(dataset[name]["what"].attrs["quantity"], dataset[name]["data"][...].tolist())
+                                  for name in dataset if name.startswith("data")])))
+    finally:
+        h5.close()
+    return scans
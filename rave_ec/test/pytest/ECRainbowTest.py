@@ -0,0 +1,227 @@
+'''
+Copyright (C) 2016 The Crown (i.e. Her Majesty the Queen in Right of Canada)
+
+This file is an add-on to RAVE.
+
+RAVE is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RAVE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RAVE.  If not, see <http://www.gnu.org/licenses/>.
+------------------------------------------------------------------------*/
+
+Tests reading Rainbow 5 files, using synthetic files
+
+@file
+@author Daniel Michelson, Environment and Climate Change Cananda
+@date 2017-05-02
+'''
+import unittest
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+import ec_RB_io
+import ec_rb5
+from Proj import dr
+from numpy import *
+
+class PyRainbowTest(unittest.TestCase):
+    NSLICES = 4
+    NRAYS = 360
+    NBINS = 100
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fstr = os.path.join(self.tmpdir, "2015120712000000dBZ.vol")
+        self.blobs = writeRainbow(self.fstr, "dBZ", self.NSLICES, self.NRAYS, self.NBINS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+    def testBlobIndex(self):
+        rbf = ec_RB_io.RainbowFile(self.fstr)
+        self.assertEqual(sorted(rbf.blobs.keys()), sorted(self.blobs.keys()))
+        for blobid, data in self.blobs.items():
+            self.assertEqual(rbf.get_blob_data(blobid), data.tostring())
+            self.assertEqual(ec_RB_io.get_RB_blob_data(rbf.datastring, blobid), data.tostring())
+        self.assertEqual(len(rbf.slices), self.NSLICES)
+        self.assertEqual([rawdata['slice'] for rawdata in rbf.rawdata], range(self.NSLICES))
+        self.assertEqual([rawdata['type'] for rawdata in rbf.rawdata], ["dBZ"] * self.NSLICES)
+
+
+    def testBlobTagInData(self):
+        # The text of a BLOB tag in uncompressed data is skipped over, not taken for a tag
+        blobs = writeRainbow(self.fstr, "dBZ", self.NSLICES, self.NRAYS, self.NBINS, compress=False)
+        rbf = ec_RB_io.RainbowFile(self.fstr)
+        self.assertEqual(sorted(rbf.blobs.keys()), sorted(blobs.keys()))
+        for blobid, data in blobs.items():
+            self.assertEqual(rbf.get_blob_data(blobid), data.tostring())
+
+
+    def testReadRainbow(self):
+        single = os.path.join(self.tmpdir, "single.vol")
+        writeRainbow(single, "V", 1, self.NRAYS, self.NBINS)
+        for fstr in (self.fstr, single):
+            # Header, then each blob searched for in the file, as read_Rainbow used to
+            rbdict = ec_RB_io.get_RB_header(fstr)
+            datastring = ec_RB_io.get_RB_file_as_string(fstr)
+            for blob in list(ec_RB_io.find_key('@blobid', rbdict)):
+                blob['data'] = ec_RB_io.get_RB_blob_from_string(datastring, blob)
+            self.assertEqual(dumpDict(ec_RB_io.read_Rainbow(fstr)), dumpDict(rbdict))
+            self.assertEqual(dumpDict(ec_RB_io.get_RB_blobs_from_file(fstr, ec_RB_io.get_RB_header(fstr))),
+                             dumpDict(rbdict))
+            self.assertEqual(ec_RB_io.read_Rainbow(fstr, loaddata=False), ec_RB_io.get_RB_header(fstr))
+
+
+
+    def testMakePvolFromSingleSliceFiles(self):
+        fstrs = []
+        for first in (2, 0, 1):
+            fstrs.append(os.path.join(self.tmpdir, "%i_dBZ.vol" % first))
+            writeRainbow(fstrs[-1], "dBZ", 1, self.NRAYS, self.NBINS, first=first)
+        pvol = ec_rb5.makePvolFromFiles(fstrs)
+        self.assertEqual(pvol.getNumberOfScans(), len(fstrs))
+        self.assertEqual(pvol.source, "NOD:caxka")
+        refs = sorted([readSlices(fstr)[0] for fstr in fstrs])
+        for i, ref in enumerate(refs):
+            self.assertEqual(dumpScan(pvol.getScan(i)), ref)
+
+
+    def testMakePvolFromFiles(self):
+        vfstr = os.path.join(self.tmpdir, "2015120712000000V.vol")
+        writeRainbow(vfstr, "V", self.NSLICES, self.NRAYS, self.NBINS)  # Not mapped to ODIM, skipped
+        refs = readSlices(self.fstr)
+        for nthreads in (1, 2):
+            pvol = ec_rb5.makePvolFromFiles([self.fstr, vfstr], nthreads=nthreads)
+            self.assertEqual([dumpScan(pvol.getScan(i)) for i in range(pvol.getNumberOfScans())], refs)
+
+
+    def testMakePvolSelection(self):
+        refs = readSlices(self.fstr)
+        rbf = ec_RB_io.RainbowFile(self.fstr)
+        get_blob, decompressed = ec_RB_io.RainbowFile.get_blob, []
+        def recordingGetBlob(self, blobdict):
+            decompressed.append(int(blobdict['@blobid']))
+            return get_blob(self, blobdict)
+        ec_RB_io.RainbowFile.get_blob = recordingGetBlob
+        try:
+            pvol = ec_rb5.makePvolFromFiles([self.fstr], quantities=["DBZH"], elevations=[ELANGLES[1], ELANGLES[3]],
+                                            nthreads=1)
+        finally:
+            ec_RB_io.RainbowFile.get_blob = get_blob
+        self.assertEqual([dumpScan(pvol.getScan(i)) for i in range(pvol.getNumberOfScans())], [refs[1], refs[3]])
+        self.assertEqual(sorted(decompressed), [3, 5, 9, 11])  # Start angles and data of those slices only
+
+        pvol = ec_rb5.makePvolFromFiles([self.fstr], quantities=["DBZH", "VRADH"])
+        self.assertEqual([dumpScan(pvol.getScan(i)) for i in range(pvol.getNumberOfScans())], refs)
+
+
+ELANGLES = [0.5, 1.2, 2.0, 2.8, 3.7, 4.8]
+RANGES = {"dBZ" : (-31.5, 95.5), "V" : (-16, 16), "W" : (0, 8), "ZDR" : (-8, 12)}
+BLOB_TAG = '<BLOB blobid="%d" size="%d" compression="%s">'
+
+
+## Nested dictionary with its numpy arrays as (type, shape, bytes), so that it can be compared
+def dumpDict(o):
+    if isinstance(o, dict):
+        return dict([(k, dumpDict(v)) for k, v in o.items()])
+    if isinstance(o, list):
+        return [dumpDict(v) for v in o]
+    if isinstance(o, ndarray):
+        return (o.dtype.str, o.shape, o.tostring())
+    return o
+
+
+## Elevation angle, range bin size, date, time and quantized data of a scan with a single
+#  parameter, so that it can be compared
+def dumpScan(scan):
+    param = scan.getParameter(scan.getParameterNames()[0])
+    return (round(scan.elangle, 6), scan.rscale, scan.beamwidth, scan.date, scan.time,
+            param.quantity, param.gain, param.offset, param.undetect, param.nodata, param.getData().tolist())
+
+
+## Each slice of a Rainbow 5 file of reflectivity as dumpScan would give it, from the file
+#  contents returned by ec_RB_io.read_Rainbow. The rays are rotated to start with the lowest
+#  start angle, as ec_rb5.readRBScanParameter did for single-slice files.
+def readSlices(fstr):
+    rb = ec_RB_io.read_Rainbow(fstr)['volume']
+    slices = rb['scan']['slice']
+    if isinstance(slices, dict):
+        slices = [slices]
+    quantity, gain, offset, undetect, nodata = ec_rb5.QGOUN["dBZ"]
+    dumps = []
+    for sl in slices:
+        start = argmin(sl['slicedata']['rayinfo'][0]['data'])
+        data = sl['slicedata']['rawdata']['data']
+        data = concatenate((data[start:], data[:start]))
+        dumps.append((round(float(sl['posangle']) * dr, 6), float(slices[0]['rangestep']) * 1000.0,
+                      float(rb['sensorinfo']['beamwidth']) * dr, "20151207", "120000",
+                      quantity, gain, offset, undetect, nodata, data.tolist()))
+    return dumps
+
+
+## Writes a synthetic Rainbow 5 file of one moment, with a slice per elevation angle. Each slice
+#  has a (compressed) blob of start angles, an uncompressed one of stop angles, and a blob
+#  of (rays, bins) data. Rays start at a random azimuth, and the slice parameters are only
+#  given where they differ from the previous slice, as Rainbow 5 does.
+#  @param string output file name
+#  @param string Rainbow data type, one of RANGES
+#  @param int number of slices
+#  @param int number of rays
+#  @param int number of bins
+#  @param boolean whether to compress the start angles and data. If not, the first ray of
+#  each slice's data starts with the text of a BLOB tag.
+#  @param int index in ELANGLES of the elevation angle of the first slice
+#  @returns dictionary of the start angle, stop angle and data arrays keyed by blob ID
+def writeRainbow(fstr, rbtype, nslices, nrays, nbins, compress=True, first=0):
+    rng = random.RandomState(len(rbtype) + first)
+    low, high = RANGES[rbtype]
+    xml = ['<volume version="5.34.16" datetime="2015-12-07T12:00:00" type="vol" owner="">',
+           '<scan name="vol.vol" time="12:00:00" date="2015-12-07">',
+           '<pargroup refid="sdf">', '<posele>%.1f</posele>' % ELANGLES[first], '</pargroup>']
+    blobs, data = {}, []
+    for i in range(nslices):
+        blobid = 3 * i
+        start = (arange(nrays) * 65536 // nrays + rng.randint(0, nrays) * 65536 // nrays) % 65536
+        start = roll(start.astype('>u2'), rng.randint(nrays))
+        stop = ((start.astype(int) + 65536 // nrays) % 65536).astype('>u2')
+        raw = rng.randint(0, 256, (nrays, nbins)).astype(uint8)
+        if not compress:
+            tag = BLOB_TAG % (blobid + 1, 8, "none")
+            raw[0, :len(tag)] = frombuffer(tag, uint8)
+        xml += ['<slice refid="%d">' % i, '<posangle>%.1f</posangle>' % ELANGLES[first + i]]
+        if i == 0: xml.append('<rangestep>0.25</rangestep>')
+        xml += ['<slicedata time="12:00:00" date="2015-12-07">',
+                '<rayinfo refid="startangle" blobid="%d" rays="%d" depth="16"/>' % (blobid, nrays),
+                '<rayinfo refid="stopangle" blobid="%d" rays="%d" depth="16"/>' % (blobid + 1, nrays),
+                '<rawdata blobid="%d" rays="%d" type="%s" bins="%d" min="%s" max="%s" depth="8"/>'
+                % (blobid + 2, nrays, rbtype, nbins, low, high),
+                '</slicedata>', '</slice>']
+        for j, array in enumerate((start, stop, raw)):
+            blobs[blobid + j] = array
+            data.append(makeBlob(blobid + j, array.tostring(), compress and j != 1))
+    xml += ['</scan>', '<sensorinfo type="gdrx" id="KING" name="KING_CAX01">',
+            '<lon>-79.57</lon>', '<lat>43.96</lat>', '<alt>360.0</alt>',
+            '<beamwidth>1.0</beamwidth>', '</sensorinfo>', '</volume>', ec_RB_io.END_XML_MARKER]
+    fd = open(fstr, "wb")
+    fd.write("\n".join(xml) + "\n" + "".join(data))
+    fd.close()
+    return blobs
+
+
+## BLOB tag and data, compressed as Rainbow 5 does, after the length of the uncompressed data
+def makeBlob(blobid, data, compress):
+    if compress:
+        data = struct.pack(">I", len(data)) + zlib.compress(data, 6)
+        return BLOB_TAG % (blobid, len(data), "qt") + "\n" + data + "\n</BLOB>\n"
+    return BLOB_TAG % (blobid, len(data), "none") + "\n" + data + "\n</BLOB>\n"
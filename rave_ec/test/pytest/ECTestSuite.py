@@ -26,6 +26,10 @@ Test suite for rave_ec
 import unittest, os
 
 from ECDopvolFilterTest import *
+from ECNexradTest import *
+from ECMetaTest import *
+from ECMcGillTest import *
+from ECRainbowTest import *
 
 
 if __name__ == '__main__':